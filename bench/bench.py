@@ -0,0 +1,333 @@
+"""
+    Micro-benchmarks of python side hot paths, no database needed
+    Table methods run against fake db and cursor returning synthetic rows
+
+    python bench/bench.py                          print report
+    python bench/bench.py --save bench/baseline.json
+    python bench/bench.py --baseline bench/baseline.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sql
+
+
+# ---------------------------------------------------------------------------
+# Models
+# ---------------------------------------------------------------------------
+
+class Group:
+    def __init__(self, id=None, name=None):
+        self.id = id
+        self.name = name
+
+
+class User:
+    def __init__(self, id=None, username=None, status=None, age=None, score=None,
+                 active=None, created_at=None, meta=None, tags=None, group_id=None):
+        self.id = id
+        self.username = username
+        self.status = status
+        self.age = age
+        self.score = score
+        self.active = active
+        self.created_at = created_at
+        self.meta = meta
+        self.tags = tags
+        self.group_id = group_id
+
+
+class GroupTable(sql.Table):
+    schema = 'bench'
+    name = 'groups'
+    type = Group
+    fields = {
+        'id':   {'type': 'int', 'insert': False, 'update': False},
+        'name': {},
+    }
+
+
+class UserTable(sql.Table):
+    schema = 'bench'
+    name = 'users'
+    type = User
+    fields = {
+        'id':         {'type': 'int', 'insert': False, 'update': False},
+        'username':   {},
+        'status':     {'options': ['active', 'inactive']},
+        'age':        {'type': 'int'},
+        'score':      {'type': 'float'},
+        'active':     {'type': 'bool'},
+        'created_at': {'type': 'date'},
+        'meta':       {'type': 'json'},
+        'tags':       {'array': True},
+        'group_id':   {'type': 'int'},
+    }
+    joins = {
+        'group': {'table': GroupTable, 'field': 'group_id'},
+    }
+
+
+# ---------------------------------------------------------------------------
+# Fake db returning synthetic rows
+# ---------------------------------------------------------------------------
+
+CREATED = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def synthetic(count):
+    return [(index, 'user'+str(index), 'active', 30, 1.5, True, CREATED,
+             {'en': 'name'}, ['a', 'b'], 1, 1, 'group')
+            for index in range(count)]
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.rowcount = -1
+        self.description = None
+        self.connection = None
+        self.position = 0
+
+    def execute(self, query, params=None):
+        self.rowcount = len(self.rows)
+        self.description = ()
+        self.position = 0
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        self.position += 1
+        return self.rows[self.position-1]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+class FakeDb:
+    def __init__(self, rows):
+        self.conn = FakeConn(rows)
+
+    def get(self, key=None, read=False):
+        return self.conn
+
+    def put(self, conn, key=None):
+        pass
+
+    def commit(self, conn):
+        pass
+
+    def rollback(self, conn):
+        pass
+
+    def execute(self, cursor, query, params=None):
+        return cursor.execute(query, params)
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+FILTER = {'username': 'user', 'status': 'active', 'age': [20, 30, 40], 'group_id': 1}
+SEARCH = {'username': 'jo'}
+DATA = {'username': 'john', 'status': 'active', 'age': '30', 'score': '1.5', 'active': True,
+        'created_at': '2024-01-01 12:00:00', 'meta': {'en': 'name'}, 'tags': ['a', 'b'], 'group_id': '1'}
+VALUES = {
+    'string': ('username', 'john'),
+    'int': ('age', '30'),
+    'float': ('score', '1.5'),
+    'bool': ('active', 1),
+    'date': ('created_at', '2024-01-01 12:00:00'),
+    'json': ('meta', {'en': 'name'}),
+    'options': ('status', 'active'),
+}
+QUERY = """SELECT users."id", users."username" FROM "bench"."users"
+           LEFT JOIN "bench"."groups" ON groups."id" = users."group_id"
+           WHERE users."username"::TEXT ILIKE %s AND users."status" = %s
+           ORDER BY users."id" DESC LIMIT %s OFFSET %s"""
+
+
+"""
+    Returns {name: (function, rows per call)}
+"""
+def benchmarks(rows=1000):
+    records = synthetic(rows)
+    row = records[0]
+    join = sql.Join(UserTable)
+    join.row.data(row)
+    UserTable.db = FakeDb(records)
+
+    def join_create(rows):
+        def run():
+            join.row.data(row)
+            join.create(rows)
+        return run
+
+    def value(field, data):
+        return lambda: UserTable.value(field, data)
+
+    result = {
+        'Table.where': (lambda: UserTable.where(FILTER), 0),
+        'Table.parse': (lambda: UserTable.parse(DATA, 'insert'), 0),
+        'Table.create': (lambda: UserTable.create(row), 1),
+        'Join.__init__': (lambda: sql.Join(UserTable), 0),
+        'Join.__init__.filter': (lambda: sql.Join(UserTable, FILTER, SEARCH), 0),
+        'Row.get': (lambda: join.row.get('users'), 0),
+        'sql.debug': (lambda: sql.debug(QUERY, ['%jo%', 'active', 100, 0]), 0),
+        'Table.all': (UserTable.all, rows),
+    }
+    for rows_ in sql.ROWS:
+        result['Join.create.'+rows_] = (join_create(rows_), 1)
+    for type, (field, data) in VALUES.items():
+        result['Table.value.'+type] = (value(field, data), 0)
+    return result
+
+
+"""
+    Returns best time in seconds of one call of function, calls
+    are looped until a batch takes at least seconds
+"""
+def measure(function, seconds=0.2, repeat=5):
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter()-started
+        if elapsed >= seconds:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(seconds/elapsed)+1))
+    best = elapsed
+    for _ in range(repeat-1):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter()-started)
+    return best/number
+
+
+"""
+    Returns traced bytes per row hydrated by Join.create per rows mode
+"""
+def memory(count=10000):
+    records = synthetic(count)
+    result = {}
+    for rows in sql.ROWS:
+        join = sql.Join(UserTable)
+        join.row.data(records[0])
+        join.create(rows)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            items = []
+            for row in records:
+                join.row.data(row)
+                items.append(join.create(rows))
+            result[rows] = (tracemalloc.get_traced_memory()[0]-before)/count
+        finally:
+            tracemalloc.stop()
+        del items
+    return result
+
+
+"""
+    Returns report of all benchmarks, sql.debug measured with
+    debug logging disabled as it runs in production
+"""
+def run(seconds=0.2, repeat=5, rows=1000, count=10000):
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    db = UserTable.db
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'benchmarks': {},
+              'memory': {}}
+    try:
+        for name, (function, per) in benchmarks(rows).items():
+            call = measure(function, seconds, repeat)
+            item = {'ns_per_call': round(call*1e9, 1)}
+            if per:
+                item['ns_per_row'] = round(call*1e9/per, 1)
+            report['benchmarks'][name] = item
+    finally:
+        UserTable.db = db
+        logging.getLogger().setLevel(level)
+    for rows, size in memory(count).items():
+        report['memory']['bytes_per_row.'+rows] = round(size, 1)
+    return report
+
+
+"""
+    Returns list of (name, metric, baseline, current) where current
+    exceeds baseline by more than tolerance
+"""
+def compare(report, baseline, tolerance=0.25):
+    regressions = []
+    for name, item in sorted(report['benchmarks'].items()):
+        old = baseline.get('benchmarks', {}).get(name, {})
+        for metric, value in sorted(item.items()):
+            if metric in old and value > old[metric]*(1+tolerance):
+                regressions.append((name, metric, old[metric], value))
+    for name, value in sorted(report['memory'].items()):
+        old = baseline.get('memory', {}).get(name)
+        if old is not None and value > old*(1+tolerance):
+            regressions.append((name, 'bytes', old, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of sql hot paths')
+    parser.add_argument('--seconds', type=float, default=0.2, help='minimum batch time per benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='batches per benchmark, best is reported')
+    parser.add_argument('--save', help='write JSON report to path')
+    parser.add_argument('--baseline', help='compare with JSON report at path')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over baseline')
+    args = parser.parse_args(argv)
+
+    report = run(args.seconds, args.repeat)
+    for name, item in sorted(report['benchmarks'].items()):
+        line = '%-28s %12.1f ns/call' % (name, item['ns_per_call'])
+        if 'ns_per_row' in item:
+            line += ' %10.1f ns/row' % item['ns_per_row']
+        print(line)
+    for name, value in sorted(report['memory'].items()):
+        print('%-28s %12.1f bytes' % (name, value))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print('REGRESSION %s %s %.1f -> %.1f (+%.0f%%)' % (name, metric, old, new, (new/old-1)*100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,5 +12,9 @@ setup(name='postgresql-orm',
       packages=["sql"],
       url='https://github.com/hazardland/sql.py',
       python_requires='>=3.6',
-      install_requires=['python_dateutil']
+      install_requires=['python_dateutil'],
+      extras_require={
+          'async': ['psycopg[binary]', 'psycopg_pool'],
+          'numpy': ['numpy'],
+      }
      )
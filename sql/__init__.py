@@ -2,19 +2,65 @@ import sys
 import os
 import sys
 import inspect
+import keyword
 import json
 import logging as log
 from functools import wraps
 from dateutil.parser import parse as parse_date
 import re
+import time
+import base64
+import pickle
+import threading
+import weakref
+import itertools
+import contextvars
+import bisect
+import urllib.parse
+import difflib
+from collections import OrderedDict, namedtuple, deque
 
 db = None
+adb = None
+# Metrics() measures Table operations and sql.query
+metrics = None
+# Tracer() observes statements executed by Table operations and sql.query
+tracer = None
+# SlowLog() captures slow all and filter queries with their plans
+slowlog = None
 
 if sys.platform.lower() == "win32":
     os.system('color')
 
 ESCAPE = '"'
 
+ROWS = ('object', 'tuple', 'dict', 'namedtuple')
+
+# numpy dtype and NULL fill value per field type for Table.columns
+COLUMN_TYPES = {
+    'int': ('int64', 0),
+    'float': ('float64', float('nan')),
+    'bool': ('bool', False),
+    'date': ('datetime64[us]', 'NaT'),
+}
+
+CURSORS = itertools.count(1)
+# log 1 in LOG_SAMPLE queries when DEBUG logging is enabled
+LOG_SAMPLE = 1
+QUERIES = itertools.count()
+# write generation per table, part of query result cache keys
+GENERATIONS = {}
+SAVEPOINTS = itertools.count(1)
+# bind parameters PostgreSQL accepts in one prepared statement
+PARAMS = 65535
+
+# histogram bucket upper bounds in seconds of Metrics
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Timing of operation running in current thread or task
+TIMING = contextvars.ContextVar('timing', default=None)
+# trace id of current request, set by application, tagged on spans and sql
+TRACE = contextvars.ContextVar('trace', default=None)
+
 class color():
     black = lambda x: '\033[30m' + str(x)+'\033[0;39m'
     red = lambda x: '\033[31m' + str(x)+'\033[0;39m'
@@ -77,13 +123,18 @@ class InvalidFloat(InvalidValue):
     def __init__(self, message=None, field=None):
         super().__init__(message=message, field=field)
 
+class PoolTimeout(Error):
+    def __init__(self, message=None):
+        super().__init__('pool_timeout', message=message)
+
 class Clause:
-    def __init__(self, fields, values, pattern='{name}', separator=', ', empty=''):
+    def __init__(self, fields, values, pattern='{name}', separator=', ', empty='', shape=None):
         self.__fields = fields
         self.__values = values
         self.__pattern = pattern
         self.__separator = separator
         self.__empty = empty
+        self.__shape = shape if shape is not None else fields
     def fields(self, pattern=None):
         if pattern is None and self.__pattern is not None:
             pattern = self.__pattern
@@ -96,6 +147,781 @@ class Clause:
         return self.__values
     def exctract(self):
         return self.__fields, self.__values
+    """
+        Returns hashable key describing generated sql text
+        but not bound values, used by Statements cache
+    """
+    def shape(self):
+        return (self.__separator, tuple(self.__shape))
+
+"""
+    Fields config of table, adding, replacing or removing a field in
+    place recompiles the table, changes inside a field config need
+    Table.compile()
+"""
+class Fields(dict):
+    def __init__(self, fields, table):
+        super().__init__(fields)
+        self.table = weakref.ref(table)
+    def changed(self):
+        table = self.table()
+        if table is not None:
+            table.compile()
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.changed()
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self.changed()
+        return result
+    def pop(self, *args):
+        result = super().pop(*args)
+        self.changed()
+        return result
+    def popitem(self):
+        result = super().popitem()
+        self.changed()
+        return result
+    def clear(self):
+        super().clear()
+        self.changed()
+
+"""
+    Cache of generated sql text keyed by operation and query shape
+"""
+class Statements:
+    def __init__(self, size=1024):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.items = {}
+        self.lock = threading.Lock()
+    def get(self, key):
+        with self.lock:
+            query = self.items.get(key)
+            if query is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return query
+    def set(self, key, query):
+        with self.lock:
+            if key not in self.items and len(self.items) >= self.size:
+                del self.items[next(iter(self.items))]
+            self.items[key] = query
+        return query
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+"""
+    Bounded cache of filter totals expiring after ttl seconds
+"""
+class Totals:
+    def __init__(self, size=1024):
+        self.size = size
+        self.items = {}
+        self.lock = threading.Lock()
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.items[key]
+                return None
+        return item[1]
+    def set(self, key, total, ttl):
+        with self.lock:
+            if key not in self.items and len(self.items) >= self.size:
+                del self.items[next(iter(self.items))]
+            self.items[key] = (time.monotonic()+ttl, total)
+        return total
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+"""
+    In-process store of query result cache, least recently used
+    entries are evicted when values exceed size bytes
+"""
+class Results:
+    def __init__(self, size=64*1024*1024):
+        self.size = size
+        self.used = 0
+        self.evictions = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.items[key]
+                self.used -= len(item[1])
+                return None
+            self.items.move_to_end(key)
+            return item[1]
+    def set(self, key, value, ttl):
+        if len(value) > self.size:
+            return
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is not None:
+                self.used -= len(item[1])
+            self.items[key] = (time.monotonic()+ttl, value)
+            self.used += len(value)
+            while self.used > self.size:
+                _, item = self.items.popitem(last=False)
+                self.used -= len(item[1])
+                self.evictions += 1
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.used = 0
+            self.evictions = 0
+
+"""
+    Query result cache of Table reads, enabled per table with
+    cache = Cache(). Fetched rows are kept pickled under sql text,
+    params and write generation of every table in the query, so
+    add, save and delete of a table or of a joined table make
+    older entries unreachable
+    store: object with get(key), set(key, value, ttl) and clear()
+    keeping bytes values, default is in-process Results(size)
+    Write generations are process local, a store shared between
+    processes is not invalidated by writes of other processes and
+    serves their stale rows until ttl
+"""
+class Cache:
+    def __init__(self, size=64*1024*1024, ttl=60, store=None):
+        self.store = store if store is not None else Results(size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    def key(self, tables, query, values):
+        return (query, repr(values), tuple(GENERATIONS.get(table, 0) for table in tables))
+    def get(self, key):
+        value = self.store.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            return None
+        return pickle.loads(value)
+    def set(self, key, records):
+        self.store.set(key, pickle.dumps(records, pickle.HIGHEST_PROTOCOL), self.ttl)
+    def clear(self):
+        self.store.clear()
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': getattr(self.store, 'evictions', None),
+                'bytes': getattr(self.store, 'used', None)}
+
+"""
+    Bounded least recently used cache of selected rows by primary
+    key for Table.get, enabled per table with entities = Entities()
+    Rows are kept pickled with write generations of joined tables
+    and miss once a joined table is written. Fills of selected rows
+    and writes pass version() taken before their sql, a fill is
+    skipped and a write evicts when the key was written since
+"""
+class Entities:
+    def __init__(self, size=10000):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        # number of last write per key, at most size keys are kept
+        self.written = OrderedDict()
+        # number of last write forgotten from written
+        self.floor = 0
+    def get(self, key, generations):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[0] != generations:
+                del self.items[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(item[1])
+    def version(self):
+        return self.writes
+    def set(self, key, generations, row, version=None, write=True):
+        value = pickle.dumps(row, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            stale = version is not None and version < max(self.written.get(key, 0), self.floor)
+            if write:
+                self.write(key)
+            if stale:
+                if write:
+                    self.items.pop(key, None)
+                return
+            self.items[key] = (generations, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+    def evict(self, key):
+        with self.lock:
+            self.write(key)
+            self.items.pop(key, None)
+    def write(self, key):
+        self.writes += 1
+        self.written[key] = self.writes
+        self.written.move_to_end(key)
+        while len(self.written) > self.size:
+            _, self.floor = self.written.popitem(last=False)
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+"""
+    Registry of operation counters and latency histograms per
+    table, operation and phase, enabled with sql.metrics = Metrics()
+    Phases are build (sql and params), wait (pool checkout and
+    return), execute (statements and commit), fetch (rows from
+    cursor), hydrate (objects from rows) and total
+"""
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # (table, operation): [calls, errors]
+        self.calls = {}
+        # (table, operation, phase): [count per bucket..., count over last bucket, sum]
+        self.histograms = {}
+
+    def record(self, table, operation, phases, total, error=False):
+        with self.lock:
+            calls = self.calls.get((table, operation))
+            if calls is None:
+                calls = self.calls[(table, operation)] = [0, 0]
+            calls[0] += 1
+            if error:
+                calls[1] += 1
+            for phase, seconds in phases.items():
+                self.observe((table, operation, phase), seconds)
+            self.observe((table, operation, 'total'), total)
+
+    def observe(self, key, seconds):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets)+1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def clear(self):
+        with self.lock:
+            self.calls.clear()
+            self.histograms.clear()
+
+    """
+        Returns list of {table, operation, calls, errors, phases} where
+        phases maps phase to {count, sum, buckets} and buckets holds
+        cumulative counts per upper bound, last bound is inf
+    """
+    def snapshot(self):
+        with self.lock:
+            calls = {key: list(value) for key, value in self.calls.items()}
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+        result = []
+        for (table, operation), (count, errors) in sorted(calls.items()):
+            phases = {}
+            for (table_, operation_, phase), histogram in histograms.items():
+                if table_ != table or operation_ != operation:
+                    continue
+                buckets = {}
+                total = 0
+                for bound, value in zip(self.buckets+(float('inf'),), histogram):
+                    total += value
+                    buckets[bound] = total
+                phases[phase] = {'count': total, 'sum': histogram[-1], 'buckets': buckets}
+            result.append({'table': table,
+                           'operation': operation,
+                           'calls': count,
+                           'errors': errors,
+                           'phases': phases})
+        return result
+
+    """
+        Returns metrics in prometheus text exposition format
+    """
+    def prometheus(self, prefix='sql'):
+        def labels(**values):
+            return '{'+','.join(name+'="'+str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')+'"'
+                                for name, value in values.items())+'}'
+        lines = ['# HELP '+prefix+'_operations_total Table operations',
+                 '# TYPE '+prefix+'_operations_total counter']
+        snapshot = self.snapshot()
+        for item in snapshot:
+            lines.append(prefix+'_operations_total'+labels(table=item['table'], operation=item['operation'])+' '+str(item['calls']))
+        lines += ['# HELP '+prefix+'_operation_errors_total Table operations raising exception',
+                  '# TYPE '+prefix+'_operation_errors_total counter']
+        for item in snapshot:
+            lines.append(prefix+'_operation_errors_total'+labels(table=item['table'], operation=item['operation'])+' '+str(item['errors']))
+        lines += ['# HELP '+prefix+'_phase_seconds Table operation latency per phase',
+                  '# TYPE '+prefix+'_phase_seconds histogram']
+        for item in snapshot:
+            for phase, histogram in sorted(item['phases'].items()):
+                for bound, count in histogram['buckets'].items():
+                    lines.append(prefix+'_phase_seconds_bucket'+labels(table=item['table'], operation=item['operation'], phase=phase, le='+Inf' if bound == float('inf') else repr(float(bound)))+' '+str(count))
+                key = labels(table=item['table'], operation=item['operation'], phase=phase)
+                lines.append(prefix+'_phase_seconds_sum'+key+' '+repr(histogram['sum']))
+                lines.append(prefix+'_phase_seconds_count'+key+' '+str(histogram['count']))
+        return '\n'.join(lines)+'\n'
+
+"""
+    Time of one operation split into phases by mark, time
+    since previous mark is added to phase
+"""
+class Timing:
+    def __init__(self, metrics, table, operation):
+        self.metrics = metrics
+        self.table = table
+        self.operation = operation
+        self.phases = {}
+        self.token = None
+        self.started = None
+        self.last = None
+
+    def __enter__(self):
+        self.started = self.last = time.perf_counter()
+        self.token = TIMING.set(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        TIMING.reset(self.token)
+        if self.metrics is not None:
+            self.mark('hydrate')
+            self.metrics.record(self.table, self.operation, self.phases, self.last-self.started, type is not None)
+        return False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0)+now-self.last
+        self.last = now
+
+"""
+    Adds time since previous mark to phase of current operation
+"""
+def mark(phase):
+    timing = TIMING.get()
+    if timing is not None:
+        timing.mark(phase)
+
+"""
+    Decorates Table method, or query function with table=False,
+    measured as operation in sql.metrics and named operation
+    on spans of sql.tracer when they are set
+"""
+def measured(operation, table=True):
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                if metrics is None and tracer is None:
+                    return await function(*args, **kwargs)
+                with Timing(metrics, label(args[0]) if table else '', operation):
+                    return await function(*args, **kwargs)
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if metrics is None and tracer is None:
+                    return function(*args, **kwargs)
+                with Timing(metrics, label(args[0]) if table else '', operation):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+"""
+    Returns schema.name of table
+"""
+def label(table):
+    if table.schema:
+        return table.schema+'.'+str(table.name)
+    return str(table.name)
+
+"""
+    Observes statements executed by Table operations and sql.query,
+    enabled with sql.tracer = Tracer(), subclasses override
+    before(span) and after(span) hooks
+    comment: appends sqlcommenter style comment with table,
+    operation, caller and trace id to executed sql, sql text cache
+    and prepared statements keep sql without comment
+"""
+class Tracer:
+    def __init__(self, comment=False):
+        self.comment = comment
+
+    def before(self, span):
+        pass
+
+    def after(self, span):
+        pass
+
+    def start(self, query, params):
+        timing = TIMING.get()
+        span = Span(query, params)
+        if timing is not None:
+            span.table = timing.table
+            span.operation = timing.operation
+        span.caller = caller()
+        span.trace = TRACE.get()
+        self.before(span)
+        span.started = time.perf_counter()
+        return span
+
+    def finish(self, span, rowcount, error):
+        span.duration = time.perf_counter()-span.started
+        span.rowcount = rowcount
+        span.error = error
+        self.after(span)
+
+"""
+    In-process Tracer keeping last size finished spans
+"""
+class Spans(Tracer):
+    def __init__(self, size=1000, comment=False):
+        super().__init__(comment)
+        self.spans = deque(maxlen=size)
+
+    def after(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans.clear()
+
+class Span:
+    def __init__(self, query, params):
+        self.query = query
+        self.params = params
+        self.table = ''
+        self.operation = ''
+        self.caller = None
+        self.trace = None
+        self.started = None
+        self.duration = None
+        self.rowcount = None
+        self.error = None
+
+    """
+        Returns sqlcommenter style comment of span, without trace id
+        when stable is set, empty when tracer does not comment
+    """
+    def comment(self, stable=False):
+        tags = {'caller': self.caller,
+                'operation': self.operation,
+                'table': self.table,
+                'trace_id': None if stable else self.trace}
+        tags = [urllib.parse.quote(key, safe='')+"='"+urllib.parse.quote(str(value), safe='')+"'"
+                for key, value in sorted(tags.items()) if value]
+        if not tags:
+            return ''
+        return ' /*'+','.join(tags)+'*/'
+
+"""
+    Bounded ring of all and filter queries running threshold seconds
+    or longer, enabled with sql.slowlog = SlowLog(). Each record holds
+    table, sql, params, duration and plan of query re-run with
+    EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), at most one EXPLAIN
+    runs per interval seconds, later records have plan None
+    redact: params are recorded as '?'
+"""
+class SlowLog:
+    def __init__(self, threshold=1.0, size=100, interval=60, redact=False):
+        self.threshold = threshold
+        self.interval = interval
+        self.redact = redact
+        self.items = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.explained = None
+
+    """
+        Returns True when EXPLAIN may run now
+    """
+    def due(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.explained is not None and now-self.explained < self.interval:
+                return False
+            self.explained = now
+            return True
+
+    def record(self, table, query, params, duration, plan=None, error=None):
+        if self.redact and params is not None:
+            params = ['?' for _ in params]
+        self.items.append({'time': time.time(),
+                           'table': table,
+                           'sql': query,
+                           'params': params,
+                           'duration': duration,
+                           'plan': plan,
+                           'error': error})
+
+    """
+        Returns recorded queries oldest first, JSON written to
+        path when given
+    """
+    def dump(self, path=None):
+        items = list(self.items)
+        if path is not None:
+            with open(path, 'w') as file:
+                json.dump(items, file, default=str, indent=2)
+        return items
+
+    def clear(self):
+        self.items.clear()
+
+"""
+    Returns module:function of first frame outside this module
+"""
+def caller():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return frame.f_globals.get('__name__', '')+':'+frame.f_code.co_name
+
+"""
+    Returns query with comment appended, percent signs of comment
+    are escaped when driver formats query with params
+"""
+def commented(query, comment, params):
+    if not comment:
+        return query
+    if params is not None:
+        comment = comment.replace('%', '%%')
+    return query+comment
+
+class cast():
+    @staticmethod
+    def string(value, field):
+        return str(value)
+    @staticmethod
+    def int(value, field):
+        return int(value)
+    @staticmethod
+    def bool(value, field):
+        return bool(value)
+    @staticmethod
+    def json(value, field):
+        return json.dumps(value)
+    @staticmethod
+    def date(value, field):
+        try:
+            return parse_date(value)
+        except Exception:
+            raise InvalidDate('Invalid date '+value+' for field'+field, field)
+    @staticmethod
+    def float(value, field):
+        try:
+            return float(value)
+        except Exception:
+            raise InvalidFloat('Invalid float '+value+' for field'+field, field)
+
+"""
+    Parses postgresql array literal returned as string
+"""
+def parse_array(value):
+    if isinstance(value, list):
+        return value
+    if value == '{}':
+        return []
+    return value[1:-1].split(',')
+
+"""
+    Compiled form of a single field config, resolved once per table
+"""
+class Field:
+    def __init__(self, table, name, config):
+        self.name = name
+        self.config = config
+        self.type = config['type'] if 'type' in config else 'string'
+        self.array = bool(config['array']) if 'array' in config else False
+        self.options = config['options'] if 'options' in config else None
+        self.encoder = config['encoder'] if 'encoder' in config else None
+        self.decoder = config['decoder'] if 'decoder' in config else None
+        self.keys = config['keys'] if 'keys' in config else None
+        self.select = config['select'] if 'select' in config else True
+        self.insert = config['insert'] if 'insert' in config else True
+        self.update = config['update'] if 'update' in config else True
+        self.cast = getattr(cast, self.type, None)
+        self.json = self.type == 'json'
+        self.numeric = self.type in ('int', 'date', 'float')
+
+        self.column = config['field'] if 'field' in config else name
+        self.escaped = ESCAPE+self.column+ESCAPE
+        # table."column" as used in select, where and order clauses
+        self.reference = str(table.name)+'.'+self.escaped
+        # "table"."column" as returned by Table('field')
+        self.qualified = ESCAPE+str(table.name)+ESCAPE+'.'+self.escaped
+        # range criteria for {'from':..., 'to':...} filters
+        self.start = self.reference+'>=%s'
+        self.end = self.reference+'<=%s'
+
+        self.like = False
+        if self.array:
+            self.criteria = '%s = ANY('+self.reference+')'
+        elif self.json:
+            self.like = True
+            self.criteria = self.reference+'::TEXT ILIKE %s'
+        elif self.options is not None or self.type == 'bool' or self.numeric:
+            self.criteria = self.reference+'=%s'
+        else:
+            self.like = True
+            self.criteria = self.reference+'::TEXT ILIKE %s'
+
+    def value(self, value):
+        if value is None:
+            return None
+
+        # type casting
+        if self.cast is not None:
+            value = self.cast(value, self.name)
+
+        # checking for options
+        if self.options is not None:
+            if value not in self.options:
+                raise InvalidValue('Invalid value '+value+' for field '+self.name, self.name)
+
+        # encoding
+        if self.encoder is not None:
+            value = self.encoder(value)
+
+        return str(value)
+
+    """
+        Returns value formatted for writing, arrays are
+        formatted as postgresql array literal
+    """
+    def format(self, value):
+        if self.array:
+            if value is not None:
+                if not isinstance(value, list) and not isinstance(value, tuple):
+                    raise InvalidValue('Value of '+self.name+' must be instance of list '+str(type(value))+' given', self.name)
+                value = '{'+(','.join([self.value(parse) for parse in value]))+'}'
+            return value
+        return self.value(value)
+
+"""
+    Per table plan compiled by MetaTable when class is defined
+    or when its fields, name or schema are reassigned
+"""
+class Plan:
+    def __init__(self, table):
+        self.table = ''
+        if table.schema:
+            self.table += ESCAPE+table.schema+ESCAPE+'.'
+        self.table += ESCAPE+str(table.name)+ESCAPE
+        self.fields = {}
+        for name, config in table.fields.items():
+            self.fields[name] = Field(table, name, config)
+        self.modes = {}
+        for mode in ('select', 'insert', 'update'):
+            self.modes[mode] = tuple(field for field in self.fields.values() if getattr(field, mode))
+        self.select = self.modes['select']
+        self.columns = ', '.join(field.reference for field in self.select)
+        self.offset = len(self.select)
+        # position of primary key in selected row
+        self.key = next((position for position, field in enumerate(self.select) if field.name == table.id), None)
+        self.hydrators = {}
+
+    """
+        Returns function converting selected row tuple into object
+        of type, generated once per type and cached
+        init=False skips type.__init__ and fills __dict__ directly
+        rows='tuple'|'dict'|'namedtuple' returns raw rows instead,
+        hydrate(data, joined) then appends joined rows under joins names
+    """
+    def hydrator(self, type, init=True, rows='object', joins=()):
+        key = (type, init) if rows == 'object' else (rows, joins)
+        hydrate = self.hydrators.get(key)
+        if hydrate is None:
+            hydrate = self.hydrators[key] = self.generate(type, init, rows, joins)
+        return hydrate
+
+    def generate(self, type, init=True, rows='object', joins=()):
+        scope = {'type': type, 'loads': json.loads, 'array': parse_array}
+        lines = []
+        values = []
+        for position, field in enumerate(self.select):
+            value = 'data['+str(position)+']'
+            if field.decoder is not None:
+                scope['decoder'+str(position)] = field.decoder
+            if field.array:
+                lines.append(f'value{position} = {value}')
+                if field.decoder is not None:
+                    lines.append(f'value{position} = decoder{position}(value{position}) if value{position} is None else array(value{position})')
+                else:
+                    lines.append(f'if value{position} is not None: value{position} = array(value{position})')
+                value = 'value'+str(position)
+            elif field.decoder is not None:
+                value = f'decoder{position}({value})'
+            elif field.json:
+                lines.append(f'value{position} = {value}')
+                lines.append(f'if isinstance(value{position}, str): value{position} = loads(value{position})')
+                value = 'value'+str(position)
+            values.append((field.name, value))
+
+        if rows == 'tuple':
+            lines.append('return ('+''.join(value+', ' for name, value in values)+') + joined')
+        elif rows == 'namedtuple':
+            scope['row'] = namedtuple('Row', [name for name, value in values]+list(joins), rename=True)
+            lines.append('return row('+''.join(value+', ' for name, value in values)+'*joined)')
+        elif rows == 'dict':
+            lines.append('item = {'+', '.join(f'{name!r}: {value}' for name, value in values)+'}')
+            for position, name in enumerate(joins):
+                lines.append(f'item[{name!r}] = joined[{position}]')
+            lines.append('return item')
+        elif init:
+            try:
+                arguments = inspect.getfullargspec(type).args
+            except TypeError:
+                arguments = []
+            arguments = [argument for argument in arguments if argument != 'self']
+            lines.append('item = type('+', '.join(f'{name}={value}' for name, value in values if name in arguments)+')')
+            for name, value in values:
+                if name in arguments:
+                    continue
+                if name.isidentifier() and not keyword.iskeyword(name):
+                    lines.append(f'item.{name} = {value}')
+                else:
+                    lines.append(f'setattr(item, {name!r}, {value})')
+        else:
+            lines.append('item = type.__new__(type)')
+            lines.append('item.__dict__.update({'+', '.join(f'{name!r}: {value}' for name, value in values)+'})')
+        if rows == 'object':
+            lines.append('return item')
+
+        source = 'def hydrate(data, joined=()):\n    '+'\n    '.join(lines)
+        exec(source, scope)
+        hydrate = scope['hydrate']
+        hydrate.source = source
+        return hydrate
 
 '''
 FIELD OPTIONS
@@ -119,29 +945,441 @@ FIELD OPTIONS
     }
 '''
 
+"""
+    Connection pool with the getconn/putconn interface of psycopg2 pools
+    Callers wait in FIFO order up to timeout seconds when all size
+    connections are in use, then PoolTimeout is raised, timeout None
+    waits without limit, idle connections are reused last in first
+    out, connections older than max_age seconds or used max_uses times
+    are closed on return, connections idle longer than check seconds
+    are tested with SELECT 1 on borrow
+"""
+class Pool:
+    # upper bounds in seconds of wait time histogram buckets
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float('inf'))
+
+    def __init__(self, config, size=20, timeout=30, max_age=None, max_uses=None, check=1):
+        import psycopg2
+        import psycopg2.pool
+        import psycopg2.extensions
+        self.connect = psycopg2.connect
+        self.error = psycopg2.pool.PoolError
+        self.extensions = psycopg2.extensions
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.check = check
+        self.lock = threading.Lock()
+        # stack of (conn, returned at)
+        self.idle = []
+        # [event, conn or True to open new] per waiting caller
+        self.waiting = deque()
+        # conn -> [created at, uses]
+        self.used = {}
+        self.keys = {}
+        self.closed = False
+        self.counters = {'waits': 0, 'timeouts': 0, 'created': 0, 'recycled': 0, 'failed_checks': 0}
+        self.histogram = [0] * len(self.buckets)
+        self.opened = 1
+        self.idle.append((self.open(), time.monotonic()))
+
+    def getconn(self, key=None):
+        start = time.monotonic()
+        waiter = None
+        conn = None
+        with self.lock:
+            if self.closed:
+                raise self.error('connection pool is closed')
+            if key is not None and key in self.keys:
+                return self.keys[key]
+            if self.idle:
+                idle = self.idle.pop()
+            elif self.opened < self.size:
+                self.opened += 1
+                conn = True
+            else:
+                waiter = [threading.Event(), None]
+                self.waiting.append(waiter)
+                self.counters['waits'] += 1
+
+        if waiter is not None:
+            waiter[0].wait(self.timeout)
+            with self.lock:
+                conn = waiter[1]
+                if conn is None:
+                    self.waiting.remove(waiter)
+                    self.counters['timeouts'] += 1
+                    self.measure(time.monotonic()-start)
+                    raise PoolTimeout('No connection available in '+str(self.timeout)+' seconds')
+        elif conn is None:
+            conn = self.borrow(*idle)
+        if conn is True:
+            conn = self.open()
+
+        with self.lock:
+            self.used[conn][1] += 1
+            if key is not None:
+                self.keys[key] = conn
+            self.measure(time.monotonic()-start)
+        return conn
+
+    def putconn(self, conn, key=None, close=False):
+        with self.lock:
+            if key is not None:
+                self.keys.pop(key, None)
+            else:
+                for name, keyed in list(self.keys.items()):
+                    if keyed is conn:
+                        del self.keys[name]
+            if conn not in self.used:
+                raise self.error('trying to put unkeyed connection')
+            created, uses = self.used[conn]
+
+        if not conn.closed and not close:
+            status = conn.info.transaction_status
+            if status == self.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != self.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        if not close and ((self.max_age is not None and time.monotonic()-created >= self.max_age) or (self.max_uses is not None and uses >= self.max_uses)):
+            with self.lock:
+                self.counters['recycled'] += 1
+            close = True
+
+        if close or conn.closed or self.closed:
+            self.discard(conn)
+            return
+
+        with self.lock:
+            if self.waiting:
+                waiter = self.waiting.popleft()
+                waiter[1] = conn
+                waiter[0].set()
+            else:
+                self.idle.append((conn, time.monotonic()))
+
+    def closeall(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn, returned in idle:
+            self.discard(conn)
+
+    """
+        Returns {size, opened, in_use, idle, waiters, waits, timeouts,
+        created, recycled, failed_checks, wait} where wait maps bucket
+        upper bound in seconds to number of getconn calls
+    """
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['size'] = self.size
+            stats['opened'] = self.opened
+            stats['idle'] = len(self.idle)
+            stats['in_use'] = self.opened-len(self.idle)
+            stats['waiters'] = len(self.waiting)
+            stats['wait'] = dict(zip(self.buckets, self.histogram))
+        return stats
+
+    def measure(self, seconds):
+        for position, bucket in enumerate(self.buckets):
+            if seconds <= bucket:
+                self.histogram[position] += 1
+                return
+
+    """
+        Returns idle conn when still usable or True to open new one
+    """
+    def borrow(self, conn, returned):
+        created = self.used[conn][0]
+        if conn.closed or (self.max_age is not None and time.monotonic()-created >= self.max_age):
+            self.discard(conn, True)
+            return True
+        if self.check is not None and time.monotonic()-returned >= self.check:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1')
+                conn.rollback()
+            except Exception as error:
+                log.warning(color.yellow('Pooled connection failed check: %s'), error)
+                with self.lock:
+                    self.counters['failed_checks'] += 1
+                self.discard(conn, True)
+                return True
+        return conn
+
+    def open(self):
+        try:
+            conn = self.connect(self.config)
+        except Exception:
+            self.release()
+            raise
+        with self.lock:
+            self.used[conn] = [time.monotonic(), 0]
+            self.counters['created'] += 1
+        return conn
+
+    """
+        Closes conn, keep=True keeps its slot for the caller
+    """
+    def discard(self, conn, keep=False):
+        with self.lock:
+            self.used.pop(conn, None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        if not keep:
+            self.release()
+
+    """
+        Frees a connection slot, first waiter may open new connection
+    """
+    def release(self):
+        with self.lock:
+            if self.waiting and not self.closed:
+                waiter = self.waiting.popleft()
+                waiter[1] = True
+                waiter[0].set()
+            else:
+                self.opened -= 1
+
 class Db:
-    def __init__(self, config, size=20):
+    """
+        prepare: number of server side prepared statements kept per
+        pooled connection for Table generated queries, 0 disables
+        (use 0 behind PgBouncer in transaction mode)
+        primary, replicas: config of primary and list of replica configs,
+        get(read=True) connections come from replicas, others from primary
+        balance: 'round-robin' or 'least-connections' choice of replica
+        sticky: seconds reads stay on primary after a write made in the
+        same thread or task
+        lsn: seconds a replica read waits for the replica to replay the
+        last write of the same thread or task before falling back to
+        primary, 0 disables
+        pool: None uses psycopg2 ThreadedConnectionPool, dict of
+        timeout, max_age, max_uses and check options uses Pool
+    """
+    def __init__(self, config=None, size=20, prepare=0, primary=None, replicas=None, balance='round-robin', sticky=0, lsn=0, pool=None):
+        if primary is not None:
+            config = primary
+        if config is None:
+            raise MissingConfig()
+        if balance not in ('round-robin', 'least-connections'):
+            raise InvalidValue('Invalid balance '+str(balance))
         self.pool = None
         self.config = config
         self.size = size
+        self.prepare = prepare
+        self.options = pool
+        self.prepared = weakref.WeakKeyDictionary()
+        self.sequence = itertools.count(1)
+        self.lock = threading.Lock()
         if Table.db is None:
             Table.db = self
 
-    def get(self, key=None):
+        self.replicas = [Db(replica, size, prepare, pool=pool) for replica in replicas or []]
+        self.balance = balance
+        self.sticky = sticky
+        self.lsn = lsn
+        self.using = {replica: 0 for replica in self.replicas}
+        self.borrowed = weakref.WeakKeyDictionary()
+        self.turn = itertools.count()
+        # (time, lsn, replicas which replayed lsn) of last write
+        self.written = contextvars.ContextVar('written', default=None)
+        # Transaction of current thread or task
+        self.scope = contextvars.ContextVar('scope', default=None)
+
+    def get(self, key=None, read=False):
+        mark('build')
+        scope = self.scope.get()
+        if scope is not None:
+            return scope.conn
+        if read and self.replicas:
+            conn = self.replica(key)
+            if conn is not None:
+                mark('wait')
+                return conn
         if self.pool is None:
             self.init()
         conn = self.pool.getconn(key)
+        if read and self.replicas:
+            # read on primary is not a write
+            self.borrowed[conn] = self
         log.debug(color.yellow('Using db connection at address %s'), id(conn))
+        mark('wait')
         return conn
 
     def put(self, conn, key=None):
+        scope = self.scope.get()
+        if scope is not None and scope.conn is conn:
+            return
         log.debug(color.yellow('Releasing db connection at address %s'), id(conn))
-        self.pool.putconn(conn, key=key)
+        if conn.closed:
+            # pool will replace closed connection, its statements are gone
+            with self.lock:
+                self.prepared.pop(conn, None)
+        owner = self.borrowed.pop(conn, None)
+        if owner is None:
+            if self.replicas and (self.sticky or self.lsn):
+                self.wrote(conn)
+            owner = self
+        elif owner is not self:
+            with self.lock:
+                self.using[owner] -= 1
+        owner.pool.putconn(conn, key=key)
+        mark('wait')
+
+    """
+        Commits conn unless it belongs to current transaction scope
+    """
+    def commit(self, conn):
+        scope = self.scope.get()
+        if scope is None or scope.conn is not conn:
+            conn.commit()
+            mark('execute')
+
+    def rollback(self, conn):
+        scope = self.scope.get()
+        if scope is None or scope.conn is not conn:
+            conn.rollback()
+
+    """
+        Returns context manager running Table methods and sql.query
+        of current thread or task on one connection in one transaction
+        with sql.db.transaction(): ... commits once at exit and rolls
+        back on exception, nested scopes are savepoints
+        readonly: read only transaction, without isolation statements
+        run in autocommit mode without BEGIN and COMMIT round trips
+        isolation: 'READ COMMITTED', 'REPEATABLE READ' or 'SERIALIZABLE'
+    """
+    def transaction(self, readonly=False, isolation=None):
+        return Transaction(self, readonly, isolation)
+
+    """
+        Returns connection of next replica or None when reads
+        of current thread or task must go to primary
+    """
+    def replica(self, key=None):
+        written = self.written.get()
+        if written is not None:
+            if time.monotonic() < written[0]+self.sticky:
+                return None
+            if written[1] is None or len(written[2]) == len(self.replicas):
+                self.written.set(None)
+                written = None
+
+        with self.lock:
+            start = next(self.turn) % len(self.replicas)
+            replica = self.replicas[start]
+            if self.balance == 'least-connections':
+                replica = min(self.replicas[start:]+self.replicas[:start], key=self.using.get)
+            self.using[replica] += 1
+
+        try:
+            conn = replica.get(key)
+        except Exception:
+            with self.lock:
+                self.using[replica] -= 1
+            raise
+        self.borrowed[conn] = replica
+
+        if written is not None and replica not in written[2]:
+            if not self.replayed(conn, written[1]):
+                log.debug(color.yellow('Replica behind last write, reading from primary'))
+                self.put(conn, key)
+                return None
+            self.written.set((written[0], written[1], written[2] | {replica}))
+        return conn
+
+    """
+        Waits up to lsn seconds for replica connection to replay wal
+        position, a server which is not in recovery has every position
+    """
+    def replayed(self, conn, position):
+        deadline = time.monotonic()+self.lsn
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(*debug("""SELECT CASE WHEN pg_is_in_recovery()
+                                  THEN pg_last_wal_replay_lsn()
+                                  ELSE pg_current_wal_lsn() END >= %s::PG_LSN""", [position]))
+            replayed = cursor.fetchone()[0]
+            if replayed or time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+        conn.commit()
+        return bool(replayed)
+
+    """
+        Remembers time and, when lsn is set, wal position
+        of write made on primary connection
+    """
+    def wrote(self, conn):
+        position = None
+        if self.lsn and not conn.closed:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(*debug('SELECT pg_current_wal_lsn()::TEXT'))
+                position = cursor.fetchone()[0]
+                conn.commit()
+            except Exception as error:
+                log.error(error)
+                conn.rollback()
+        self.written.set((time.monotonic(), position, frozenset()))
+
+    """
+        Executes query on cursor, logged with duration and rowcount
+    """
+    def execute(self, cursor, query, params=None):
+        sampled = logged()
+        if not sampled and tracer is None:
+            result = self.run(cursor, query, params)
+            mark('execute')
+            return result
+        return observe(cursor, query, params, self.run, sampled)
+
+    """
+        Executes query on cursor, through PREPARE/EXECUTE when
+        prepare is enabled. Prepared statements are cached per
+        connection and least recently used ones are deallocated
+    """
+    def run(self, cursor, query, params=None, comment=''):
+        if not self.prepare:
+            return cursor.execute(commented(query, comment, params), params)
+
+        with self.lock:
+            statements = self.prepared.get(cursor.connection)
+            if statements is None:
+                statements = OrderedDict()
+                self.prepared[cursor.connection] = statements
+
+        name = statements.get(query)
+        if name is None:
+            name = 'sql_'+str(next(self.sequence))
+            position = itertools.count(1)
+            source = re.sub(r'%[%s]', lambda match: '%' if match.group(0) == '%%' else '$'+str(next(position)), query)
+            cursor.execute('PREPARE '+name+' AS '+source)
+            statements[query] = name
+            while len(statements) > self.prepare:
+                _, expired = statements.popitem(last=False)
+                cursor.execute('DEALLOCATE '+expired)
+        else:
+            statements.move_to_end(query)
+
+        # comment goes to EXECUTE, prepared sql stays the same
+        if params:
+            return cursor.execute(commented('EXECUTE '+name+'('+', '.join(['%s'] * len(params))+')', comment, params), params)
+        return cursor.execute(commented('EXECUTE '+name, comment, None))
 
     def init(self):
         import psycopg2.pool
         try:
-            self.pool = psycopg2.pool.ThreadedConnectionPool(1, self.size, self.config)
+            if self.options is None:
+                self.pool = psycopg2.pool.ThreadedConnectionPool(1, self.size, self.config)
+            else:
+                self.pool = Pool(self.config, self.size, **self.options)
             log.debug(color.cyan('Initialized db connection pool'))
         except psycopg2.OperationalError as e:
             log.error(e)
@@ -157,6 +1395,144 @@ class Db:
             self.put(db)
         return cursor.fetchone()[0]
 
+"""
+    Asyncio pool on psycopg 3 AsyncConnectionPool for Table.a* methods
+    and aquery, psycopg and psycopg_pool are imported on first use
+    prepare: number of prepared statements psycopg keeps per
+    connection, statements are prepared on first execution,
+    0 disables
+"""
+class AsyncDb:
+    def __init__(self, config, size=20, prepare=0):
+        self.pool = None
+        self.config = config
+        self.size = size
+        self.prepare = prepare
+        if Table.adb is None:
+            Table.adb = self
+
+    async def get(self):
+        mark('build')
+        if self.pool is None:
+            await self.init()
+        conn = await self.pool.getconn()
+        log.debug(color.yellow('Using async db connection at address %s'), id(conn))
+        mark('wait')
+        return conn
+
+    async def put(self, conn):
+        log.debug(color.yellow('Releasing async db connection at address %s'), id(conn))
+        # pool rolls back connections returned inside transaction
+        await self.pool.putconn(conn)
+        mark('wait')
+
+    async def execute(self, cursor, query, params=None):
+        sampled = logged()
+        if not sampled and tracer is None:
+            result = await cursor.execute(query, params)
+            mark('execute')
+            return result
+        span = tracer.start(query, params) if tracer is not None else None
+        started = time.perf_counter()
+        try:
+            # psycopg prepares by sql text, trace id would defeat it
+            comment = span.comment(stable=bool(self.prepare)) if span is not None and tracer.comment else ''
+            return await cursor.execute(commented(query, comment, params), params)
+        finally:
+            mark('execute')
+            if sampled:
+                emit(query, params, time.perf_counter()-started, cursor.rowcount)
+            if span is not None:
+                tracer.finish(span, cursor.rowcount, sys.exc_info()[1])
+
+    async def init(self):
+        from psycopg_pool import AsyncConnectionPool
+        if self.pool is None:
+            self.pool = AsyncConnectionPool(self.config, min_size=1, max_size=self.size, configure=self.configure, open=False)
+        await self.pool.open()
+        log.debug(color.cyan('Initialized async db connection pool'))
+
+    async def configure(self, conn):
+        if self.prepare:
+            conn.prepare_threshold = 0
+            conn.prepared_max = self.prepare
+        else:
+            conn.prepare_threshold = None
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def version(self):
+        return (await aquery('SELECT VERSION()', db=self))[0][0]
+
+class Transaction:
+    def __init__(self, db, readonly=False, isolation=None):
+        self.db = db
+        self.readonly = readonly
+        self.isolation = isolation
+        self.conn = None
+        self.savepoint = None
+        self.token = None
+        # tables written inside scope
+        self.tables = set()
+        # (table, id) of entities written inside scope
+        self.entities = set()
+
+    def __enter__(self):
+        outer = self.db.scope.get()
+        if outer is not None:
+            # nested scope shares outer connection, readonly and isolation
+            self.conn = outer.conn
+            if not self.conn.autocommit:
+                self.savepoint = 'sql_savepoint_'+str(next(SAVEPOINTS))
+                self.conn.cursor().execute(*debug('SAVEPOINT '+self.savepoint))
+            return self
+
+        self.conn = self.db.get(read=self.readonly)
+        try:
+            if self.readonly and self.isolation is None:
+                self.conn.set_session(readonly=True, autocommit=True)
+            else:
+                self.conn.set_session(isolation_level=self.isolation, readonly=True if self.readonly else None)
+        except Exception:
+            self.db.put(self.conn)
+            raise
+        self.token = self.db.scope.set(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.token is None:
+            if self.savepoint is not None:
+                cursor = self.conn.cursor()
+                if type is None:
+                    cursor.execute(*debug('RELEASE SAVEPOINT '+self.savepoint))
+                else:
+                    cursor.execute(*debug('ROLLBACK TO SAVEPOINT '+self.savepoint))
+            return False
+
+        self.db.scope.reset(self.token)
+        try:
+            if self.conn.autocommit:
+                pass
+            elif type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            try:
+                if not self.conn.closed:
+                    self.conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT', autocommit=False)
+            finally:
+                self.db.put(self.conn)
+                # reads cached by others before commit are stale too
+                for table in self.tables:
+                    table.invalidate()
+                for table, key in self.entities:
+                    table.entities.evict(key)
+        return False
+
 class MetaTable(type):
     def __repr__(cls):
         return "<Table '"+str(cls)+"'>"
@@ -171,10 +1547,21 @@ class MetaTable(type):
     def __add__(cls, other):
         #print("In __add_ with", other)
         return str(cls)+str(other)
+    def __init__(cls, name, bases, attrs):
+        super().__init__(name, bases, attrs)
+        if 'fields' in attrs:
+            super().__setattr__('fields', Fields(attrs['fields'], cls))
+        cls.compile()
+    def __setattr__(cls, key, value):
+        if key == 'fields':
+            value = Fields(value, cls)
+        super().__setattr__(key, value)
+        if key in ('fields', 'name', 'schema', 'joins', 'id'):
+            cls.compile()
     def __call__(cls, field):
-        if field not in cls.fields:
+        if field not in cls.plan.fields:
             raise UnknownField(field)
-        return ESCAPE+cls.name+ESCAPE+'.'+ESCAPE+(field if not 'field' in cls.fields[field] else cls.fields[field]['field'])+ESCAPE
+        return cls.plan.fields[field].qualified
 
 class Table(metaclass=MetaTable):
     type = lambda x: None
@@ -185,13 +1572,47 @@ class Table(metaclass=MetaTable):
     joins = dict()
     #order = {'field':'id', 'method':'desc'}
     db = None
+    adb = None
+    # Cache() enables query result cache of get, all and filter
+    cache = None
+    # Entities() enables primary key cache of get
+    entities = None
+    # seconds filter(count='cached') keeps totals
+    count_ttl = 60
+    # False creates objects without calling type.__init__,
+    # for types whose __init__ only assigns fields
+    init = True
+
+    @classmethod
+    def compile(cls):
+        cls.plan = Plan(cls)
+        cls.statements = Statements()
+        cls.totals = Totals()
+        for table in cls.__subclasses__():
+            table.compile()
+        # sql and cached rows of tables joining cls have its old columns
+        for table in cls.joining():
+            table.statements = Statements()
+            if table.entities is not None:
+                table.entities.clear()
+
+    """
+        Returns tables with a join to cls
+    """
+    @classmethod
+    def joining(cls):
+        tables = []
+        stack = [[base for base in cls.__mro__ if isinstance(base, MetaTable)][-1]]
+        while stack:
+            table = stack.pop()
+            stack.extend(table.__subclasses__())
+            if any(join.get('table') is cls for join in table.joins.values()):
+                tables.append(table)
+        return tables
 
     @classmethod
     def str(cls):
-        result = ''
-        if cls.schema:
-            result += ESCAPE+cls.schema+ESCAPE+'.'
-        return result + ESCAPE+cls.name+ESCAPE
+        return cls.plan.table
     """
         Returns an array for updating table
         update['fields'] = 'field1=%s, field2=%s'
@@ -225,77 +1646,57 @@ class Table(metaclass=MetaTable):
 
         values = []
         fields = []
-        for field, config in cls.fields.items():
+        shape = []
+        for field in cls.plan.fields.values():
 
-            #log.debug(color.cyan('Parsing field %s %s'), field, config)
-
-            if field in data:
-
-                value = data[field]
-                column = config['field'] if 'field' in config else field
-                repeat = None
-
-                if not 'type' in config:
-                    config['type'] = 'string'
+            if field.name not in data:
+                continue
 
-                if 'array' in config and config['array']:
-                    criteria = '%s = ANY('+cls.name+'.'+ESCAPE+column+ESCAPE+')'
-                elif config['type'] == 'json':
-                    value = '%'+value+'%'
-                    criteria = cls.name+'.'+ESCAPE+column+ESCAPE+'::TEXT ILIKE %s'
-                elif 'options' in config or config['type'] == 'bool':
-                    criteria = cls.name+'.'+ESCAPE+column+ESCAPE+'=%s'
-                elif config['type'] == 'int' or config['type'] == 'date' or config['type'] == 'float':
-                    criteria = cls.name+'.'+ESCAPE+column+ESCAPE+'=%s'
-                else:
-                    value = '%'+value+'%'
-                    criteria = cls.name+'."'+column+"\"::TEXT ILIKE %s"
-
-                if 'array' in config and config['array']:
-                    if not isinstance(value, list) and not isinstance(value, tuple):
-                        raise InvalidValue('Value of '+field+' must be instance of list '+str(type(value))+' given', field)
-                    for parse in value:
-                        values.append(cls.value(field, parse))
-                        fields.append(criteria)
+            value = data[field.name]
+            criteria = field.criteria
+
+            if field.like:
+                value = '%'+value+'%'
+
+            if field.array:
+                if not isinstance(value, list) and not isinstance(value, tuple):
+                    raise InvalidValue('Value of '+field.name+' must be instance of list '+str(type(value))+' given', field.name)
+                for parse in value:
+                    values.append(field.value(parse))
+                    fields.append(criteria)
+                    shape.append(criteria)
+            elif field.options is not None and (isinstance(value, list) or isinstance(value, tuple) or isinstance(value, set)):
+                fields.append(field.reference+" IN ("+','.join(['%s'] * len(value))+")")
+                shape.append((field.name, len(value)))
+                for item in value:
+                    values.append(field.value(item))
+            elif field.numeric and \
+                (isinstance(value, list) or
+                 isinstance(value, tuple) or
+                 isinstance(value, set) or
+                 isinstance(value, dict)):
+                if isinstance(value, dict) and 'from' in value:
+                    values.append(field.value(value['from']))
+                    fields.append(field.start)
+                    shape.append(field.start)
+                if isinstance(value, dict) and 'to' in value:
+                    values.append(field.value(value['to']))
+                    fields.append(field.end)
+                    shape.append(field.end)
+                if (isinstance(value, list) or isinstance(value, tuple) or isinstance(value, set)) and len(value):
+                    for item in value:
+                        values.append(field.value(item))
+                    fields.append(field.reference+" IN ("+','.join(['%s'] * len(value))+")")
+                    shape.append((field.name, len(value)))
+            else:
+                if not field.json:
+                    values.append(field.value(value))
                 else:
-                    if 'options' in config and (isinstance(value, list) or isinstance(value, tuple) or isinstance(value, set)):
-                        fields.append(cls.name+'."'+column+"\" IN ("+','.join(['%s'] * len(value))+")")
-                        for item in value:
-                            log.debug(color.cyan('%s'), item)
-                            values.append(cls.value(field, item))
-                    elif (config['type'] == 'int' or
-                        config['type'] == 'date' or
-                        config['type'] == 'float') and \
-                        (isinstance(value, list) or
-                         isinstance(value, tuple) or
-                         isinstance(value, set) or
-                         isinstance(value, dict)):
-                        # ('from' in value or
-                        #  'to' in value or
-                        #  'in' in value):
-                        if isinstance(value, dict) and 'from' in value:
-                            values.append(cls.value(field, value['from']))
-                            fields.append(cls.name+'."'+column+"\">=%s")
-                        if isinstance(value, dict) and 'to' in value:
-                            values.append(cls.value(field, value['to']))
-                            fields.append(cls.name+'."'+column+"\"<=%s")
-                        if (isinstance(value, list) or isinstance(value, tuple) or isinstance(value, set)) and len(value):
-                            for item in value:
-                                #log.debug(color.cyan('%s'), item)
-                                values.append(cls.value(field, item))
-                            fields.append(cls.name+'."'+column+"\" IN ("+','.join(['%s'] * len(value))+")")
-                    else:
-                        if config['type'] != 'json':
-                            values.append(cls.value(field, value))
-                            if repeat:
-                                values.append(cls.value(field, repeat))
-                        else:
-                            values.append(str(value))
-                            if repeat:
-                                values.append(str(repeat))
-                        fields.append(criteria)
+                    values.append(str(value))
+                fields.append(criteria)
+                shape.append(criteria)
 
-        return Clause(fields, values, separator=' '+separator+' ', empty='1=1')
+        return Clause(fields, values, separator=' '+separator+' ', empty='1=1', shape=shape)
 
     @classmethod
     def order(cls, field=None, method=None, data=None):
@@ -321,21 +1722,19 @@ class Table(metaclass=MetaTable):
         if not field:
             raise MissingField()
 
-        if field not in cls.fields:
+        if field not in cls.plan.fields:
             raise UnknownField(field)
 
-        config = cls.fields[field]
-        if 'type' not in config:
-            config['type'] = 'string'
+        config = cls.plan.fields[field]
 
-        column = cls.name+'.'+ESCAPE+(config['field'] if 'field' in config else field)+ESCAPE
+        column = config.reference
 
-        if config['type'] == 'json':
+        if config.json:
             if key is None:
                 raise MissingField()
-            if 'keys' not in config:
+            if config.keys is None:
                 raise MissingConfig()
-            if key not in config['keys']:
+            if key not in config.keys:
                 raise UnknownField()
             column += "->'"+key+"'"
 
@@ -359,32 +1758,15 @@ class Table(metaclass=MetaTable):
 
         #log.debug(color.cyan('In a parse %s'), cls.fields)
 
+        plan = cls.plan
         values = []
         fields = []
-        for field, config in cls.fields.items():
-            #log.debug(color.cyan('Parsing field %s'), field)
-            if mode in config and not config[mode]:
+        for field in plan.modes[mode] if mode in plan.modes else plan.fields.values():
+            if field.name not in data:
                 continue
 
-            if field in data:
-
-                value = data[field]
-
-                if 'array' in config and config['array']:
-                    if value is not None:
-                        if not isinstance(value, list) and not isinstance(value, tuple):
-                            raise InvalidValue('Value of '+field+' must be instance of list '+str(type(value))+' given', field)
-                        value = '{'+(','.join([cls.value(field, parse) for parse in value]))+'}'
-                else:
-                    value = cls.value(field, value)
-
-                values.append(value)
-
-                if 'field' in config:
-                    name = config['field']
-                else:
-                    name = field
-                fields.append(ESCAPE+name+ESCAPE)
+            values.append(field.format(data[field.name]))
+            fields.append(field.escaped)
 
         return (fields, values)
 
@@ -392,67 +1774,18 @@ class Table(metaclass=MetaTable):
     def value(cls, field, value):
         if value is None:
             return None
-
-        config = cls.fields[field]
-
-        # type casting
-        if value is None and 'null' in config and config['null']:
-            return None
-        elif 'type' not in config or config['type'] == 'string':
-            value = str(value)
-        elif config['type'] == 'int':
-            value = int(value)
-        elif config['type'] == 'bool':
-            value = bool(value)
-        elif config['type'] == 'json':
-            value = json.dumps(value)
-        elif config['type'] == 'date':
-            try:
-                value = parse_date(value)
-            except Exception:
-                raise InvalidDate('Invalid date '+value+' for field'+field, field)
-        elif config['type'] == 'float':
-            try:
-                value = float(value)
-            except Exception:
-                raise InvalidFloat('Invalid float '+value+' for field'+field, field)
-
-        # checking for options
-        if 'options' in config:
-            if value not in config['options']:
-                raise InvalidValue('Invalid value '+value+' for field '+field, field)
-
-        # encoding
-        if 'encoder' in config:
-            value = config['encoder'](value)
-
-        return str(value)
+        return cls.plan.fields[field].value(value)
     """
         Returns list of field names for selecting
         field1, field2, field3
     """
     @classmethod
     def select(cls):
-        fields = []
-        for field, config in cls.fields.items():
-            if 'select' in config and not config['select']:
-                continue
-            if 'field' in config:
-                fields.append(config['field'])
-            else:
-                fields.append(field)
-
-        return (', '.join(cls.name+'.'+ESCAPE+value+ESCAPE for value in fields))
+        return cls.plan.columns
 
     @classmethod
     def offset(cls):
-        #log.debug(color.red(cls.fields))
-        count = 0
-        for field, config in cls.fields.items():
-            if 'select' in config and not config['select']:
-                continue
-            count += 1
-        return count
+        return cls.plan.offset
 
 
     """
@@ -460,170 +1793,766 @@ class Table(metaclass=MetaTable):
     """
     @classmethod
     def create(cls, data, offset=0):
-        params = {}
-        position = 0
-        for field, config in cls.fields.items():
-            if 'select' in config and not config['select']:
-                continue
-            if 'array' in config and config['array'] and data[position] is not None:
-                if isinstance(data[position], list):
-                    params[field] = data[position]
-                elif data[position] == '{}':
-                    params[field] = []
-                else:
-                    params[field] = data[position][1:-1].split(',')
-            else:
-                if 'decoder' in config:
-                    params[field] = config['decoder'](data[position])
-                else:
-                    params[field] = data[position]
-                    if 'type' in config and config['type'] == 'json' and isinstance(params[field], str):
-                        params[field] = json.loads(params[field])
-            position += 1
-        #print(params)
-        # if cls.name=='user_media':print(color.magenta(cls.type.__name__))
-        # if cls.name=='user_media':print(color.magenta(params))
-
-        init_args = {}
-        for argument in inspect.getargspec(cls.type).args:
-            if argument != 'self':
-                if argument in params:
-                    init_args[argument] = params[argument]
-        result = cls.type(**init_args)
-        for key, value in params.items():
-            if key not in init_args:
-                setattr(result, key, value)
-
-        return result
+        return cls.plan.hydrator(cls.type, cls.init)(data)
 
-        #return cls.type(**params)
     @classmethod
-    def get(cls, id, filter=None):
+    @measured('get')
+    def get(cls, id, filter=None, rows='object'):
+        join = Join(cls)
+        version = None
+        # filtered get is not answered from cache, its row is remembered
+        if cls.entities is not None:
+            version = cls.stamp(join)
+            if not filter and not cls.scoped():
+                row = cls.entities.get(cls.pk(id), version[1])
+                if row is not None:
+                    join.row.data(row)
+                    return join.create(rows)
         if filter is None:
             filter = {}
         filter = cls.where(filter)
-        join = Join(cls)
+        query, values = cls.query_get(id, join, filter)
+        records, _ = cls.fetch(query, values, join)
+        if records:
+            cls.remember(id, join, records[0], version, True)
+            join.row.data(records[0])
+            return join.create(rows)
+
+    """
+        Writes committed row through entity cache, row None or
+        write inside transaction evicts id instead
+        id None takes primary key from row
+        version: (entities.version(), join.generations()) taken before
+        row was selected or written, when id was written since a fill
+        is skipped and a write evicts id
+    """
+    @classmethod
+    def remember(cls, id, join, row, version=None, fill=False):
+        if cls.entities is None:
+            return
+        if id is None:
+            if row is None or cls.plan.key is None:
+                return
+            id = row[cls.plan.key]
+        if row is None or cls.scoped():
+            cls.forget([id])
+        elif version is None:
+            cls.entities.set(cls.pk(id), join.generations(), row)
+        else:
+            cls.entities.set(cls.pk(id), version[1], row, version[0], not fill)
+
+    """
+        Returns version passed to remember, taken before its sql
+    """
+    @classmethod
+    def stamp(cls, join):
+        if cls.entities is None:
+            return None
+        return cls.entities.version(), join.generations()
+
+    """
+        Evicts ids from entity cache
+    """
+    @classmethod
+    def forget(cls, ids):
+        if cls.entities is None:
+            return
+        scope = cls.db.scope.get() if cls.scoped() else None
+        for id in ids:
+            key = cls.pk(id)
+            cls.entities.evict(key)
+            if scope is not None:
+                scope.entities.add((cls, key))
+
+    """
+        Returns id cast to python type of id field
+    """
+    @classmethod
+    def pk(cls, id):
         try:
-            db = cls.db.get()
-            cursor = db.cursor()
-            cursor.execute(*debug(f"""SELECT {join.select()}
+            return cls.ids([id])[0]
+        except (ValueError, TypeError, Error):
+            return id
+
+    """
+        Returns True inside transaction scope of cls.db
+    """
+    @classmethod
+    def scoped(cls):
+        return isinstance(cls.db, Db) and cls.db.scope.get() is not None
+
+    """
+        Returns sql and params of get, shared with aget
+    """
+    @classmethod
+    def query_get(cls, id, join, filter):
+        key = ('get', filter.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""SELECT {join.select()}
                              FROM {cls}
                              {join}
-                             WHERE {cls(cls.id)}=%s AND {filter.fields()}""",
-                             [id,]+filter.values()))
-            if cursor.rowcount > 0:
-                join.row.data(cursor.fetchone())
-                return join.create()
-        except Exception as error:
-            raise error
-        finally:
-            db.commit()
-            cls.db.put(db)
+                             WHERE {cls(cls.id)}=%s AND {filter.fields()}""")
+        return query, [id,]+filter.values()
 
+    """
+        Returns Result with objects for ids in one query, in order of
+        ids when preserve_order is set, and ids not found in missing
+    """
     @classmethod
-    def all(cls, filter=None, order=None, search=None, limit=None):
+    def get_many(cls, ids, filter=None, preserve_order=True):
         if filter is None:
             filter = {}
-        if order is None:
-            order = {}
-        if search is None:
-            search = {}
-        join = Join(cls, filter, search)
+        filter = cls.where(filter)
+        join = Join(cls)
+        ids = cls.ids(ids)
 
-        result = []
+        result = Result()
 
+        key = ('get_many', filter.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""SELECT {join.select()}
+                             FROM {cls}
+                             {join}
+                             WHERE {cls(cls.id)} = ANY(%s) AND {filter.fields()}""")
+        found = {}
+        db = None
         try:
-            db = cls.db.get()
+            db = cls.db.get(read=True)
             cursor = db.cursor()
-            cursor.execute(*debug(f"""SELECT
-                           {join.select()}
-                           FROM {cls}
-                           {join}
-                           WHERE {join.fields()}
-                           ORDER BY {cls.order(cls.id, 'desc', order)}
-                           {f'LIMIT {int(limit)}' if limit else ''}""",
-                           join.values()))
+            cls.db.execute(cursor, query, [list(dict.fromkeys(ids)),]+filter.values())
             log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
-            while True:
-                try:
-                    join.row.data(cursor.fetchone())
-                    item = join.create()
-                    result.append(item)
-                except TypeError:
-                    break
-        except Exception as error:
-            raise error
+            for row in cursor.fetchall():
+                join.row.data(row)
+                item = join.create()
+                found[getattr(item, cls.id)] = item
+                if not preserve_order:
+                    result.add(item)
         finally:
-            db.commit()
-            cls.db.put(db)
+            if db is not None:
+                cls.db.commit(db)
+                cls.db.put(db)
+
+        for id in ids:
+            if id in found:
+                if preserve_order:
+                    result.add(found[id])
+            elif id not in result.missing:
+                result.missing.append(id)
+        result.total = len(result.items)
 
         return result
 
+    """
+        Casts primary key values to python type of id field
+        so they compare equal to fetched ids
+    """
+    @classmethod
+    def ids(cls, ids):
+        field = cls.plan.fields.get(cls.id)
+        if field is None or field.cast is None or field.array or field.json:
+            return list(ids)
+        return [field.cast(id, field.name) for id in ids]
+
     @classmethod
-    def filter(cls, page=1, limit=100, filter=None, order=None, search=None):
+    @measured('all')
+    def all(cls, filter=None, order=None, search=None, limit=None, rows='object'):
         if filter is None:
             filter = {}
         if order is None:
             order = {}
         if search is None:
             search = {}
+        join = Join(cls, filter, search)
 
+        result = []
 
-        join = Join(cls, filter, search)
-        join.row.offset('total')
+        query, values = cls.query_all(join, order, limit)
 
-        limit = min(limit, 100)
-        offset = (page-1)*limit
+        records, _ = cls.fetch(query, values, join, slow=True)
+        for row in records:
+            join.row.data(row)
+            result.append(join.create(rows))
 
-        result = Result()
+        return result
 
+    """
+        Returns fetched rows of read query and planner estimate
+        when estimate is set, through cls.cache when enabled
+        slow: query is captured by sql.slowlog when slow
+    """
+    @classmethod
+    def fetch(cls, query, values, join, estimate=False, slow=False):
+        key, cached = cls.recall(query, values, join, cls.scoped())
+        if cached is not None:
+            return cached
+
+        total = None
         db = None
+        try:
+            db = cls.db.get(read=True)
+            cursor = db.cursor()
+            started = time.perf_counter()
+            cls.db.execute(cursor, query, values)
+            log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
+            records = cursor.fetchall()
+            duration = time.perf_counter()-started
+            if estimate:
+                total = cls.estimate(cursor, join)
+            mark('fetch')
+        finally:
+            if db is not None:
+                cls.db.commit(db)
+                cls.db.put(db)
+
+        if slow and slowlog is not None and duration >= slowlog.threshold:
+            cls.capture(query, values, duration)
+        if key is not None:
+            cls.cache.set(key, (records, total))
+        return records, total
+
+    """
+        Records slow query in sql.slowlog with its plan when EXPLAIN
+        is due, not explained inside transaction scope
+    """
+    @classmethod
+    def capture(cls, query, values, duration):
+        plan = None
+        error = None
+        if not cls.scoped() and slowlog.due():
+            db = None
+            try:
+                db = cls.db.get(read=True)
+                cursor = db.cursor()
+                execute(cursor, cls.query_explain(query), values)
+                plan = cursor.fetchone()[0]
+            except Exception as exception:
+                error = str(exception)
+            finally:
+                if db is not None:
+                    cls.db.rollback(db)
+                    cls.db.put(db)
+        slowlog.record(label(cls), query, values, duration, plan, error)
+
+    @classmethod
+    def query_explain(cls, query, analyze=True):
+        return 'EXPLAIN ('+('ANALYZE, BUFFERS, ' if analyze else '')+'FORMAT JSON) '+query
+
+    """
+        Returns EXPLAIN (FORMAT JSON) output of exactly the sql which
+        method 'get', 'all' or 'filter' runs with same arguments
+        analyze: runs query with EXPLAIN (ANALYZE, BUFFERS)
+        Users.explain('filter', filter={'status': 'active'}, order={'field': 'name'})
+        Users.explain('get', id=1)
+    """
+    @classmethod
+    def explain(cls, method='filter', filter=None, search=None, order=None, analyze=False, id=None, page=1, limit=None, cursor=None, count='exact'):
+        if filter is None:
+            filter = {}
+        if order is None:
+            order = {}
+        if search is None:
+            search = {}
+        if method == 'get':
+            if id is None:
+                raise MissingInput()
+            query, values = cls.query_get(id, Join(cls), cls.where(filter))
+        elif method == 'all':
+            query, values = cls.query_all(Join(cls, filter, search), order, limit)
+        elif method == 'filter':
+            if count not in ('exact', 'estimate', 'none', 'cached'):
+                raise InvalidValue('Invalid count '+str(count))
+            join = Join(cls, filter, search)
+            limit = min(limit if limit is not None else 100, 100)
+            if cursor is not None:
+                query, values, _ = cls.query_seek(join, limit, order, cursor)
+            else:
+                query, values, _ = cls.query_filter(join, order, limit, (page-1)*limit, count)
+        else:
+            raise InvalidValue('Invalid method '+str(method))
 
+        db = None
         try:
-            db = cls.db.get()
+            db = cls.db.get(read=True)
             cursor = db.cursor()
-            cursor.execute(*debug(f"""SELECT
-                           {join.select()},
-                           COUNT(*) OVER()
+            execute(cursor, cls.query_explain(query, analyze), values)
+            plan = cursor.fetchone()[0]
+        finally:
+            if db is not None:
+                cls.db.rollback(db)
+                cls.db.put(db)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan
+
+    """
+        Returns cache key and cached (rows, estimate) of read query,
+        key is None when cache is disabled or inside transaction
+    """
+    @classmethod
+    def recall(cls, query, values, join, scoped=False):
+        if cls.cache is None or scoped:
+            return None, None
+        key = cls.cache.key(join.tables(), query, values)
+        return key, cls.cache.get(key)
+
+    """
+        Makes cached reads of this table and of tables joining it stale,
+        called after commit so reads racing the write are not cached
+        under the new generation
+    """
+    @classmethod
+    def invalidate(cls):
+        table = str(cls)
+        GENERATIONS[table] = GENERATIONS.get(table, 0)+1
+        if cls.scoped():
+            cls.db.scope.get().tables.add(cls)
+
+    """
+        Returns sql and params of all for join, shared with iter and aall
+    """
+    @classmethod
+    def query_all(cls, join, order, limit=None):
+        key = ('all', join.shape(), order.get('field'), order.get('method'), bool(limit))
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""SELECT
+                           {join.select()}
+                           FROM {cls}
+                           {join}
+                           WHERE {join.fields()}
+                           ORDER BY {cls.order(cls.id, 'desc', order)}
+                           {'LIMIT %s' if limit else ''}""")
+        values = join.values()
+        if limit:
+            values.append(int(limit))
+        return query, values
+
+    """
+        Returns {field: numpy masked array} for fields of rows matching
+        filter and search, NULLs are masked. Arrays are typed from field
+        config: int->int64, float->float64, bool->bool, date->datetime64,
+        other fields are object arrays. Rows are fetched through server
+        side named cursor itersize rows at a time, arrays grow as
+        batches arrive. NumPy is imported only when called
+    """
+    @classmethod
+    def columns(cls, fields=None, filter=None, order=None, search=None, limit=None, itersize=10000):
+        import numpy
+
+        if filter is None:
+            filter = {}
+        if order is None:
+            order = {}
+        if search is None:
+            search = {}
+        if fields is None:
+            fields = [field.name for field in cls.plan.select]
+        columns = []
+        for name in fields:
+            if name not in cls.plan.fields or not cls.plan.fields[name].select:
+                raise UnknownField(name)
+            columns.append(cls.plan.fields[name])
+        if not columns:
+            raise MissingField()
+
+        join = Join(cls, filter, search)
+
+        key = ('columns', tuple(fields), join.shape(), order.get('field'), order.get('method'), bool(limit))
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""SELECT
+                           {', '.join(field.reference for field in columns)}
                            FROM {cls}
                            {join}
                            WHERE {join.fields()}
                            ORDER BY {join.order(cls.id, 'desc', order)}
-                           LIMIT %s OFFSET %s""",
-                           join.values()+[limit, offset]))
-            log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
+                           {'LIMIT %s' if limit else ''}""")
+        values = join.values()
+        if limit:
+            values.append(int(limit))
+
+        arrays = []
+        for field in columns:
+            dtype, fill = COLUMN_TYPES.get(field.type, ('object', None))
+            if field.array or field.decoder is not None:
+                dtype, fill = 'object', None
+            arrays.append((field, numpy.empty(0, dtype=dtype), numpy.zeros(0, dtype=bool), fill))
+
+        result = {}
+        db = cls.db.get(read=True)
+        cursor = None
+        try:
+            # named cursor in autocommit read only transaction must be held
+            cursor = db.cursor(name='sql_columns_'+str(next(CURSORS)), withhold=db.autocommit)
+            cursor.itersize = itersize
+            execute(cursor, query, values)
+
+            start = 0
             while True:
-                try:
-                    join.row.data(cursor.fetchone())
-                    if result.total is None:
-                        result.total = join.row('total')
-                    item = join.create()
-                    result.add(item)
-                except TypeError:
+                batch = cursor.fetchmany(itersize)
+                if not batch:
                     break
-        except Exception as error:
-            raise error
+                end = start+len(batch)
+                if end > len(arrays[0][1]):
+                    # grown in place, new mask positions are False
+                    size = max(end, 2*len(arrays[0][1]))
+                    for field, data, mask, fill in arrays:
+                        data.resize(size, refcheck=False)
+                        mask.resize(size, refcheck=False)
+                for (field, data, mask, fill), column in zip(arrays, zip(*batch)):
+                    if None in column:
+                        mask[start:end] = [value is None for value in column]
+                        if fill is not None:
+                            column = [fill if value is None else value for value in column]
+                    if data.dtype == object:
+                        # element wise, so list values are not broadcast
+                        for position, value in enumerate(cls.column(field, column), start):
+                            data[position] = value
+                    else:
+                        data[start:end] = column
+                start = end
+            log.debug(color.cyan('Total fetched %s'), start)
+
+            for field, data, mask, fill in arrays:
+                data.resize(start, refcheck=False)
+                mask.resize(start, refcheck=False)
+                result[field.name] = numpy.ma.MaskedArray(data, mask=mask)
         finally:
-            db.commit()
+            if cursor is not None and db.autocommit and not db.closed:
+                cursor.close()
+            # ends transaction and with it the server side cursor
+            cls.db.commit(db)
             cls.db.put(db)
 
-        if result.total is None:
+        return result
+
+    """
+        Applies decoder, array and json parsing to object column values
+    """
+    @classmethod
+    def column(cls, field, column):
+        if field.decoder is not None:
+            return [field.decoder(value) for value in column]
+        if field.array:
+            return [None if value is None else parse_array(value) for value in column]
+        if field.json:
+            return [json.loads(value) if isinstance(value, str) else value for value in column]
+        return column
+
+    """
+        Generator over rows matching filter and search, fetched through
+        server side named cursor itersize rows at a time
+        Holds its connection until exhausted or closed
+    """
+    @classmethod
+    def iter(cls, filter=None, order=None, search=None, limit=None, itersize=2000, rows='object'):
+        if filter is None:
+            filter = {}
+        if order is None:
+            order = {}
+        if search is None:
+            search = {}
+        join = Join(cls, filter, search)
+
+        query, values = cls.query_all(join, order, limit)
+
+        db = cls.db.get(read=True)
+        cursor = None
+        try:
+            # named cursor in autocommit read only transaction must be held
+            cursor = db.cursor(name='sql_iter_'+str(next(CURSORS)), withhold=db.autocommit)
+            cursor.itersize = itersize
+            execute(cursor, query, values)
+            while True:
+                records = cursor.fetchmany(itersize)
+                if not records:
+                    break
+                log.debug(color.cyan('Total fetched %s'), len(records))
+                for row in records:
+                    join.row.data(row)
+                    yield join.create(rows)
+        finally:
+            if cursor is not None and db.autocommit and not db.closed:
+                cursor.close()
+            # ends transaction and with it the server side cursor
+            cls.db.commit(db)
+            cls.db.put(db)
+
+    """
+        Returns page of rows as Result
+        cursor=True or cursor token from previous Result.cursor switches
+        to keyset pagination, page is ignored and total is not computed
+        count selects how Result.total is computed:
+            'exact' COUNT(*) OVER() in the same query
+            'estimate' planner estimate, pg_class.reltuples when unfiltered
+            'none' total is None
+            'cached' exact total remembered per filter for count_ttl seconds
+    """
+    @classmethod
+    @measured('filter')
+    def filter(cls, page=1, limit=100, filter=None, order=None, search=None, cursor=None, count='exact', rows='object'):
+        if count not in ('exact', 'estimate', 'none', 'cached'):
+            raise InvalidValue('Invalid count '+str(count))
+        if filter is None:
+            filter = {}
+        if order is None:
+            order = {}
+        if search is None:
+            search = {}
+
+
+        join = Join(cls, filter, search)
+
+        limit = min(limit, 100)
+
+        if cursor is not None:
+            return cls.seek(join, limit, order, cursor, rows)
+
+        offset = (page-1)*limit
+
+        result = Result()
+
+        query, values, total = cls.query_filter(join, order, limit, offset, count)
+        exact = count == 'exact' or (count == 'cached' and total is None)
+
+        records, estimate = cls.fetch(query, values, join, count == 'estimate', True)
+        for row in records:
+            join.row.data(row)
+            if exact and result.total is None:
+                result.total = join.row('total')
+            result.add(join.create(rows))
+        if count == 'estimate':
+            result.total = estimate
+
+        return cls.total(result, join, count, total, offset)
+
+    """
+        Returns sql, params and cached total of filter page, shared with
+        afilter. COUNT(*) OVER() is selected for count='exact' and for
+        count='cached' when total is not cached
+    """
+    @classmethod
+    def query_filter(cls, join, order, limit, offset, count):
+        total = None
+        if count == 'cached':
+            total = cls.totals.get((join.shape(), tuple(join.values())))
+        exact = count == 'exact' or (count == 'cached' and total is None)
+        if exact:
+            join.row.offset('total')
+
+        key = ('filter', join.shape(), order.get('field'), order.get('method'), exact)
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""SELECT
+                           {select(join.select(), 'COUNT(*) OVER()' if exact else '')}
+                           FROM {cls}
+                           {join}
+                           WHERE {join.fields()}
+                           ORDER BY {join.order(cls.id, 'desc', order)}
+                           LIMIT %s OFFSET %s""")
+        return query, join.values()+[limit, offset], total
+
+    """
+        Completes Result.total of fetched filter page
+    """
+    @classmethod
+    def total(cls, result, join, count, total, offset):
+        exact = count == 'exact' or (count == 'cached' and total is None)
+        if exact and result.total is None:
             result.total = 0
 
+        if count == 'cached':
+            if total is not None:
+                result.total = total
+            elif result.items or offset == 0:
+                # past last page window count is missing, not zero
+                cls.totals.set((join.shape(), tuple(join.values())), result.total, cls.count_ttl)
+
         return result
 
+    """
+        Returns planner row estimate for join filters and search
+        or pg_class.reltuples when there are none
+    """
+    @classmethod
+    def estimate(cls, cursor, join):
+        if not join.filters and not join.searchs:
+            execute(cursor, *cls.query_reltuples())
+            row = cursor.fetchone()
+            # -1 when table was never vacuumed or analyzed
+            if row is not None and row[0] >= 0:
+                return int(row[0])
+        execute(cursor, *cls.query_estimate(join))
+        return cls.plan_rows(cursor.fetchone()[0])
+
+    @classmethod
+    def query_reltuples(cls):
+        return 'SELECT reltuples FROM pg_class WHERE oid = %s::REGCLASS', [str(cls)]
+
     @classmethod
+    def query_estimate(cls, join):
+        key = ('estimate', join.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""EXPLAIN (FORMAT JSON)
+                           SELECT 1
+                           FROM {cls}
+                           {join}
+                           WHERE {join.fields()}""")
+        return query, join.values()
+
+    """
+        Returns row estimate of EXPLAIN (FORMAT JSON) output
+    """
+    @classmethod
+    def plan_rows(cls, plan):
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    """
+        Keyset pagination, rows after cursor position in order
+        WHERE (key, id) < (%s, %s) ORDER BY key DESC, id DESC
+        Rows with NULL key are ordered by id, last in ascending and
+        first in descending order as in default btree index, page
+        crossing between NULL and non NULL keys runs second query
+    """
+    @classmethod
+    def seek(cls, join, limit, order, cursor, rows='object'):
+        query, values, rest = cls.query_seek(join, limit, order, cursor)
+        records, _ = cls.fetch(query, values, join, slow=True)
+        if rest is not None and len(records) <= limit:
+            query, values, _ = cls.query_seek(join, limit-len(records), order, cursor, rest)
+            records = records+cls.fetch(query, values, join, slow=True)[0]
+        return cls.page(join, records, limit, rows)
+
+    """
+        Returns sql, params and following phase of keyset page, shared
+        with afilter. Phase of seek predicate is taken from cursor:
+            'key' (key, id) after position, plain row comparison
+            'null' NULL key and id after position
+            'nulls' all NULL keys, follows 'key' in ascending order
+            'keys' all non NULL keys, follows 'null' in descending order
+            None first page, no predicate
+    """
+    @classmethod
+    def query_seek(cls, join, limit, order, cursor, phase=None):
+        column, method = join.keyset(cls.id, 'desc', order)
+        id = cls.order(cls.id)
+        count = 1 if column == id else 2
+        position = None
+        if cursor is not True:
+            position = Cursor.decode(cursor)
+            if len(position) != count:
+                raise InvalidValue('Cursor does not match order '+str(cursor))
+
+        if 'cursor' not in join.row.offsets:
+            join.row.offset('cursor', count)
+
+        rest = None
+        if phase is None and position is not None:
+            phase = 'key'
+            if count == 2 and position[0] is None:
+                phase = 'null'
+            if count == 2 and method == 'ASC' and phase == 'key':
+                rest = 'nulls'
+            elif count == 2 and method == 'DESC' and phase == 'null':
+                rest = 'keys'
+        if phase == 'null':
+            position = position[1:]
+        elif phase != 'key':
+            position = None
+
+        key = ('seek', join.shape(), order.get('field'), order.get('method'), phase)
+        query = cls.statements.get(key)
+        if query is None:
+            compare = '<' if method == 'DESC' else '>'
+            if column == id:
+                keys = f"{id}::TEXT"
+                seek = f"{id} {compare} %s"
+                sort = f"{id} {method}"
+            else:
+                keys = f"{column}::TEXT, {id}::TEXT"
+                seek = {'key': f"({column}, {id}) {compare} (%s, %s)",
+                        'null': f"{column} IS NULL AND {id} {compare} %s",
+                        'nulls': f"{column} IS NULL",
+                        'keys': f"{column} IS NOT NULL"}.get(phase)
+                sort = f"{column} {method}, {id} {method}"
+            query = cls.statements.set(key, f"""SELECT
+                           {join.select()},
+                           {keys}
+                           FROM {cls}
+                           {join}
+                           WHERE {join.fields()}
+                           {'AND '+seek if phase is not None else ''}
+                           ORDER BY {sort}
+                           LIMIT %s""")
+
+        values = join.values()
+        if position is not None:
+            values.extend(position)
+        values.append(limit+1)
+        return query, values, rest
+
+    """
+        Returns Result of keyset page from limit+1 fetched records,
+        cursor is set when there is a next page
+    """
+    @classmethod
+    def page(cls, join, records, limit, rows='object'):
+        result = Result()
+        for row in records[:limit]:
+            join.row.data(row)
+            result.add(join.create(rows))
+        if len(records) > limit:
+            join.row.data(records[limit-1])
+            position = join.row('cursor')
+            result.cursor = Cursor.encode(position if isinstance(position, tuple) else (position,))
+
+        return result
+
+    @classmethod
+    @measured('save')
     def save(cls, id, data, filter=None):
         if filter is None:
             filter = {}
 
         filter = cls.where(filter)
         join = Join(cls)
-        update = cls.update(data)
+        query, values = cls.query_save(id, join, cls.update(data), filter)
+        version = cls.stamp(join)
         try:
             db = cls.db.get()
             cursor = db.cursor()
-            cursor.execute(*debug(f"""WITH "{cls.name}" AS (
+            cls.db.execute(cursor, query, values)
+            row = cursor.fetchone() if cursor.rowcount > 0 else None
+            mark('fetch')
+        except Exception as error:
+            cls.unique(error)
+            raise error
+        finally:
+            cls.db.commit(db)
+            cls.db.put(db)
+            cls.invalidate()
+
+        cls.remember(id, join, row, version)
+        if row is not None:
+            join.row.data(row)
+            item = join.create()
+            mark('hydrate')
+            return item
+
+    """
+        Returns sql and params of save, shared with asave
+    """
+    @classmethod
+    def query_save(cls, id, join, update, filter):
+        key = ('save', update.shape(), filter.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""WITH "{cls.name}" AS (
                                         UPDATE {cls}
                                         SET {update.fields()}
                                         WHERE {cls(cls.id)}=%s AND {filter.fields()}
@@ -632,35 +2561,46 @@ class Table(metaclass=MetaTable):
                                     SELECT {join.select()}
                                     FROM "{cls.name}"
                                     {join}
-                                    """,
-                                update.values(id)+filter.values()))
-            if cursor.rowcount > 0:
-                join.row.data(cursor.fetchone())
-                return join.create()
-        except Exception as error:
-            match = re.search(r''+cls.name+'_unique_(.*?)_index', str(error))
-            print(match)
-            if match is not None and match.lastindex > 0:
-                index = match.group(1)
-                if index in cls.fields:
-                    raise UniqueError(index)
-                for field, config in cls.fields:
-                    if 'field' in config and config['field'] == index:
-                        raise UniqueError(field)
-            raise error
-        finally:
-            db.commit()
-            cls.db.put(db)
-
+                                    """)
+        return query, update.values(id)+filter.values()
 
     @classmethod
+    @measured('add')
     def add(cls, data):
         join = Join(cls)
-        insert = cls.insert(data)
+        query, values = cls.query_add(join, cls.insert(data))
         try:
             db = cls.db.get()
             cursor = db.cursor()
-            cursor.execute(*debug(f"""WITH "{cls.name}" AS (
+            cls.db.execute(cursor, query, values)
+            log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
+            row = cursor.fetchone() if cursor.rowcount > 0 else None
+            mark('fetch')
+
+        except Exception as error:
+            cls.unique(error)
+            raise error
+        finally:
+            cls.db.commit(db)
+            cls.db.put(db)
+            cls.invalidate()
+
+        cls.remember(None, join, row)
+        if row is not None:
+            join.row.data(row)
+            item = join.create()
+            mark('hydrate')
+            return item
+
+    """
+        Returns sql and params of add, shared with aadd
+    """
+    @classmethod
+    def query_add(cls, join, insert):
+        key = ('add', insert.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""WITH "{cls.name}" AS (
                                         INSERT INTO {cls}
                                         ({insert.fields()})
                                         VALUES ({insert.fields('%s')})
@@ -669,50 +2609,548 @@ class Table(metaclass=MetaTable):
                                     SELECT {join.select()}
                                     FROM "{cls.name}"
                                     {join}
-                                    """,
-                                insert.values()))
-            log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
-            if cursor.rowcount > 0:
-                join.row.data(cursor.fetchone())
-                return join.create()
+                                    """)
+        return query, insert.values()
+
+
+    """
+        Updates many rows given as {id: data, ...} inside one transaction
+        Rows are grouped by set of updated fields, each group is updated
+        with UPDATE ... FROM (VALUES ...) in chunks of chunk_size rows,
+        capped to PARAMS bind parameters
+        filter is applied to every row like in save
+        Returns {id: object} of updated rows or updated row count
+        when returning is False
+    """
+    @classmethod
+    def save_many(cls, rows, filter=None, chunk_size=1000, returning=True):
+        if filter is None:
+            filter = {}
 
+        filter = cls.where(filter)
+        join = Join(cls)
+        result = {} if returning else 0
+
+        groups = {}
+        for id, data in rows.items():
+            update = cls.update(data)
+            groups.setdefault(update.shape(), []).append((id, update))
+
+        db = None
+        try:
+            db = cls.db.get()
+            cursor = db.cursor()
+            for chunk in groups.values():
+                size = min(chunk_size, max(1, (PARAMS-len(filter.values())) // (len(chunk[0][1].values())+1)))
+                for start in range(0, len(chunk), size):
+                    result = cls.update_chunk(cursor, join, chunk[start:start+size], filter, returning, result)
         except Exception as error:
-            match = re.search(r''+cls.name+'_unique_(.*?)_index', str(error))
-            print(match)
-            if match is not None and match.lastindex > 0:
-                index = match.group(1)
-                if index in cls.fields:
-                    raise UniqueError(index)
-                for field, config in cls.fields:
-                    if 'field' in config and config['field'] == index:
-                        raise UniqueError(field)
+            if db is not None:
+                cls.db.rollback(db)
+            cls.unique(error)
             raise error
         finally:
-            db.commit()
-            cls.db.put(db)
+            if db is not None:
+                cls.db.commit(db)
+                cls.db.put(db)
+            cls.invalidate()
+            cls.forget(rows)
+
+        return result
+
+    @classmethod
+    def update_chunk(cls, cursor, join, chunk, filter, returning, result):
+        update = chunk[0][1]
+        key = ('save_many', update.shape(), filter.shape(), len(chunk), returning)
+        query = cls.statements.get(key)
+        if query is None:
+            id = cls.plan.fields[cls.id]
+            fields, _ = update.exctract()
+            columns = ', '.join([id.escaped]+fields)
+            # first row of typed NULLs gives VALUES the column types of table
+            types = ', '.join(f'(NULL::{cls}).{name}' for name in [id.escaped]+fields)
+            values = ', '.join(['(%s, '+update.fields('%s')+')'] * len(chunk))
+            query = f"""UPDATE {cls}
+                        SET {update.fields('{name}=v.{name}')}
+                        FROM (VALUES ({types}), {values}) AS v ({columns})
+                        WHERE {cls(cls.id)}=v.{id.escaped} AND {filter.fields()}"""
+            if returning:
+                query = f"""WITH "{cls.name}" AS (
+                                {query}
+                                RETURNING {cls.select()}
+                            )
+                            SELECT {join.select()}
+                            FROM "{cls.name}"
+                            {join}"""
+            query = cls.statements.set(key, query)
+
+        params = []
+        for id, update in chunk:
+            params.append(id)
+            params.extend(update.values())
+        cls.db.execute(cursor, query, params+filter.values())
+        log.debug(color.cyan('Total updated %s'), cursor.rowcount)
+
+        if not returning:
+            return result + cursor.rowcount
+        for row in cursor.fetchall():
+            join.row.data(row)
+            item = join.create()
+            result[getattr(item, cls.id)] = item
+        return result
+
+    """
+        Inserts rows in chunks of multi row VALUES inside one transaction
+        Consecutive rows with the same set of fields share a statement
+        Chunks are capped to PARAMS bind parameters
+        Returns list of created objects or inserted row count when
+        returning is False
+    """
+    @classmethod
+    def add_many(cls, rows, chunk_size=1000, returning=True):
+        join = Join(cls)
+        result = [] if returning else 0
+
+        db = None
+        try:
+            db = cls.db.get()
+            cursor = db.cursor()
+            chunk = []
+            shape = None
+            size = chunk_size
+            for data in rows:
+                insert = cls.insert(data)
+                if chunk and (insert.shape() != shape or len(chunk) >= size):
+                    for part in parts(chunk, size):
+                        result = cls.insert_chunk(cursor, join, part, returning, result)
+                    chunk = []
+                shape = insert.shape()
+                size = min(chunk_size, max(1, PARAMS // len(insert.values())))
+                chunk.append(insert)
+            for part in parts(chunk, size):
+                result = cls.insert_chunk(cursor, join, part, returning, result)
+        except Exception as error:
+            if db is not None:
+                cls.db.rollback(db)
+            cls.unique(error)
+            raise error
+        finally:
+            if db is not None:
+                cls.db.commit(db)
+                cls.db.put(db)
+            cls.invalidate()
+
+        return result
+
+    @classmethod
+    def insert_chunk(cls, cursor, join, chunk, returning, result):
+        key = ('add_many', chunk[0].shape(), len(chunk), returning)
+        query = cls.statements.get(key)
+        if query is None:
+            values = ', '.join(['('+chunk[0].fields('%s')+')'] * len(chunk))
+            if returning:
+                # rows are returned in order of VALUES, numbered before join
+                query = f"""WITH "{cls.name}" AS (
+                                INSERT INTO {cls}
+                                ({chunk[0].fields()})
+                                VALUES {values}
+                                RETURNING {cls.select()}
+                            )
+                            SELECT {join.select()}
+                            FROM (SELECT *, ROW_NUMBER() OVER () AS sql_position FROM "{cls.name}") AS "{cls.name}"
+                            {join}
+                            ORDER BY "{cls.name}".sql_position"""
+            else:
+                query = f"""INSERT INTO {cls}
+                            ({chunk[0].fields()})
+                            VALUES {values}"""
+            query = cls.statements.set(key, query)
+
+        params = []
+        for insert in chunk:
+            params.extend(insert.values())
+        cls.db.execute(cursor, query, params)
+        log.debug(color.cyan('Total inserted %s'), cursor.rowcount)
+
+        if not returning:
+            return result + cursor.rowcount
+        for row in cursor.fetchall():
+            join.row.data(row)
+            result.append(join.create())
+        return result
+
+    """
+        Streams rows into table with COPY ... FROM STDIN
+        Values are cast and encoded like in parse, columns are
+        taken from fields or from first row, missing values are NULL
+        Returns count of copied rows
+    """
+    @classmethod
+    def copy_in(cls, rows, fields=None, size=65536):
+        rows = iter(rows)
+        first = None
+        if fields is None:
+            try:
+                first = next(rows)
+            except StopIteration:
+                return 0
+            fields = first.keys()
+        columns = []
+        for field in cls.plan.modes['insert']:
+            if field.name in fields:
+                columns.append(field)
+        if not columns:
+            raise MissingInput()
 
+        key = ('copy_in', tuple(field.name for field in columns))
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""COPY {cls} ({', '.join(field.escaped for field in columns)}) FROM STDIN""")
+
+        stream = Stream(cls.copy_lines(columns, first, rows), size)
+
+        db = None
+        try:
+            db = cls.db.get()
+            cursor = db.cursor()
+            debug(query)
+            cursor.copy_expert(query, stream, size)
+            log.debug(color.cyan('Total copied %s'), stream.count)
+        except Exception as error:
+            if db is not None:
+                cls.db.rollback(db)
+            if stream.error is not None:
+                raise stream.error
+            cls.unique(error)
+            raise error
+        finally:
+            if db is not None:
+                cls.db.commit(db)
+                cls.db.put(db)
+            cls.invalidate()
+
+        return stream.count
 
     @classmethod
+    def copy_lines(cls, columns, first, rows):
+        if first is not None:
+            yield cls.copy_line(columns, first)
+        for data in rows:
+            yield cls.copy_line(columns, data)
+
+    @classmethod
+    def copy_line(cls, columns, data):
+        line = []
+        for field in columns:
+            value = field.format(data[field.name]) if field.name in data else None
+            if value is None:
+                line.append('\\N')
+            else:
+                line.append(value.translate(COPY_ESCAPE))
+        return '\t'.join(line)+'\n'
+
+    """
+        Raises UniqueError when error is violation of
+        <table>_unique_<field>_index unique index
+    """
+    @classmethod
+    def unique(cls, error):
+        match = re.search(r''+cls.name+'_unique_(.*?)_index', str(error))
+        if match is not None and match.lastindex > 0:
+            index = match.group(1)
+            if index in cls.plan.fields:
+                raise UniqueError(index)
+            for field in cls.plan.fields.values():
+                if field.column == index:
+                    raise UniqueError(field.name)
+
+    @classmethod
+    @measured('delete')
     def delete(cls, id, filter=None):
         if filter is None:
             filter = {}
 
         filter = cls.where(filter)
+        query, values = cls.query_delete(id, filter)
         try:
             db = cls.db.get()
             cursor = db.cursor()
-            cursor.execute(*debug(f"""DELETE FROM {cls}
-                                    WHERE {filter.fields()} AND {cls(cls.id)}=%s""",
-                                  filter.values(id)))
+            cls.db.execute(cursor, query, values)
             return bool(cursor.rowcount)
         except Exception as error:
             raise error
         finally:
-            db.commit()
+            cls.db.commit(db)
             cls.db.put(db)
+            cls.invalidate()
+            cls.forget([id])
 
         return False
 
+    """
+        Returns sql and params of delete, shared with adelete
+    """
+    @classmethod
+    def query_delete(cls, id, filter):
+        key = ('delete', filter.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""DELETE FROM {cls}
+                                    WHERE {filter.fields()} AND {cls(cls.id)}=%s""")
+        return query, filter.values(id)
+
+    """
+        Deletes rows with given ids in one query, returns deleted ids
+    """
+    @classmethod
+    def delete_many(cls, ids, filter=None):
+        if filter is None:
+            filter = {}
+
+        filter = cls.where(filter)
+        ids = cls.ids(ids)
+        key = ('delete_many', filter.shape())
+        query = cls.statements.get(key)
+        if query is None:
+            query = cls.statements.set(key, f"""DELETE FROM {cls}
+                                    WHERE {cls(cls.id)} = ANY(%s) AND {filter.fields()}
+                                    RETURNING {cls(cls.id)}""")
+        db = None
+        try:
+            db = cls.db.get()
+            cursor = db.cursor()
+            cls.db.execute(cursor, query, [ids,]+filter.values())
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            if db is not None:
+                cls.db.commit(db)
+                cls.db.put(db)
+            cls.invalidate()
+            cls.forget(ids)
+
+    """
+        Awaitable get, all, filter, add, save and delete on cls.adb
+        Same arguments, sql and results as synchronous methods
+    """
+    @classmethod
+    @measured('get')
+    async def aget(cls, id, filter=None, rows='object'):
+        join = Join(cls)
+        version = None
+        if cls.entities is not None:
+            version = cls.stamp(join)
+            if not filter:
+                row = cls.entities.get(cls.pk(id), version[1])
+                if row is not None:
+                    join.row.data(row)
+                    return join.create(rows)
+        if filter is None:
+            filter = {}
+        filter = cls.where(filter)
+        query, values = cls.query_get(id, join, filter)
+        records, _ = await cls.aread(query, values, join)
+        if records:
+            cls.remember(id, join, records[0], version, True)
+            join.row.data(records[0])
+            return join.create(rows)
+
+    @classmethod
+    @measured('all')
+    async def aall(cls, filter=None, order=None, search=None, limit=None, rows='object'):
+        if filter is None:
+            filter = {}
+        if order is None:
+            order = {}
+        if search is None:
+            search = {}
+        join = Join(cls, filter, search)
+
+        query, values = cls.query_all(join, order, limit)
+
+        result = []
+        records, _ = await cls.aread(query, values, join, slow=True)
+        for row in records:
+            join.row.data(row)
+            result.append(join.create(rows))
+        return result
+
+    @classmethod
+    @measured('filter')
+    async def afilter(cls, page=1, limit=100, filter=None, order=None, search=None, cursor=None, count='exact', rows='object'):
+        if count not in ('exact', 'estimate', 'none', 'cached'):
+            raise InvalidValue('Invalid count '+str(count))
+        if filter is None:
+            filter = {}
+        if order is None:
+            order = {}
+        if search is None:
+            search = {}
+
+        join = Join(cls, filter, search)
+
+        limit = min(limit, 100)
+
+        if cursor is not None:
+            query, values, rest = cls.query_seek(join, limit, order, cursor)
+            records, _ = await cls.aread(query, values, join, slow=True)
+            if rest is not None and len(records) <= limit:
+                query, values, _ = cls.query_seek(join, limit-len(records), order, cursor, rest)
+                records = records+(await cls.aread(query, values, join, slow=True))[0]
+            return cls.page(join, records, limit, rows)
+
+        offset = (page-1)*limit
+
+        result = Result()
+
+        query, values, total = cls.query_filter(join, order, limit, offset, count)
+        exact = count == 'exact' or (count == 'cached' and total is None)
+
+        records, estimate = await cls.aread(query, values, join, count == 'estimate', True)
+        for row in records:
+            join.row.data(row)
+            if exact and result.total is None:
+                result.total = join.row('total')
+            result.add(join.create(rows))
+        if count == 'estimate':
+            result.total = estimate
+
+        return cls.total(result, join, count, total, offset)
+
+    """
+        Awaitable fetch on cls.adb
+    """
+    @classmethod
+    async def aread(cls, query, values, join, estimate=False, slow=False):
+        key, cached = cls.recall(query, values, join)
+        if cached is not None:
+            return cached
+
+        total = None
+        db = await cls.adb.get()
+        try:
+            cursor = db.cursor()
+            started = time.perf_counter()
+            await cls.adb.execute(cursor, query, values)
+            log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
+            records = await cursor.fetchall()
+            duration = time.perf_counter()-started
+            if estimate:
+                total = await cls.aestimate(cursor, join)
+            mark('fetch')
+            await db.commit()
+            mark('execute')
+        finally:
+            await cls.adb.put(db)
+
+        if slow and slowlog is not None and duration >= slowlog.threshold:
+            await cls.acapture(query, values, duration)
+        if key is not None:
+            cls.cache.set(key, (records, total))
+        return records, total
+
+    @classmethod
+    async def acapture(cls, query, values, duration):
+        plan = None
+        error = None
+        if slowlog.due():
+            db = await cls.adb.get()
+            try:
+                cursor = db.cursor()
+                await cls.adb.execute(cursor, cls.query_explain(query), values)
+                plan = (await cursor.fetchone())[0]
+            except Exception as exception:
+                error = str(exception)
+            finally:
+                await db.rollback()
+                await cls.adb.put(db)
+        slowlog.record(label(cls), query, values, duration, plan, error)
+
+    @classmethod
+    async def aestimate(cls, cursor, join):
+        if not join.filters and not join.searchs:
+            await cls.adb.execute(cursor, *cls.query_reltuples())
+            row = await cursor.fetchone()
+            if row is not None and row[0] >= 0:
+                return int(row[0])
+        await cls.adb.execute(cursor, *cls.query_estimate(join))
+        return cls.plan_rows((await cursor.fetchone())[0])
+
+    @classmethod
+    @measured('save')
+    async def asave(cls, id, data, filter=None):
+        if filter is None:
+            filter = {}
+        filter = cls.where(filter)
+        join = Join(cls)
+        query, values = cls.query_save(id, join, cls.update(data), filter)
+        version = cls.stamp(join)
+        try:
+            row = await cls.afetch(query, values, 'one')
+        except Exception as error:
+            cls.unique(error)
+            raise error
+        finally:
+            cls.invalidate()
+        cls.remember(id, join, row, version)
+        if row is not None:
+            join.row.data(row)
+            return join.create()
+
+    @classmethod
+    @measured('add')
+    async def aadd(cls, data):
+        join = Join(cls)
+        query, values = cls.query_add(join, cls.insert(data))
+        try:
+            row = await cls.afetch(query, values, 'one')
+        except Exception as error:
+            cls.unique(error)
+            raise error
+        finally:
+            cls.invalidate()
+        cls.remember(None, join, row)
+        if row is not None:
+            join.row.data(row)
+            return join.create()
+
+    @classmethod
+    @measured('delete')
+    async def adelete(cls, id, filter=None):
+        if filter is None:
+            filter = {}
+        filter = cls.where(filter)
+        query, values = cls.query_delete(id, filter)
+        try:
+            return bool(await cls.afetch(query, values, 'count'))
+        finally:
+            cls.invalidate()
+            cls.forget([id])
+
+    """
+        Executes query on connection of cls.adb and commits,
+        returns all rows, first row for fetch='one' or
+        row count for fetch='count'
+    """
+    @classmethod
+    async def afetch(cls, query, values, fetch='all'):
+        db = await cls.adb.get()
+        try:
+            cursor = db.cursor()
+            await cls.adb.execute(cursor, query, values)
+            log.debug(color.cyan('Total fetched %s'), cursor.rowcount)
+            if fetch == 'count':
+                result = cursor.rowcount
+            elif fetch == 'one':
+                result = await cursor.fetchone()
+            else:
+                result = await cursor.fetchall()
+            mark('fetch')
+            await db.commit()
+            mark('execute')
+        finally:
+            await cls.adb.put(db)
+        return result
+
 class Row:
     def __init__(self):
         self.position = 0
@@ -747,6 +3185,7 @@ class Join():
 
 
         self.table = table
+        self.hydrators = {}
 
         self.row = Row()
         self.row.offset(self.table.name, self.table)
@@ -785,6 +3224,22 @@ class Join():
             filter = '1=1'
         return '('+search+ ') AND ('+filter+')'
 
+    """
+        Returns write generations of joined tables
+    """
+    def generations(self):
+        return tuple(GENERATIONS.get(str(join['table']), 0) for join in self.table.joins.values())
+
+    """
+        Returns names of table and joined tables
+    """
+    def tables(self):
+        return [str(self.table)]+[str(join['table']) for join in self.table.joins.values()]
+
+    def shape(self):
+        return (tuple((key, where.shape()) for key, where in self.searchs.items()),
+                tuple((key, where.shape()) for key, where in self.filters.items()))
+
     def values(self):
         result = []
         for where in self.searchs.values():
@@ -802,12 +3257,39 @@ class Join():
             return '\n'.join([self.clause(join) for join in self.table.joins.keys()])
         return ''
 
-    def create(self):
-        item = self.table.create(self.row(self.table.name))
-        if self.table.joins:
-            for name, join in self.table.joins.items():
-                setattr(item, name, join['table'].create(self.row(join['table'].name)))
-        return item
+    """
+        Returns current row as object of table type with joined objects
+        set as attributes, or as tuple, dict or namedtuple with joined
+        rows nested under join names
+    """
+    def create(self, rows='object'):
+        if rows == 'object':
+            item = self.table.create(self.row(self.table.name))
+            if self.table.joins:
+                for name, join in self.table.joins.items():
+                    setattr(item, name, join['table'].create(self.row(join['table'].name)))
+            return item
+
+        hydrate = self.hydrators.get(rows)
+        if hydrate is None:
+            if rows not in ROWS:
+                raise InvalidValue('Invalid rows '+str(rows))
+            hydrate = self.hydrators[rows] = (
+                self.table.plan.hydrator(None, rows=rows, joins=tuple(self.table.joins)),
+                tuple((join['table'].name, join['table'].plan.hydrator(None, rows=rows)) for join in self.table.joins.values())
+            )
+        main, joins = hydrate
+        return main(self.row(self.table.name), tuple(create(self.row(name)) for name, create in joins))
+
+    """
+        Returns order expression and direction separately for keyset
+    """
+    def keyset(self, field, method, order=None):
+        column = self.order(field, method, order)
+        for direction in ('ASC', 'DESC'):
+            if column.endswith(' '+direction):
+                return column[:-len(direction)-1], direction
+        return column, 'ASC'
 
     def order(self, field, method, order=None):
         if order is None:
@@ -833,19 +3315,179 @@ class Join():
 def select(*args):
     return ','.join([item for item in args if str(item).strip() != ''])
 
+COPY_ESCAPE = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+"""
+    Read only file like object over iterator of lines
+    used as COPY source, keeps at most about size characters buffered
+"""
+class Stream:
+    def __init__(self, lines, size=65536):
+        self.lines = lines
+        self.size = size
+        self.buffer = ''
+        self.count = 0
+        self.error = None
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while length < size:
+            try:
+                line = next(self.lines)
+            except StopIteration:
+                break
+            except Exception as error:
+                # psycopg2 reports it as canceled copy, keep original
+                self.error = error
+                raise
+            self.count += 1
+            chunks.append(line)
+            length += len(line)
+        buffer = ''.join(chunks)
+        self.buffer = buffer[size:]
+        return buffer[:size]
+
+"""
+    Opaque keyset pagination token holding last row order key and id
+"""
+class Cursor:
+    @staticmethod
+    def encode(position):
+        return base64.urlsafe_b64encode(json.dumps(list(position)).encode()).decode()
+    @staticmethod
+    def decode(token):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        except Exception:
+            raise InvalidValue('Invalid cursor '+str(token))
+        if not isinstance(position, list) or not position or len(position) > 2:
+            raise InvalidValue('Invalid cursor '+str(token))
+        return position
+
 class Result():
     def __init__(self, total=None):
         self.total = total
         self.items = []
+        self.missing = []
+        self.cursor = None
     def add(self, item):
         #log.debug('Adding %s', item)
         self.items.append(item)
 
+"""
+    Returns True when query is to be logged, False at cost of one
+    level check while DEBUG is disabled on root logger, else True
+    for 1 in LOG_SAMPLE queries
+"""
+def logged():
+    if not log.root.isEnabledFor(log.DEBUG):
+        return False
+    return LOG_SAMPLE <= 1 or next(QUERIES) % LOG_SAMPLE == 0
+
+"""
+    Executes query on cursor, logged with duration and rowcount
+"""
+def execute(cursor, query, params=None):
+    sampled = logged()
+    if not sampled and tracer is None:
+        result = cursor.execute(query, params)
+        mark('execute')
+        return result
+    return observe(cursor, query, params, run, sampled)
+
+def run(cursor, query, params=None, comment=''):
+    return cursor.execute(commented(query, comment, params), params)
+
+"""
+    Executes query with run(cursor, query, params, comment)
+    between hooks of sql.tracer, logged when sampled
+"""
+def observe(cursor, query, params, run, sampled):
+    span = tracer.start(query, params) if tracer is not None else None
+    started = time.perf_counter()
+    try:
+        return run(cursor, query, params, span.comment() if span is not None and tracer.comment else '')
+    finally:
+        mark('execute')
+        if sampled:
+            emit(query, params, time.perf_counter()-started, cursor.rowcount)
+        if span is not None:
+            tracer.finish(span, cursor.rowcount, sys.exc_info()[1])
+
+"""
+    Logs query not run through execute, Db.execute or
+    AsyncDb.execute and returns (query, params) unchanged
+"""
 def debug(query, params=None):
     if params is None:
         params = []
-    params_debug = tuple(["'"+str(param)+"'" for param in params])
+    if logged():
+        emit(query, params)
+    return (query, params)
+
+"""
+    Logs DEBUG record with sql, params, duration in seconds and
+    rowcount attributes, message text is formatted only when
+    a handler emits the record
+"""
+def emit(query, params, duration=None, rowcount=None):
+    log.debug('%s', Statement(query, params, duration, rowcount),
+              extra={'sql': query, 'params': params, 'duration': duration, 'rowcount': rowcount})
+
+class Statement:
+    def __init__(self, query, params, duration=None, rowcount=None):
+        self.query = query
+        self.params = params
+        self.duration = duration
+        self.rowcount = rowcount
 
+    def __str__(self):
+        text = ' '.join(self.query.split())
+        if self.params:
+            text += ' '+repr(self.params)
+        return text+self.summary()
+
+    def summary(self):
+        text = ''
+        if self.duration is not None:
+            text += ' (%.3f ms' % (self.duration*1000)
+            if self.rowcount is not None and self.rowcount >= 0:
+                text += ', %s rows' % self.rowcount
+            text += ')'
+        return text
+
+"""
+    Logging formatter printing sql of query records on several
+    highlighted lines, colors None highlights only when stream
+    (default sys.stderr) is a terminal
+    handler.setFormatter(sql.Formatter())
+"""
+class Formatter(log.Formatter):
+    def __init__(self, fmt=None, datefmt=None, colors=None, stream=None):
+        super().__init__(fmt, datefmt)
+        if colors is None:
+            if stream is None:
+                stream = sys.stderr
+            colors = hasattr(stream, 'isatty') and stream.isatty()
+        self.colors = colors
+
+    def format(self, record):
+        if not self.colors or not isinstance(getattr(record, 'sql', None), str):
+            return super().format(record)
+        statement = Statement(record.sql, record.params, record.duration, record.rowcount)
+        record = log.makeLogRecord(record.__dict__)
+        record.msg = highlight(record.sql, record.params)+color.magenta(statement.summary().strip())
+        record.args = None
+        return super().format(record)
+
+"""
+    Returns query with params inlined and keywords colored
+"""
+def highlight(query, params=None):
+    if params is None:
+        params = []
     query_debug = '\n'
     for line in query.splitlines():
         query_debug += line.strip()+" "
@@ -881,28 +3523,163 @@ def debug(query, params=None):
     query_debug = query_debug.replace('VALUES', '\n'+color.cyan('VALUES'))
     query_debug += '\n'
 
-    if query_debug.count('%s') != len(params_debug):
-        log.error(color.red('Query contains %s params while %s provided'), query_debug.count('%s'), len(params_debug))
-        log.debug(query_debug)
-        log.debug(params_debug)
-    else:
-        log.debug(query_debug % params_debug)
-
-    return (query, params)
-
-def query(source, params=None):
+    if isinstance(params, (list, tuple)) and query_debug.count('%s') == len(params):
+        return query_debug % tuple(["'"+str(param)+"'" for param in params])
+    return query_debug+str(params)+'\n'
+
+"""
+    Returns nodes of EXPLAIN (FORMAT JSON) output as (depth, node)
+"""
+def plan_nodes(plan):
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    if isinstance(plan, list):
+        plan = plan[0]
+    if 'Plan' in plan:
+        plan = plan['Plan']
+    nodes = []
+    stack = [(0, plan)]
+    while stack:
+        depth, node = stack.pop()
+        nodes.append((depth, node))
+        for child in reversed(node.get('Plans', [])):
+            stack.append((depth+1, child))
+    return nodes
+
+"""
+    Returns problems found in EXPLAIN (FORMAT JSON) output as
+    {'problem', 'node', 'relation', 'message'} dicts
+    'seq_scan' sequential scan reading rows or more rows, scanned
+    rows are counted only with ANALYZE, else planned rows
+    'disk_sort' sort spilled to disk, needs ANALYZE
+    'estimate' planned and actual rows differ ratio times or more,
+    needs ANALYZE
+"""
+def plan_problems(plan, rows=10000, ratio=10):
+    problems = []
+    for _, node in plan_nodes(plan):
+        relation = node.get('Relation Name')
+        actual = node.get('Actual Rows')
+        if node['Node Type'] == 'Seq Scan':
+            if actual is not None:
+                scanned = (actual+node.get('Rows Removed by Filter', 0))*node.get('Actual Loops', 1)
+            else:
+                scanned = node.get('Plan Rows', 0)
+            if scanned >= rows:
+                problems.append({'problem': 'seq_scan',
+                                 'node': node['Node Type'],
+                                 'relation': relation,
+                                 'message': 'Sequential scan of '+str(relation)+' reads '+str(int(scanned))+' rows'})
+        if node.get('Sort Space Type') == 'Disk' or 'external' in node.get('Sort Method', ''):
+            problems.append({'problem': 'disk_sort',
+                             'node': node['Node Type'],
+                             'relation': relation,
+                             'message': 'Sort spilled to disk using '+str(node.get('Sort Space Used'))+' kB'})
+        if actual is not None:
+            planned = node.get('Plan Rows', 0)
+            if max(planned, actual) / max(min(planned, actual), 1) >= ratio:
+                problems.append({'problem': 'estimate',
+                                 'node': node['Node Type'],
+                                 'relation': relation,
+                                 'message': 'Planned '+str(planned)+' rows, actual '+str(actual)+' rows'})
+    return problems
+
+"""
+    Returns plan shape, one line per node with node type, join
+    type, index and relation, without costs and row counts
+"""
+def plan_shape(plan):
+    lines = []
+    for depth, node in plan_nodes(plan):
+        line = node['Node Type']
+        if 'Join Type' in node:
+            line += ' ('+node['Join Type']+')'
+        if 'Index Name' in node:
+            line += ' using '+node['Index Name']
+        if 'Relation Name' in node:
+            line += ' on '+node['Relation Name']
+        lines.append('  '*depth+line)
+    return lines
+
+"""
+    Returns plan shapes of representative calls, JSON friendly
+    calls: {name: (table, explain arguments)}
+    sql.plan_snapshot({'active users': (Users, {'method': 'filter', 'filter': {'status': 'active'}})})
+"""
+def plan_snapshot(calls):
+    return {name: plan_shape(table.explain(**arguments)) for name, (table, arguments) in calls.items()}
+
+"""
+    Returns {name: unified diff} of calls whose plan shape differs
+    between snapshots old and new, empty when plans keep shape
+"""
+def plan_diff(old, new):
+    result = {}
+    for name in sorted(set(old) | set(new)):
+        before = old.get(name, [])
+        after = new.get(name, [])
+        if before != after:
+            result[name] = '\n'.join(difflib.unified_diff(before, after, name+' (old)', name+' (new)', lineterm=''))
+    return result
+
+"""
+    Splits rows into parts of size rows, shorter tail into parts of
+    power of two lengths, so chunked statements take few shapes
+"""
+def parts(rows, size):
+    start = 0
+    while start < len(rows):
+        count = min(len(rows)-start, size)
+        if count < size:
+            count = 1 << (count.bit_length()-1)
+        yield rows[start:start+count]
+        start += count
+
+"""
+    Returns True when sql only reads and can run on a replica
+"""
+def reads(source):
+    return bool(re.match(r'\s*(SELECT|WITH|SHOW|VALUES|TABLE)\b', source, re.I)) \
+        and not re.search(r'\b(INSERT|UPDATE|DELETE|MERGE|NEXTVAL|SETVAL)\b|\bFOR\s+(NO\s+KEY\s+)?(SHARE|KEY\s+SHARE)\b|\bINTO\b', source, re.I)
+
+"""
+    primary: True runs source on primary, False on replica,
+    None decides by source text when db has replicas
+"""
+@measured('query', table=False)
+def query(source, params=None, primary=None):
+    if primary is None:
+        primary = not reads(source)
     db_ = None
     try:
-        db_ = db.get()
+        db_ = db.get(read=not primary)
         cursor = db_.cursor()
-        cursor.execute(*debug(source, params))
-        log.debug(color.cyan('Total %s'), cursor.rowcount)
+        execute(cursor, source, params)
         # if cursor.rowcount > 0:
         if cursor.description:
             result = []
             for record in cursor:
                 result.append(record)
+            mark('fetch')
             return result
     finally:
-        db_.commit()
+        db.commit(db_)
         db.put(db_)
+
+@measured('query', table=False)
+async def aquery(source, params=None, db=None):
+    if db is None:
+        db = adb
+    db_ = await db.get()
+    try:
+        cursor = db_.cursor()
+        await db.execute(cursor, source, params)
+        result = None
+        if cursor.description:
+            result = await cursor.fetchall()
+            mark('fetch')
+        await db_.commit()
+        mark('execute')
+        return result
+    finally:
+        await db.put(db_)
@@ -0,0 +1,89 @@
+import pytest
+import sql
+from conftest import UserTable, GroupTable, ItemTable, UniqueItemTable, Item
+
+
+def test_add_many_returns_objects_in_order(truncate):
+    users = UserTable.add_many([
+        {'username': 'a', 'fullname': 'A', 'status': 'active'},
+        {'username': 'b', 'fullname': 'B', 'status': 'inactive'},
+        {'username': 'c', 'fullname': 'C', 'status': 'active'},
+    ])
+    assert [user.username for user in users] == ['a', 'b', 'c']
+    assert all(isinstance(user.id, int) for user in users)
+
+
+def test_add_many_returns_objects_in_insert_order_of_given_ids(truncate):
+    class NumberedTable(sql.Table):
+        schema = 'test'
+        name = 'items'
+        type = Item
+        fields = {'id': {'type': 'int'}, 'title': {}}
+    items = NumberedTable.add_many([{'id': 30, 'title': 'a'}, {'id': 10, 'title': 'b'}, {'id': 20, 'title': 'c'}])
+    assert [(item.id, item.title) for item in items] == [(30, 'a'), (10, 'b'), (20, 'c')]
+
+
+def test_add_many_tail_statement_sizes(truncate):
+    ItemTable.statements.clear()
+    ItemTable.add_many(({'title': str(number)} for number in range(16)), chunk_size=8)
+    sizes = sorted(key[2] for key in ItemTable.statements.items if key[0] == 'add_many')
+    assert sizes == [8]
+    items = ItemTable.add_many(({'title': str(number)} for number in range(7)), chunk_size=8)
+    sizes = sorted(key[2] for key in ItemTable.statements.items if key[0] == 'add_many')
+    assert sizes == [1, 2, 4, 8]
+    assert [item.title for item in items] == [str(number) for number in range(7)]
+    assert len(ItemTable.all()) == 23
+
+
+def test_parts():
+    assert [len(part) for part in sql.parts(list(range(23)), 8)] == [8, 8, 4, 2, 1]
+    assert list(sql.parts([], 8)) == []
+
+
+def test_add_many_hydrates_joins(truncate):
+    group = GroupTable.add({'name': 'admins'})
+    users = UserTable.add_many([
+        {'username': 'a', 'status': 'active', 'group_id': group.id},
+        {'username': 'b', 'status': 'active', 'group_id': group.id},
+    ])
+    assert users[0].group.name == 'admins'
+    assert users[1].group.name == 'admins'
+
+
+def test_add_many_chunks(truncate):
+    items = ItemTable.add_many(({'title': str(number)} for number in range(25)), chunk_size=10)
+    assert len(items) == 25
+    assert len(ItemTable.all()) == 25
+
+
+def test_add_many_mixed_field_sets(truncate):
+    items = ItemTable.add_many([
+        {'title': 'a'},
+        {'title': 'b', 'active': True},
+        {'title': 'c'},
+    ])
+    assert [item.title for item in items] == ['a', 'b', 'c']
+    assert items[1].active is True
+    assert items[0].active is None
+
+
+def test_add_many_without_returning_returns_count(truncate):
+    count = ItemTable.add_many([{'title': 'a'}, {'title': 'b'}], returning=False)
+    assert count == 2
+    assert len(ItemTable.all()) == 2
+
+
+def test_add_many_empty(truncate):
+    assert ItemTable.add_many([]) == []
+    assert ItemTable.add_many([], returning=False) == 0
+
+
+def test_add_many_validates_rows(truncate):
+    with pytest.raises(sql.InvalidValue):
+        UserTable.add_many([{'username': 'a', 'status': 'unknown'}])
+
+
+def test_add_many_rolls_back_on_error(truncate):
+    with pytest.raises(sql.UniqueError):
+        UniqueItemTable.add_many([{'code': 'x'}, {'code': 'y'}, {'code': 'x'}], chunk_size=2)
+    assert UniqueItemTable.all() == []
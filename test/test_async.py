@@ -0,0 +1,208 @@
+import os
+import asyncio
+import pytest
+import sql
+
+from conftest import UserTable, GroupTable, CategoryTable, UniqueItemTable
+
+pytest.importorskip('psycopg')
+pytest.importorskip('psycopg_pool')
+
+
+@pytest.fixture
+def adb(db, monkeypatch):
+    monkeypatch.setattr(sql.Table, 'adb', None)
+    database = sql.AsyncDb(os.environ['TEST_DSN'], size=4)
+    assert sql.Table.adb is database
+    monkeypatch.setattr(sql, 'adb', database)
+    return database
+
+
+def run(adb, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await adb.close()
+    return asyncio.run(main())
+
+
+def test_add_get(adb, truncate):
+    async def main():
+        group = await GroupTable.aadd({'name': 'admins'})
+        user = await UserTable.aadd({'username': 'john', 'status': 'active', 'group_id': group.id})
+        fetched = await UserTable.aget(user.id)
+        return group, user, fetched
+
+    group, user, fetched = run(adb, main())
+    assert user.id is not None
+    assert fetched.username == 'john'
+    assert fetched.group.name == 'admins'
+    assert UserTable.get(user.id).username == 'john'
+
+
+def test_get_missing_and_filter(adb, truncate):
+    user = UserTable.add({'username': 'john', 'status': 'active'})
+
+    async def main():
+        return (
+            await UserTable.aget(user.id+1000),
+            await UserTable.aget(user.id, filter={'status': 'inactive'}),
+            await UserTable.aget(user.id, rows='dict'),
+        )
+
+    missing, filtered, row = run(adb, main())
+    assert missing is None
+    assert filtered is None
+    assert row['username'] == 'john'
+
+
+def test_all(adb, truncate):
+    for name in ('a', 'b', 'c'):
+        UserTable.add({'username': name, 'status': 'active'})
+    UserTable.add({'username': 'd', 'status': 'inactive'})
+
+    async def main():
+        return await UserTable.aall(filter={'status': 'active'}, order={'field': 'username', 'method': 'asc'}, limit=2)
+
+    users = run(adb, main())
+    assert [user.username for user in users] == ['a', 'b']
+
+
+def test_filter_matches_sync(adb, truncate):
+    for position in range(5):
+        UserTable.add({'username': 'user'+str(position), 'status': 'active'})
+
+    async def main():
+        return (
+            await UserTable.afilter(page=2, limit=2, order={'field': 'username', 'method': 'asc'}),
+            await UserTable.afilter(limit=2, count='none'),
+            await UserTable.afilter(limit=2, count='estimate'),
+        )
+
+    page, uncounted, estimated = run(adb, main())
+    expected = UserTable.filter(page=2, limit=2, order={'field': 'username', 'method': 'asc'})
+    assert page.total == expected.total == 5
+    assert [user.username for user in page.items] == [user.username for user in expected.items]
+    assert uncounted.total is None
+    assert len(uncounted.items) == 2
+    assert isinstance(estimated.total, int)
+
+
+def test_filter_cursor(adb, truncate):
+    for position in range(5):
+        UserTable.add({'username': 'user'+str(position)})
+
+    async def main():
+        usernames = []
+        cursor = True
+        while cursor:
+            result = await UserTable.afilter(limit=2, cursor=cursor, order={'field': 'username', 'method': 'asc'})
+            usernames.extend(user.username for user in result.items)
+            cursor = result.cursor
+        return usernames
+
+    assert run(adb, main()) == ['user0', 'user1', 'user2', 'user3', 'user4']
+
+
+def test_filter_cursor_null_keys(adb, truncate):
+    for position in range(5):
+        UserTable.add({'username': 'user'+str(position), 'fullname': 'name' if position % 2 else None})
+
+    async def main():
+        usernames = []
+        cursor = True
+        while cursor:
+            result = await UserTable.afilter(limit=2, cursor=cursor, order={'field': 'fullname', 'method': 'asc'})
+            usernames.extend(user.username for user in result.items)
+            cursor = result.cursor
+        return usernames
+
+    assert run(adb, main()) == ['user1', 'user3', 'user0', 'user2', 'user4']
+
+
+def test_save_delete(adb, truncate):
+    user = UserTable.add({'username': 'john', 'status': 'active'})
+
+    async def main():
+        saved = await UserTable.asave(user.id, {'fullname': 'John Doe'})
+        skipped = await UserTable.asave(user.id, {'fullname': 'X'}, filter={'status': 'inactive'})
+        deleted = await UserTable.adelete(user.id)
+        again = await UserTable.adelete(user.id)
+        return saved, skipped, deleted, again
+
+    saved, skipped, deleted, again = run(adb, main())
+    assert saved.fullname == 'John Doe'
+    assert skipped is None
+    assert deleted is True
+    assert again is False
+    assert UserTable.get(user.id) is None
+
+
+def test_json_and_array(adb, truncate):
+    async def main():
+        category = await CategoryTable.aadd({'name': {'en': 'Books', 'ka': 'წიგნები'}, 'tags': ['a', 'b']})
+        return await CategoryTable.aget(category.id)
+
+    category = run(adb, main())
+    assert category.name == {'en': 'Books', 'ka': 'წიგნები'}
+    assert category.tags == ['a', 'b']
+
+
+def test_unique_error(adb, truncate):
+    UniqueItemTable.add({'code': 'x'})
+
+    async def main():
+        await UniqueItemTable.aadd({'code': 'x'})
+
+    with pytest.raises(sql.UniqueError):
+        run(adb, main())
+
+
+def test_shares_statement_cache(adb, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.get(user.id)
+    hits = UserTable.statements.hits
+
+    async def main():
+        return await UserTable.aget(user.id)
+
+    run(adb, main())
+    assert UserTable.statements.hits == hits+1
+
+
+def test_aquery(adb, truncate):
+    UserTable.add({'username': 'john'})
+
+    async def main():
+        rows = await sql.aquery('SELECT username FROM test.users WHERE username = %s', ['john'])
+        none = await sql.aquery('UPDATE test.users SET fullname = %s', ['x'])
+        return rows, none
+
+    rows, none = run(adb, main())
+    assert rows == [('john',)]
+    assert none is None
+
+
+def test_prepare(db, truncate, monkeypatch):
+    monkeypatch.setattr(sql.Table, 'adb', None)
+    database = sql.AsyncDb(os.environ['TEST_DSN'], size=1, prepare=2)
+    user = UserTable.add({'username': 'john'})
+
+    async def main():
+        users = []
+        for _ in range(3):
+            users.append(await UserTable.aget(user.id))
+        conn = await database.get()
+        try:
+            cursor = conn.cursor()
+            await cursor.execute('SELECT COUNT(*) FROM pg_prepared_statements')
+            count = (await cursor.fetchone())[0]
+            await conn.commit()
+        finally:
+            await database.put(conn)
+        return users, count
+
+    users, count = run(database, main())
+    assert [item.username for item in users] == ['john'] * 3
+    assert 1 <= count <= 2
@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+
+import bench
+
+
+def test_report():
+    db = bench.UserTable.db
+    report = bench.run(seconds=0.0001, repeat=1, rows=10, count=10)
+    names = set(report['benchmarks'])
+    assert {'Table.where', 'Table.parse', 'Table.create', 'Join.__init__', 'Row.get', 'sql.debug', 'Table.all'} <= names
+    assert {'Table.value.'+type for type in ('string', 'int', 'float', 'bool', 'date', 'json')} <= names
+    assert {'Join.create.object', 'Join.create.tuple'} <= names
+    assert report['benchmarks']['Table.all']['ns_per_row'] > 0
+    assert 'ns_per_row' not in report['benchmarks']['Table.where']
+    assert report['memory']['bytes_per_row.object'] > 0
+    assert json.loads(json.dumps(report)) == report
+    assert bench.UserTable.db is db
+
+
+def test_compare():
+    baseline = {'benchmarks': {'a': {'ns_per_call': 100, 'ns_per_row': 10}}, 'memory': {'bytes_per_row.object': 200}}
+    report = {'benchmarks': {'a': {'ns_per_call': 120, 'ns_per_row': 20}, 'b': {'ns_per_call': 1}},
+              'memory': {'bytes_per_row.object': 300}}
+    assert bench.compare(report, baseline) == [('a', 'ns_per_row', 10, 20), ('bytes_per_row.object', 'bytes', 200, 300)]
+    assert bench.compare(report, baseline, tolerance=1) == []
+
+
+def test_baseline_is_stored(monkeypatch):
+    monkeypatch.setattr(bench.UserTable, 'db', None)
+    with open(os.path.join(os.path.dirname(bench.__file__), 'baseline.json')) as file:
+        baseline = json.load(file)
+    assert set(baseline['benchmarks']) == set(bench.benchmarks(rows=1))
@@ -0,0 +1,162 @@
+import threading
+import pytest
+import sql
+
+from conftest import UserTable, GroupTable, CategoryTable
+
+
+@pytest.fixture
+def cached(db, monkeypatch):
+    cache = sql.Cache(size=1024*1024, ttl=60)
+    monkeypatch.setattr(UserTable, 'cache', cache)
+    return cache
+
+
+def test_get_hit(cached, truncate):
+    user = UserTable.add({'username': 'john'})
+    assert UserTable.get(user.id).username == 'john'
+    sql.query('UPDATE test.users SET username = %s', ['changed'])
+    assert UserTable.get(user.id).username == 'john'
+    assert cached.hits == 1
+    assert cached.misses == 1
+    assert UserTable.get(user.id, rows='tuple')[1] == 'john'
+
+
+def test_missing_row_is_cached(cached, truncate):
+    assert UserTable.get(1) is None
+    assert UserTable.get(1) is None
+    assert cached.hits == 1
+
+
+def test_params_are_part_of_key(cached, truncate):
+    first = UserTable.add({'username': 'john'})
+    second = UserTable.add({'username': 'jane'})
+    assert UserTable.get(first.id).username == 'john'
+    assert UserTable.get(second.id).username == 'jane'
+    assert cached.misses == 2
+
+
+def test_write_invalidates(cached, truncate):
+    user = UserTable.add({'username': 'john'})
+    assert [item.username for item in UserTable.all()] == ['john']
+    UserTable.save(user.id, {'username': 'johnny'})
+    assert [item.username for item in UserTable.all()] == ['johnny']
+    UserTable.add({'username': 'jane'})
+    assert UserTable.filter().total == 2
+    UserTable.delete(user.id)
+    assert UserTable.filter().total == 1
+    assert cached.hits == 0
+
+
+def test_joined_table_write_invalidates(cached, truncate):
+    group = GroupTable.add({'name': 'admins'})
+    user = UserTable.add({'username': 'john', 'group_id': group.id})
+    assert UserTable.get(user.id).group.name == 'admins'
+    GroupTable.save(group.id, {'name': 'owners'})
+    assert UserTable.get(user.id).group.name == 'owners'
+
+
+def test_bulk_writes_invalidate(cached, truncate):
+    assert UserTable.all() == []
+    UserTable.add_many([{'username': 'a'}, {'username': 'b'}])
+    assert len(UserTable.all()) == 2
+    UserTable.copy_in([{'username': 'c'}], fields=['username'])
+    assert len(UserTable.all()) == 3
+    ids = [user.id for user in UserTable.all()]
+    UserTable.delete_many(ids[:1])
+    assert len(UserTable.all()) == 2
+
+
+def test_cached_values_are_copies(db, monkeypatch, truncate):
+    monkeypatch.setattr(CategoryTable, 'cache', sql.Cache())
+    category = CategoryTable.add({'name': {'en': 'Books', 'ka': 'x'}, 'tags': ['a']})
+    CategoryTable.get(category.id).tags.append('b')
+    assert CategoryTable.get(category.id).tags == ['a']
+
+
+def test_transaction_bypasses_and_invalidates(db, cached, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.get(user.id)
+    with db.transaction():
+        UserTable.save(user.id, {'username': 'johnny'})
+        assert UserTable.get(user.id).username == 'johnny'
+        generation = sql.GENERATIONS[str(UserTable)]
+    assert sql.GENERATIONS[str(UserTable)] == generation+1
+    assert UserTable.get(user.id).username == 'johnny'
+
+
+def test_ttl(db, monkeypatch, truncate):
+    cache = sql.Cache(ttl=0)
+    monkeypatch.setattr(UserTable, 'cache', cache)
+    UserTable.all()
+    UserTable.all()
+    assert cache.hits == 0
+
+
+def test_lru_eviction_by_size():
+    results = sql.Results(size=10)
+    results.set('a', b'12345', 60)
+    results.set('b', b'12345', 60)
+    assert results.get('a') == b'12345'
+    results.set('c', b'123', 60)
+    assert results.get('b') is None
+    assert results.get('a') == b'12345'
+    assert results.evictions == 1
+    assert results.used == 8
+    results.set('d', b'x' * 11, 60)
+    assert results.get('d') is None
+
+
+def test_pluggable_store(db, monkeypatch, truncate):
+    class Store:
+        def __init__(self):
+            self.items = {}
+        def get(self, key):
+            return self.items.get(key)
+        def set(self, key, value, ttl):
+            self.items[key] = value
+        def clear(self):
+            self.items.clear()
+
+    store = Store()
+    cache = sql.Cache(store=store)
+    monkeypatch.setattr(UserTable, 'cache', cache)
+    UserTable.all()
+    UserTable.all()
+    assert len(store.items) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': None, 'bytes': None}
+
+
+def test_disabled_by_default(truncate):
+    assert UserTable.cache is None
+    assert GroupTable.cache is None
+
+
+def test_read_during_commit_is_not_cached(db, cached, monkeypatch, truncate):
+    user = UserTable.add({'username': 'old'})
+    commit = db.commit
+    reads = []
+
+    def racing(conn):
+        # read from another thread after UPDATE, before its COMMIT
+        if threading.current_thread() is threading.main_thread() and not reads:
+            thread = threading.Thread(target=lambda: reads.append(UserTable.all()))
+            thread.start()
+            thread.join()
+        commit(conn)
+
+    monkeypatch.setattr(db, 'commit', racing)
+    UserTable.save(user.id, {'username': 'new'})
+    assert [item.username for item in reads[0]] == ['old']
+    assert [item.username for item in UserTable.all()] == ['new']
+
+
+def test_clear_resets_stats():
+    cache = sql.Cache(size=40)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, [key])
+        cache.get(key)
+    cache.get('a')
+    assert cache.stats()['evictions'] > 0
+    cache.clear()
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
@@ -0,0 +1,75 @@
+import datetime
+import pytest
+import sql
+from conftest import ItemTable, ProductTable, CategoryTable, UserTable, GroupTable
+
+numpy = pytest.importorskip('numpy')
+
+
+def test_columns_typed_arrays(truncate):
+    ItemTable.add_many([
+        {'title': 'a', 'active': True, 'created_at': '2024-01-01'},
+        {'title': 'b', 'active': False, 'created_at': '2024-01-02'},
+    ], returning=False)
+    result = ItemTable.columns(order={'field': 'id', 'method': 'asc'})
+    assert result['id'].dtype == numpy.int64
+    assert result['active'].dtype == numpy.bool_
+    assert result['created_at'].dtype == numpy.dtype('datetime64[us]')
+    assert result['title'].dtype == object
+    assert list(result['title']) == ['a', 'b']
+    assert result['created_at'][1] == numpy.datetime64('2024-01-02')
+
+
+def test_columns_selected_fields_only(truncate):
+    ProductTable.add_many([{'title': 'a', 'price': 1.5}, {'title': 'b', 'price': 2.5}], returning=False)
+    result = ProductTable.columns(fields=['price'])
+    assert list(result) == ['price']
+    assert result['price'].dtype == numpy.float64
+    assert result['price'].sum() == 4.0
+
+
+def test_columns_masks_nulls(truncate):
+    ItemTable.add_many([{'title': 'a', 'active': True}, {'title': 'b'}], returning=False)
+    result = ItemTable.columns(fields=['active', 'created_at'], order={'field': 'id', 'method': 'asc'})
+    assert list(result['active'].mask) == [False, True]
+    assert result['created_at'].mask.all()
+
+
+def test_columns_batches(truncate):
+    ItemTable.add_many([{'title': str(n), 'active': n % 2 == 0} for n in range(25)], returning=False)
+    result = ItemTable.columns(fields=['id', 'active'], itersize=4)
+    assert len(result['id']) == 25
+    assert result['active'].sum() == 13
+
+
+def test_columns_object_fields_decoded(truncate):
+    CategoryTable.add({'name': {'en': 'a'}, 'tags': ['x', 'y']})
+    result = CategoryTable.columns(fields=['name', 'tags'])
+    assert result['name'][0] == {'en': 'a'}
+    assert result['tags'][0] == ['x', 'y']
+
+
+def test_columns_filter_on_join(truncate):
+    group = GroupTable.add({'name': 'admins'})
+    UserTable.add_many([{'username': 'a', 'status': 'active', 'group_id': group.id}, {'username': 'b', 'status': 'active'}], returning=False)
+    result = UserTable.columns(fields=['username'], filter={'group': {'name': 'admins'}})
+    assert list(result['username']) == ['a']
+
+
+def test_columns_unknown_field_raises(truncate):
+    with pytest.raises(sql.UnknownField):
+        ItemTable.columns(fields=['nope'])
+
+
+def test_columns_empty(truncate):
+    result = ItemTable.columns(fields=['id'])
+    assert len(result['id']) == 0
+
+
+def test_columns_grow_over_batches(db, truncate):
+    ItemTable.add_many([{'title': str(n), 'active': n < 3 or None} for n in range(11)], returning=False)
+    with db.transaction(readonly=True):
+        result = ItemTable.columns(fields=['title', 'active'], order={'field': 'id', 'method': 'asc'}, itersize=2)
+    assert list(result['title']) == [str(n) for n in range(11)]
+    assert list(result['active'].mask) == [False]*3+[True]*8
+    assert len(result['active'].data) == 11
@@ -0,0 +1,78 @@
+import sql
+import pytest
+from conftest import UserTable, CategoryTable, EncodedItemTable, ItemTable
+
+
+# ---------------------------------------------------------------------------
+# Encoding (no database)
+# ---------------------------------------------------------------------------
+
+def test_copy_line_escapes_special_characters():
+    columns = [ItemTable.plan.fields['title']]
+    assert ItemTable.copy_line(columns, {'title': 'a\tb\nc\\d'}) == 'a\\tb\\nc\\\\d\n'
+
+
+def test_copy_line_null_for_missing_and_none():
+    columns = [ItemTable.plan.fields['title'], ItemTable.plan.fields['active']]
+    assert ItemTable.copy_line(columns, {'active': None}) == '\\N\t\\N\n'
+
+
+def test_copy_line_formats_arrays_like_parse():
+    columns = [CategoryTable.plan.fields['tags']]
+    fields, values = CategoryTable.parse({'tags': ['a', 'b']}, 'insert')
+    assert CategoryTable.copy_line(columns, {'tags': ['a', 'b']}) == values[0]+'\n'
+
+
+def test_stream_reads_bounded_chunks():
+    stream = sql.Stream(iter(['ab\n', 'cd\n', 'ef\n']), size=4)
+    assert stream.read(4) == 'ab\nc'
+    assert stream.read(4) == 'd\nef'
+    assert stream.read(4) == '\n'
+    assert stream.read(4) == ''
+    assert stream.count == 3
+
+
+# ---------------------------------------------------------------------------
+# COPY into database
+# ---------------------------------------------------------------------------
+
+def test_copy_in_inserts_rows(truncate):
+    count = UserTable.copy_in({'username': 'u'+str(n), 'status': 'active'} for n in range(100))
+    assert count == 100
+    assert len(UserTable.all()) == 100
+
+
+def test_copy_in_casts_and_encodes(truncate):
+    EncodedItemTable.copy_in([{'title': 'x', 'secret': 'hidden'}])
+    item = EncodedItemTable.all()[0]
+    assert item.secret == 'hidden'      # encoder uppercased, decoder lowercased
+    conn = sql.db.get()
+    cursor = conn.cursor()
+    cursor.execute('SELECT secret FROM test.encoded_items')
+    assert cursor.fetchone()[0] == 'HIDDEN'
+    conn.commit()
+    sql.db.put(conn)
+
+
+def test_copy_in_arrays_and_json(truncate):
+    CategoryTable.copy_in([{'name': {'en': 'Tab\there'}, 'tags': ['a', 'b']}])
+    category = CategoryTable.all()[0]
+    assert category.name == {'en': 'Tab\there'}
+    assert category.tags == ['a', 'b']
+
+
+def test_copy_in_explicit_fields(truncate):
+    ItemTable.copy_in([{'title': 'a', 'active': True}], fields=['title'])
+    item = ItemTable.all()[0]
+    assert item.title == 'a'
+    assert item.active is None
+
+
+def test_copy_in_validates(truncate):
+    with pytest.raises(sql.InvalidValue):
+        UserTable.copy_in([{'username': 'a', 'status': 'active'}, {'username': 'b', 'status': 'bad'}])
+    assert UserTable.all() == []
+
+
+def test_copy_in_empty(truncate):
+    assert ItemTable.copy_in([]) == 0
@@ -0,0 +1,88 @@
+import threading
+import pytest
+import sql
+from conftest import ItemTable
+
+
+def test_invalid_count_raises():
+    with pytest.raises(sql.InvalidValue):
+        ItemTable.filter(count='maybe')
+
+
+def test_count_exact_is_default(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(5)], returning=False)
+    result = ItemTable.filter(limit=2)
+    assert result.total == 5
+    assert len(result.items) == 2
+
+
+def test_count_none(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(5)], returning=False)
+    result = ItemTable.filter(limit=2, count='none')
+    assert result.total is None
+    assert [item.title for item in result.items] == ['4', '3']
+
+
+def test_count_estimate_unfiltered(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(50)], returning=False)
+    sql.query('ANALYZE test.items')
+    result = ItemTable.filter(limit=2, count='estimate')
+    assert result.total == 50
+
+
+def test_count_estimate_filtered(truncate):
+    ItemTable.add_many([{'title': str(n), 'active': n < 10} for n in range(50)], returning=False)
+    sql.query('ANALYZE test.items')
+    result = ItemTable.filter(limit=2, filter={'active': True}, count='estimate')
+    assert isinstance(result.total, int)
+    assert 0 < result.total <= 50
+
+
+def test_count_cached_reuses_total(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(5)], returning=False)
+    ItemTable.totals.clear()
+    assert ItemTable.filter(limit=2, count='cached').total == 5
+    ItemTable.add({'title': 'new'})
+    assert ItemTable.filter(limit=2, count='cached').total == 5
+    assert ItemTable.filter(limit=2, page=2, count='cached').total == 5
+    assert ItemTable.filter(limit=2).total == 6
+
+
+def test_count_cached_per_filter_values(truncate):
+    ItemTable.add_many([{'title': 'a'}, {'title': 'a'}, {'title': 'b'}], returning=False)
+    ItemTable.totals.clear()
+    assert ItemTable.filter(filter={'title': 'a'}, count='cached').total == 2
+    assert ItemTable.filter(filter={'title': 'b'}, count='cached').total == 1
+
+
+def test_count_cached_expires(truncate, monkeypatch):
+    ItemTable.add_many([{'title': 'a'}], returning=False)
+    ItemTable.totals.clear()
+    monkeypatch.setattr(ItemTable, 'count_ttl', 0)
+    assert ItemTable.filter(count='cached').total == 1
+    ItemTable.add({'title': 'b'})
+    assert ItemTable.filter(count='cached').total == 2
+
+
+def test_count_cached_not_stored_past_last_page(truncate):
+    ItemTable.add_many([{'title': 'a'}], returning=False)
+    ItemTable.totals.clear()
+    ItemTable.filter(page=5, count='cached')
+    assert ItemTable.filter(count='cached').total == 1
+
+
+def test_totals_threads():
+    totals = sql.Totals(size=8)
+
+    def work(number):
+        for position in range(2000):
+            key = (number, position % 16)
+            if totals.get(key) is None:
+                totals.set(key, position, 60)
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(totals.items) == 8
@@ -122,3 +122,61 @@ def test_create_extra_fields_set_via_setattr():
     obj = ExtraTable.create((1, 'world'))
     assert hasattr(obj, 'name')
     assert obj.name == 'world'
+
+
+# --- generated hydrators ---
+
+class CountingObj:
+    calls = 0
+
+    def __init__(self, id=None):
+        CountingObj.calls += 1
+        self.id = id
+
+
+class NoInitTable(sql.Table):
+    name = 'noinit'
+    type = CountingObj
+    init = False
+    fields = {
+        'id':   {'type': 'int'},
+        'tags': {'array': True},
+        'meta': {'type': 'json'},
+    }
+
+
+class OddNamesTable(sql.Table):
+    name = 'odd'
+    type = IdOnlyObj
+    fields = {
+        'id':         {'type': 'int'},
+        'first-name': {},
+        'class':      {},
+    }
+
+
+def test_hydrator_cached_per_type():
+    first = SimpleTable.plan.hydrator(SimpleObj)
+    assert SimpleTable.plan.hydrator(SimpleObj) is first
+    assert SimpleTable.plan.hydrator(IdOnlyObj) is not first
+
+
+def test_create_without_init_skips_constructor():
+    CountingObj.calls = 0
+    obj = NoInitTable.create((7, '{a,b}', '{"k": 1}'))
+    assert CountingObj.calls == 0
+    assert isinstance(obj, CountingObj)
+    assert obj.id == 7
+    assert obj.tags == ['a', 'b']
+    assert obj.meta == {'k': 1}
+
+
+def test_create_non_identifier_field_names():
+    obj = OddNamesTable.create((1, 'John', 'x'))
+    assert getattr(obj, 'first-name') == 'John'
+    assert getattr(obj, 'class') == 'x'
+
+
+def test_create_array_none_passthrough():
+    obj = WithArrayTable.create((1, None))
+    assert obj.tags is None
@@ -0,0 +1,180 @@
+import pytest
+import sql
+
+from conftest import UserTable, GroupTable
+
+
+@pytest.fixture
+def entities(db, monkeypatch):
+    entities = sql.Entities(size=100)
+    monkeypatch.setattr(UserTable, 'entities', entities)
+    return entities
+
+
+def test_get_hit(entities, truncate):
+    user = UserTable.add({'username': 'john'})
+    sql.query('UPDATE test.users SET username = %s', ['changed'])
+    assert UserTable.get(user.id).username == 'john'
+    assert UserTable.get(str(user.id), rows='tuple')[1] == 'john'
+    assert entities.hits == 2
+    assert entities.misses == 0
+
+
+def test_miss_fills(entities, truncate):
+    user = UserTable.add({'username': 'john'})
+    entities.clear()
+    assert UserTable.get(user.id).username == 'john'
+    sql.query('UPDATE test.users SET username = %s', ['changed'])
+    assert UserTable.get(user.id).username == 'john'
+    assert entities.misses == 1
+    assert entities.hits == 1
+
+
+def test_save_writes_through(entities, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.save(user.id, {'username': 'johnny'})
+    assert UserTable.get(user.id).username == 'johnny'
+    assert entities.hits == 1
+
+
+def test_delete_evicts(entities, truncate):
+    first = UserTable.add({'username': 'john'})
+    second = UserTable.add({'username': 'jane'})
+    UserTable.delete(first.id)
+    assert UserTable.get(first.id) is None
+    UserTable.delete_many([second.id])
+    assert UserTable.get(second.id) is None
+    assert entities.hits == 0
+
+
+def test_save_many_evicts(entities, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.save_many({user.id: {'username': 'johnny'}})
+    assert UserTable.get(user.id).username == 'johnny'
+
+
+def test_filter_bypasses(entities, truncate):
+    user = UserTable.add({'username': 'john'})
+    sql.query('UPDATE test.users SET username = %s', ['changed'])
+    assert UserTable.get(user.id, filter={'username': 'john'}) is None
+    assert UserTable.get(user.id, filter={'username': 'changed'}).username == 'changed'
+    assert UserTable.get(user.id).username == 'changed'
+
+
+def test_joined_table_write_misses(entities, truncate):
+    group = GroupTable.add({'name': 'admins'})
+    user = UserTable.add({'username': 'john', 'group_id': group.id})
+    assert UserTable.get(user.id).group.name == 'admins'
+    GroupTable.save(group.id, {'name': 'owners'})
+    assert UserTable.get(user.id).group.name == 'owners'
+
+
+def test_transaction(db, entities, truncate):
+    user = UserTable.add({'username': 'john'})
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            UserTable.save(user.id, {'username': 'johnny'})
+            assert UserTable.get(user.id).username == 'johnny'
+            raise RuntimeError()
+    assert UserTable.get(user.id).username == 'john'
+    with db.transaction():
+        UserTable.save(user.id, {'username': 'johnny'})
+        UserTable.get(user.id)
+        assert not entities.items
+    assert UserTable.get(user.id).username == 'johnny'
+
+
+def test_fill_racing_save_is_skipped(entities, monkeypatch, truncate):
+    user = UserTable.add({'username': 'old'})
+    entities.clear()
+    fetch = UserTable.fetch
+
+    def racing(query, values, join, estimate=False, slow=False):
+        # save commits after get selected old row, before get fills
+        records = fetch(query, values, join, estimate, slow)
+        monkeypatch.setattr(UserTable, 'fetch', fetch)
+        UserTable.save(user.id, {'username': 'new'})
+        return records
+
+    monkeypatch.setattr(UserTable, 'fetch', racing)
+    assert UserTable.get(user.id).username == 'old'
+    assert UserTable.get(user.id).username == 'new'
+    assert entities.hits == 1
+
+
+def test_failed_commit_is_not_cached(db, entities, monkeypatch, truncate):
+    user = UserTable.add({'username': 'old'})
+    commit = db.commit
+    failed = []
+
+    def failing(conn):
+        conn.rollback()
+        failed.append(conn)
+        raise RuntimeError()
+
+    monkeypatch.setattr(db, 'commit', failing)
+    with pytest.raises(RuntimeError):
+        UserTable.save(user.id, {'username': 'new'})
+    monkeypatch.setattr(db, 'commit', commit)
+    db.put(failed[0])
+    assert UserTable.get(user.id).username == 'old'
+
+
+def test_stale_fill():
+    entities = sql.Entities(size=2)
+    version = entities.version()
+    entities.evict(1)
+    entities.set(1, (), ('old',), version, False)
+    assert entities.get(1, ()) is None
+    entities.set(1, (), ('new',), entities.version(), False)
+    assert entities.get(1, ()) == ('new',)
+    version = entities.version()
+    entities.evict(2)
+    entities.evict(3)
+    entities.evict(4)
+    entities.set(2, (), ('old',), version, False)
+    assert entities.get(2, ()) is None
+
+
+def test_saves_writing_through_out_of_order(entities, monkeypatch, truncate):
+    user = UserTable.add({'username': 'old'})
+    remember = UserTable.remember
+    later = []
+
+    def delayed(id, join, row, version=None, fill=False):
+        # first save writes through after the second one
+        if not later:
+            later.append(lambda: remember(id, join, row, version, fill))
+            UserTable.save(user.id, {'username': 'new'})
+            later.pop()()
+        else:
+            remember(id, join, row, version, fill)
+
+    monkeypatch.setattr(UserTable, 'remember', delayed)
+    UserTable.save(user.id, {'username': 'older'})
+    monkeypatch.setattr(UserTable, 'remember', remember)
+    assert UserTable.get(user.id).username == 'new'
+
+
+def test_stale_write_evicts():
+    entities = sql.Entities()
+    version = entities.version()
+    entities.set(1, (), ('new',))
+    entities.set(1, (), ('old',), version)
+    assert entities.get(1, ()) is None
+
+
+def test_lru_eviction():
+    entities = sql.Entities(size=2)
+    entities.set(1, (), ('a',))
+    entities.set(2, (), ('b',))
+    assert entities.get(1, ()) == ('a',)
+    entities.set(3, (), ('c',))
+    assert entities.get(2, ()) is None
+    assert entities.get(1, ()) == ('a',)
+    assert entities.get(1, (1,)) is None
+    assert entities.evictions == 1
+
+
+def test_disabled_by_default(truncate):
+    assert UserTable.entities is None
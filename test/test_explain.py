@@ -0,0 +1,86 @@
+import json
+import pytest
+import sql
+
+from conftest import UserTable, GroupTable
+
+
+def test_same_sql_as_method(db, monkeypatch, truncate):
+    spans = sql.Spans()
+    monkeypatch.setattr(sql, 'tracer', spans)
+    arguments = {'filter': {'username': 'jo'}, 'search': {'fullname': 'J'}, 'order': {'field': 'username'}}
+    UserTable.filter(page=2, limit=10, **arguments)
+    UserTable.explain('filter', page=2, limit=10, **arguments)
+    UserTable.all(**arguments)
+    UserTable.explain('all', **arguments)
+    UserTable.get(1, filter={'status': 'active'})
+    UserTable.explain('get', id=1, filter={'status': 'active'})
+    spans = list(spans.spans)
+    for run, explained in zip(spans[::2], spans[1::2]):
+        assert explained.query == 'EXPLAIN (FORMAT JSON) '+run.query
+        assert explained.params == run.params
+
+
+def test_plan(db, truncate):
+    plan = UserTable.explain(filter={'username': 'jo'})
+    assert plan[0]['Plan']['Node Type'] == 'Limit'
+    assert 'Actual Rows' not in plan[0]['Plan']
+    shape = sql.plan_shape(plan)
+    assert shape[0] == 'Limit'
+    assert any(line.strip().endswith('on users') for line in shape)
+    assert any(line.strip().endswith('on groups') for line in shape)
+
+
+def test_analyze(db, truncate):
+    UserTable.add({'username': 'john'})
+    plan = UserTable.explain('all', analyze=True)
+    assert plan[0]['Plan']['Actual Rows'] == 1
+    assert 'Shared Hit Blocks' in plan[0]['Plan']
+    assert 'Execution Time' in plan[0]
+
+
+def test_seek(db, truncate):
+    cursor = sql.Cursor.encode((10,))
+    shape = sql.plan_shape(UserTable.explain(cursor=cursor))
+    assert shape[0] == 'Limit'
+
+
+def test_invalid(db):
+    with pytest.raises(sql.MissingInput):
+        UserTable.explain('get')
+    with pytest.raises(sql.InvalidValue):
+        UserTable.explain('delete')
+    with pytest.raises(sql.InvalidValue):
+        UserTable.explain(count='wrong')
+
+
+def test_problems():
+    plan = [{'Plan': {'Node Type': 'Sort', 'Sort Method': 'external merge', 'Sort Space Type': 'Disk',
+                      'Sort Space Used': 2048, 'Plan Rows': 50000, 'Actual Rows': 50000, 'Actual Loops': 1,
+                      'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'users', 'Plan Rows': 10,
+                                 'Actual Rows': 50000, 'Rows Removed by Filter': 1000, 'Actual Loops': 1}]}}]
+    problems = sql.plan_problems(json.dumps(plan))
+    assert [(problem['problem'], problem['node']) for problem in problems] == [
+        ('disk_sort', 'Sort'),
+        ('seq_scan', 'Seq Scan'),
+        ('estimate', 'Seq Scan'),
+    ]
+    assert problems[1]['relation'] == 'users'
+    assert problems[1]['message'] == 'Sequential scan of users reads 51000 rows'
+    assert sql.plan_problems(plan, rows=100000, ratio=10000) == [problems[0]]
+    planned = [{'Plan': {'Node Type': 'Seq Scan', 'Relation Name': 'users', 'Plan Rows': 20000}}]
+    assert [problem['problem'] for problem in sql.plan_problems(planned)] == ['seq_scan']
+
+
+def test_snapshot_diff(db, truncate):
+    calls = {'users by name': (UserTable, {'method': 'filter', 'filter': {'username': 'jo'}}),
+             'group': (GroupTable, {'method': 'get', 'id': 1})}
+    snapshot = sql.plan_snapshot(calls)
+    assert set(snapshot) == {'users by name', 'group'}
+    assert json.loads(json.dumps(snapshot)) == snapshot
+    assert sql.plan_diff(snapshot, sql.plan_snapshot(calls)) == {}
+    changed = dict(snapshot, group=['Seq Scan on groups'])
+    diff = sql.plan_diff(snapshot, changed)
+    assert list(diff) == ['group']
+    assert '+Seq Scan on groups' in diff['group']
+    assert list(sql.plan_diff(snapshot, {'group': snapshot['group']})) == ['users by name']
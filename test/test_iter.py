@@ -0,0 +1,54 @@
+import os
+import pytest
+import sql
+from conftest import UserTable, GroupTable, ItemTable
+
+
+@pytest.fixture
+def single(db, truncate, monkeypatch):
+    database = sql.Db(os.environ['TEST_DSN'], size=1)
+    monkeypatch.setattr(ItemTable, 'db', database)
+    yield database
+    database.pool.closeall()
+
+
+def test_iter_yields_all_rows(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(25)], returning=False)
+    items = list(ItemTable.iter(itersize=10))
+    assert len(items) == 25
+    assert [item.title for item in items] == [item.title for item in ItemTable.all()]
+
+
+def test_iter_applies_filter_order_and_limit(truncate):
+    ItemTable.add_many([{'title': 'a', 'active': True}, {'title': 'b', 'active': False}, {'title': 'c', 'active': True}])
+    items = ItemTable.iter(filter={'active': True}, order={'field': 'title', 'method': 'asc'})
+    assert [item.title for item in items] == ['a', 'c']
+    assert len(list(ItemTable.iter(limit=2))) == 2
+
+
+def test_iter_loads_joins(truncate):
+    group = GroupTable.add({'name': 'admins'})
+    UserTable.add({'username': 'a', 'status': 'active', 'group_id': group.id})
+    assert next(UserTable.iter()).group.name == 'admins'
+
+
+def test_iter_is_lazy(single):
+    generator = ItemTable.iter()
+    # connection is not taken until iteration starts
+    assert ItemTable.all() == []
+    generator.close()
+
+
+def test_iter_releases_connection_on_break(single):
+    ItemTable.add_many([{'title': str(n)} for n in range(5)], returning=False)
+    for item in ItemTable.iter(itersize=2):
+        break
+    assert len(ItemTable.all()) == 5
+
+
+def test_iter_releases_connection_on_close(single):
+    ItemTable.add_many([{'title': str(n)} for n in range(5)], returning=False)
+    generator = ItemTable.iter(itersize=2)
+    next(generator)
+    generator.close()
+    assert len(ItemTable.all()) == 5
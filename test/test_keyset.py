@@ -0,0 +1,117 @@
+import pytest
+import sql
+from conftest import UserTable, GroupTable, ItemTable
+
+
+def pages(table, **kwargs):
+    titles = []
+    cursor = True
+    while cursor is not None:
+        result = table.filter(cursor=cursor, **kwargs)
+        titles.append([item.title for item in result.items])
+        cursor = result.cursor
+    return titles
+
+
+# ---------------------------------------------------------------------------
+# Cursor token (no database)
+# ---------------------------------------------------------------------------
+
+def test_cursor_round_trip():
+    token = sql.Cursor.encode(('2024-01-01 00:00:00', '5'))
+    assert sql.Cursor.decode(token) == ['2024-01-01 00:00:00', '5']
+
+
+def test_cursor_invalid_token_raises():
+    with pytest.raises(sql.InvalidValue):
+        sql.Cursor.decode('not a token')
+
+
+def test_join_keyset_splits_direction():
+    join = sql.Join(UserTable)
+    assert join.keyset('id', 'desc') == ('users."id"', 'DESC')
+    assert join.keyset('id', None, {'field': 'group.name'}) == ('groups."name"', 'ASC')
+
+
+# ---------------------------------------------------------------------------
+# Keyset pagination
+# ---------------------------------------------------------------------------
+
+def test_keyset_default_order_is_id_desc(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(5)])
+    assert pages(ItemTable, limit=2) == [['4', '3'], ['2', '1'], ['0']]
+
+
+def test_keyset_last_page_has_no_cursor(truncate):
+    ItemTable.add_many([{'title': 'a'}, {'title': 'b'}])
+    result = ItemTable.filter(cursor=True, limit=2)
+    assert len(result.items) == 2
+    assert result.cursor is None
+
+
+def test_keyset_order_with_ties(truncate):
+    ItemTable.add_many([{'title': title} for title in ['b', 'a', 'b', 'a', 'c']])
+    result = pages(ItemTable, limit=2, order={'field': 'title', 'method': 'asc'})
+    assert [title for page in result for title in page] == ['a', 'a', 'b', 'b', 'c']
+
+
+def test_keyset_date_order(truncate):
+    ItemTable.add_many([{'title': str(day), 'created_at': '2024-01-0'+str(day)} for day in [3, 1, 2]])
+    result = pages(ItemTable, limit=1, order={'field': 'created_at', 'method': 'desc'})
+    assert result == [['3'], ['2'], ['1']]
+
+
+def test_keyset_with_filter(truncate):
+    ItemTable.add_many([{'title': str(n), 'active': n % 2 == 0} for n in range(6)])
+    result = pages(ItemTable, limit=2, filter={'active': True})
+    assert result == [['4', '2'], ['0']]
+
+
+def test_keyset_order_on_joined_table(truncate):
+    first = GroupTable.add({'name': 'b'})
+    second = GroupTable.add({'name': 'a'})
+    UserTable.add_many([
+        {'username': 'x', 'status': 'active', 'group_id': first.id},
+        {'username': 'y', 'status': 'active', 'group_id': second.id},
+    ])
+    result = UserTable.filter(cursor=True, limit=1, order={'field': 'group.name', 'method': 'asc'})
+    assert result.items[0].username == 'y'
+    result = UserTable.filter(cursor=result.cursor, limit=1, order={'field': 'group.name', 'method': 'asc'})
+    assert result.items[0].username == 'x'
+
+
+def test_keyset_cursor_order_mismatch_raises(truncate):
+    ItemTable.add_many([{'title': str(n)} for n in range(3)])
+    result = ItemTable.filter(cursor=True, limit=1)
+    with pytest.raises(sql.InvalidValue):
+        ItemTable.filter(cursor=result.cursor, order={'field': 'title'})
+
+
+@pytest.mark.parametrize('method', ['desc', 'asc'])
+def test_keyset_null_keys(truncate, method):
+    users = UserTable.add_many([{'username': str(n), 'fullname': name}
+                                for n, name in enumerate(['b', None, 'a', None, 'c', 'a'])])
+    order = {'field': 'fullname', 'method': method}
+    seen = []
+    cursor = True
+    while cursor is not None:
+        result = UserTable.filter(cursor=cursor, limit=2, order=order)
+        seen.extend(item.id for item in result.items)
+        cursor = result.cursor
+    names = {user.id: user.fullname for user in users}
+    assert sorted(seen) == sorted(names)
+    if method == 'desc':
+        assert [names[id] for id in seen] == [None, None]+sorted('abac', reverse=True)
+    else:
+        assert [names[id] for id in seen] == sorted('abac')+[None, None]
+
+
+@pytest.mark.parametrize('method', ['desc', 'asc'])
+def test_keyset_seek_is_row_comparison(method):
+    order = {'field': 'fullname', 'method': method}
+    cursor = sql.Cursor.encode(('a', '1'))
+    query, values, rest = UserTable.query_seek(sql.Join(UserTable), 10, order, cursor)
+    assert '(users."fullname", users."id") '+('<' if method == 'desc' else '>')+' (%s, %s)' in query
+    assert ' OR ' not in query and 'NULLS' not in query
+    assert values[-3:] == ['a', '1', 11]
+    assert rest == ('nulls' if method == 'asc' else None)
@@ -0,0 +1,69 @@
+import io
+import logging
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+def queries(caplog):
+    return [record for record in caplog.records if hasattr(record, 'sql')]
+
+
+def test_disabled_costs_nothing(db, caplog, monkeypatch, truncate):
+    caplog.set_level(logging.INFO)
+    def fail(*args):
+        raise AssertionError('formatted while disabled')
+    monkeypatch.setattr(sql, 'emit', fail)
+    monkeypatch.setattr(sql, 'highlight', fail)
+    assert sql.debug('SELECT 1', [1]) == ('SELECT 1', [1])
+    UserTable.add({'username': 'john'})
+    assert sql.query('SELECT COUNT(*) FROM test.users')[0][0] == 1
+    assert queries(caplog) == []
+
+
+def test_structured_record(db, caplog, truncate):
+    caplog.set_level(logging.DEBUG)
+    UserTable.add({'username': 'john'})
+    UserTable.add({'username': 'jane'})
+    caplog.clear()
+    UserTable.all()
+    record, = queries(caplog)
+    assert record.sql.lstrip().startswith('SELECT')
+    assert record.params == []
+    assert record.duration > 0
+    assert record.rowcount == 2
+    message = record.getMessage()
+    assert '\n' not in message
+    assert '\033[' not in message
+    assert message.endswith('ms, 2 rows)')
+
+
+def test_query_and_debug(db, caplog, truncate):
+    caplog.set_level(logging.DEBUG)
+    sql.query('SELECT %s', [1])
+    sql.debug('SELECT 2')
+    first, second = queries(caplog)
+    assert (first.sql, first.params, first.rowcount) == ('SELECT %s', [1], 1)
+    assert (second.sql, second.duration) == ('SELECT 2', None)
+
+
+def test_sampling(db, caplog, monkeypatch):
+    caplog.set_level(logging.DEBUG)
+    monkeypatch.setattr(sql, 'LOG_SAMPLE', 3)
+    for _ in range(6):
+        sql.query('SELECT 1')
+    assert len(queries(caplog)) == 2
+
+
+def test_formatter_colors():
+    record = logging.LogRecord('root', logging.DEBUG, __file__, 1, '%s',
+                               (sql.Statement('SELECT * FROM users WHERE id = %s', [1], 0.001, 1),), None)
+    record.__dict__.update(sql='SELECT * FROM users WHERE id = %s', params=[1], duration=0.001, rowcount=1)
+    colored = sql.Formatter(colors=True).format(record)
+    assert '\033[' in colored
+    assert "'1'" in colored
+    assert '1 rows' in colored
+    plain = sql.Formatter(stream=io.StringIO()).format(record)
+    assert plain == "SELECT * FROM users WHERE id = %s [1] (1.000 ms, 1 rows)"
+    assert record.getMessage() == plain
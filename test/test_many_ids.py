@@ -0,0 +1,75 @@
+from conftest import UserTable, GroupTable
+
+
+# ---------------------------------------------------------------------------
+# get_many()
+# ---------------------------------------------------------------------------
+
+def test_get_many_preserves_input_order(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'active'})
+    c = UserTable.add({'username': 'c', 'status': 'active'})
+    result = UserTable.get_many([c.id, a.id, b.id])
+    assert [user.username for user in result.items] == ['c', 'a', 'b']
+    assert result.total == 3
+    assert result.missing == []
+
+
+def test_get_many_reports_missing(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    result = UserTable.get_many([99999, a.id, 88888])
+    assert [user.id for user in result.items] == [a.id]
+    assert result.missing == [99999, 88888]
+
+
+def test_get_many_casts_ids(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    result = UserTable.get_many([str(a.id)])
+    assert result.items[0].id == a.id
+    assert result.missing == []
+
+
+def test_get_many_with_filter(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'inactive'})
+    result = UserTable.get_many([a.id, b.id], filter={'status': 'active'})
+    assert [user.id for user in result.items] == [a.id]
+    assert result.missing == [b.id]
+
+
+def test_get_many_loads_joins(truncate):
+    group = GroupTable.add({'name': 'admins'})
+    a = UserTable.add({'username': 'a', 'status': 'active', 'group_id': group.id})
+    assert UserTable.get_many([a.id]).items[0].group.name == 'admins'
+
+
+def test_get_many_without_order(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'active'})
+    result = UserTable.get_many([b.id, a.id], preserve_order=False)
+    assert sorted(user.id for user in result.items) == [a.id, b.id]
+
+
+def test_get_many_empty(truncate):
+    result = UserTable.get_many([])
+    assert result.items == []
+    assert result.total == 0
+
+
+# ---------------------------------------------------------------------------
+# delete_many()
+# ---------------------------------------------------------------------------
+
+def test_delete_many_returns_deleted_ids(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'active'})
+    c = UserTable.add({'username': 'c', 'status': 'active'})
+    assert sorted(UserTable.delete_many([a.id, c.id, 99999])) == sorted([a.id, c.id])
+    assert [user.id for user in UserTable.all()] == [b.id]
+
+
+def test_delete_many_with_filter(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'inactive'})
+    assert UserTable.delete_many([a.id, b.id], filter={'status': 'inactive'}) == [b.id]
+    assert UserTable.get(a.id) is not None
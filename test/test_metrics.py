@@ -0,0 +1,98 @@
+import os
+import asyncio
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+@pytest.fixture
+def metrics(db, monkeypatch):
+    metrics = sql.Metrics()
+    monkeypatch.setattr(sql, 'metrics', metrics)
+    return metrics
+
+
+def find(metrics, operation, table='test.users'):
+    for item in metrics.snapshot():
+        if item['table'] == table and item['operation'] == operation:
+            return item
+
+
+def test_phases(metrics, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.get(user.id)
+    UserTable.save(user.id, {'username': 'johnny'})
+    UserTable.all()
+    UserTable.filter()
+    UserTable.delete(user.id)
+    for operation in ('get', 'all', 'filter', 'add', 'save'):
+        item = find(metrics, operation)
+        assert item['calls'] == 1
+        assert item['errors'] == 0
+        assert set(item['phases']) == {'build', 'wait', 'execute', 'fetch', 'hydrate', 'total'}
+    get = find(metrics, 'get')['phases']
+    assert get['total']['count'] == 1
+    assert get['total']['sum'] >= get['execute']['sum'] > 0
+    assert get['total']['buckets'][float('inf')] == 1
+    assert set(find(metrics, 'delete')['phases']) == {'build', 'wait', 'execute', 'hydrate', 'total'}
+
+
+def test_errors(metrics, truncate):
+    with pytest.raises(sql.InvalidValue):
+        UserTable.filter(count='wrong')
+    with pytest.raises(Exception):
+        UserTable.add({'username': 'john', 'group_id': 'abc'})
+    assert find(metrics, 'filter')['errors'] == 1
+    assert find(metrics, 'add')['errors'] == 1
+
+
+def test_query_and_nesting(metrics, truncate):
+    sql.query('SELECT 1')
+    item = find(metrics, 'query', '')
+    assert item['calls'] == 1
+    assert 'fetch' in item['phases']
+    with sql.db.transaction():
+        UserTable.add({'username': 'john'})
+    assert find(metrics, 'add')['calls'] == 1
+    assert sql.TIMING.get() is None
+
+
+def test_async(metrics, monkeypatch, truncate):
+    pytest.importorskip('psycopg_pool')
+    monkeypatch.setattr(sql.Table, 'adb', None)
+    adb = sql.AsyncDb(os.environ['TEST_DSN'], size=2)
+    monkeypatch.setattr(sql, 'adb', adb)
+    async def run():
+        try:
+            user = await UserTable.aadd({'username': 'john'})
+            await UserTable.aget(user.id)
+            await sql.aquery('SELECT 1')
+        finally:
+            await adb.close()
+    asyncio.run(run())
+    assert set(find(metrics, 'get')['phases']) == {'build', 'wait', 'execute', 'fetch', 'hydrate', 'total'}
+    assert find(metrics, 'add')['calls'] == 1
+    assert find(metrics, 'query', '')['calls'] == 1
+
+
+def test_prometheus():
+    metrics = sql.Metrics(buckets=(0.1, 1))
+    metrics.record('a"b', 'get', {'execute': 0.05}, 0.5)
+    metrics.record('a"b', 'get', {'execute': 2}, 3, error=True)
+    text = metrics.prometheus()
+    assert 'sql_operations_total{table="a\\"b",operation="get"} 2\n' in text
+    assert 'sql_operation_errors_total{table="a\\"b",operation="get"} 1\n' in text
+    assert 'sql_phase_seconds_bucket{table="a\\"b",operation="get",phase="execute",le="0.1"} 1\n' in text
+    assert 'sql_phase_seconds_bucket{table="a\\"b",operation="get",phase="execute",le="1.0"} 1\n' in text
+    assert 'sql_phase_seconds_bucket{table="a\\"b",operation="get",phase="total",le="+Inf"} 2\n' in text
+    assert 'sql_phase_seconds_sum{table="a\\"b",operation="get",phase="total"} 3.5\n' in text
+    assert 'sql_phase_seconds_count{table="a\\"b",operation="get",phase="total"} 2\n' in text
+    metrics.clear()
+    assert metrics.snapshot() == []
+
+
+def test_disabled_by_default(db, truncate):
+    assert sql.metrics is None
+    UserTable.all()
+    assert sql.TIMING.get() is None
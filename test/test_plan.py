@@ -0,0 +1,109 @@
+import sql
+import pytest
+
+
+class PlanData:
+    def __init__(self):
+        pass
+
+
+class PlanTable(sql.Table):
+    schema = 'shop'
+    name = 'item'
+    type = PlanData
+    fields = {
+        'id':     {'type': 'int', 'insert': False, 'update': False},
+        'name':   {},
+        'alias':  {'field': 'real_col'},
+        'hidden': {'select': False},
+        'status': {'options': ['on', 'off']},
+    }
+
+
+def test_plan_compiled_on_class_creation():
+    assert isinstance(PlanTable.plan, sql.Plan)
+    assert set(PlanTable.plan.fields) == set(PlanTable.fields)
+
+
+def test_plan_table_identifier():
+    assert PlanTable.plan.table == '"shop"."item"'
+
+
+def test_plan_resolves_column_names():
+    field = PlanTable.plan.fields['alias']
+    assert field.column == 'real_col'
+    assert field.escaped == '"real_col"'
+    assert field.reference == 'item."real_col"'
+    assert field.qualified == '"item"."real_col"'
+
+
+def test_plan_default_type_is_string():
+    assert PlanTable.plan.fields['name'].type == 'string'
+    assert 'type' not in PlanTable.fields['name']
+
+
+def test_plan_modes():
+    assert [f.name for f in PlanTable.plan.modes['insert']] == ['name', 'alias', 'hidden', 'status']
+    assert [f.name for f in PlanTable.plan.modes['update']] == ['name', 'alias', 'hidden', 'status']
+    assert [f.name for f in PlanTable.plan.select] == ['id', 'name', 'alias', 'status']
+
+
+def test_plan_options_keep_order():
+    assert PlanTable.plan.fields['status'].options == ['on', 'off']
+
+
+def test_plan_unhashable_options():
+    class Temp(sql.Table):
+        name = 'temp'
+        fields = {'id': {'type': 'int'}, 'tags': {'type': 'json', 'options': [['a'], ['b']]}}
+    assert Temp.plan.fields['tags'].options == [['a'], ['b']]
+
+
+def test_plan_offset_matches_select():
+    assert PlanTable.offset() == 4
+
+
+def test_reassigning_fields_recompiles():
+    class Temp(sql.Table):
+        name = 'temp'
+        fields = {'id': {'type': 'int'}}
+    Temp.fields = {'id': {'type': 'int'}, 'title': {}}
+    assert 'title' in Temp.plan.fields
+    assert Temp.select() == 'temp."id", temp."title"'
+
+
+def test_reassigning_base_schema_recompiles_subclasses():
+    class Base(sql.Table):
+        pass
+    class Child(Base):
+        name = 'child'
+        fields = {'id': {'type': 'int'}}
+    assert str(Child) == '"child"'
+    Base.schema = 'app'
+    assert str(Child) == '"app"."child"'
+
+
+def test_in_place_mutation_recompiles():
+    class Temp(sql.Table):
+        name = 'temp'
+        fields = {'id': {'type': 'int'}}
+    class Child(Temp):
+        pass
+    Temp.fields['title'] = {}
+    assert Temp('title') == '"temp"."title"'
+    assert Child('title') == '"temp"."title"'
+    Temp.fields.update({'body': {}})
+    assert Temp.select() == 'temp."id", temp."title", temp."body"'
+    del Temp.fields['title']
+    with pytest.raises(sql.UnknownField):
+        Temp('title')
+
+
+def test_compile_after_field_config_mutation():
+    class Temp(sql.Table):
+        name = 'temp'
+        fields = {'id': {'type': 'int'}, 'title': {}}
+    Temp.fields['title']['select'] = False
+    assert Temp.plan.fields['title'].select
+    Temp.compile()
+    assert not Temp.plan.fields['title'].select
@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+@pytest.fixture
+def pools(db):
+    created = []
+    def create(size=2, **options):
+        pool = sql.Pool(os.environ['TEST_DSN'], size, **options)
+        created.append(pool)
+        return pool
+    yield create
+    for pool in created:
+        pool.closeall()
+
+
+def test_lifo_reuse(pools):
+    pool = pools(size=3, check=None)
+    first = pool.getconn()
+    second = pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+    assert pool.getconn() is second
+    assert pool.getconn() is first
+    stats = pool.stats()
+    assert stats['in_use'] == 2
+    assert stats['idle'] == 0
+    assert stats['created'] == 2
+
+
+def test_timeout(pools):
+    pool = pools(size=1, timeout=0.05)
+    conn = pool.getconn()
+    start = time.monotonic()
+    with pytest.raises(sql.PoolTimeout):
+        pool.getconn()
+    assert time.monotonic()-start >= 0.05
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['waiters'] == 0
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_fifo_waiters(pools):
+    pool = pools(size=1, timeout=5)
+    conn = pool.getconn()
+    order = []
+
+    def wait(name):
+        got = pool.getconn()
+        order.append(name)
+        time.sleep(0.01)
+        pool.putconn(got)
+
+    threads = []
+    for name in range(4):
+        thread = threading.Thread(target=wait, args=(name,))
+        thread.start()
+        threads.append(thread)
+        while pool.stats()['waiters'] < name+1:
+            time.sleep(0.001)
+
+    pool.putconn(conn)
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3]
+    stats = pool.stats()
+    assert stats['waits'] == 4
+    assert stats['created'] == 1
+    assert sum(stats['wait'].values()) == 5
+
+
+def test_max_uses(pools):
+    pool = pools(size=1, max_uses=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    pool.putconn(conn)
+    assert conn.closed
+    assert pool.getconn() is not conn
+    assert pool.stats()['recycled'] == 1
+
+
+def test_max_age(pools):
+    pool = pools(size=1, max_age=0.02)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    time.sleep(0.03)
+    fresh = pool.getconn()
+    assert fresh is not conn
+    assert conn.closed
+
+
+def test_check_replaces_broken(pools):
+    pool = pools(size=1, check=0)
+    conn = pool.getconn()
+    killer = pool.connect(os.environ['TEST_DSN'])
+    cursor = killer.cursor()
+    cursor.execute('SELECT pg_terminate_backend(%s)', [conn.info.backend_pid])
+    killer.close()
+    pool.putconn(conn)
+    fresh = pool.getconn()
+    assert fresh is not conn
+    cursor = fresh.cursor()
+    cursor.execute('SELECT 1')
+    assert cursor.fetchone() == (1,)
+    assert pool.stats()['failed_checks'] == 1
+
+
+def test_rolls_back_open_transaction(pools):
+    pool = pools(size=1)
+    conn = pool.getconn()
+    conn.cursor().execute('SELECT 1')
+    pool.putconn(conn)
+    assert conn.info.transaction_status == pool.extensions.TRANSACTION_STATUS_IDLE
+
+
+def test_closeall(pools):
+    pool = pools(size=2)
+    conn = pool.getconn()
+    pool.closeall()
+    with pytest.raises(pool.error):
+        pool.getconn()
+    pool.putconn(conn)
+    assert conn.closed
+    assert pool.stats()['opened'] == 0
+
+
+def test_db_uses_pool(db, monkeypatch, truncate):
+    database = sql.Db(os.environ['TEST_DSN'], size=2, pool={'timeout': 1, 'max_uses': 100})
+    monkeypatch.setattr(UserTable, 'db', database)
+    try:
+        user = UserTable.add({'username': 'john'})
+        assert UserTable.get(user.id).username == 'john'
+        assert isinstance(database.pool, sql.Pool)
+        stats = database.pool.stats()
+        assert stats['in_use'] == 0
+        assert stats['idle'] == stats['opened'] == 1
+    finally:
+        database.pool.closeall()
+
+
+def test_default_timeout_is_finite(pools):
+    pool = pools(size=1)
+    assert pool.timeout == 30
@@ -0,0 +1,71 @@
+import os
+import pytest
+import sql
+from conftest import UserTable, ItemTable
+
+
+@pytest.fixture
+def prepared(db, truncate, monkeypatch):
+    database = sql.Db(os.environ['TEST_DSN'], size=1, prepare=2)
+    monkeypatch.setattr(UserTable, 'db', database)
+    monkeypatch.setattr(ItemTable, 'db', database)
+    yield database
+    database.pool.closeall()
+
+
+def server_statements(database):
+    conn = database.get()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM pg_prepared_statements')
+        return sorted(row[0] for row in cursor.fetchall())
+    finally:
+        conn.commit()
+        database.put(conn)
+
+
+def test_disabled_by_default(db):
+    assert db.prepare == 0
+
+
+def test_prepared_statement_reused(prepared):
+    user = UserTable.add({'username': 'john', 'fullname': 'John', 'status': 'active'})
+    UserTable.get(user.id)
+    assert UserTable.get(user.id).username == 'john'
+    assert len(server_statements(prepared)) == 2
+
+
+def test_prepared_filter_returns_rows(prepared):
+    UserTable.add({'username': 'john', 'fullname': 'John', 'status': 'active'})
+    UserTable.add({'username': 'jane', 'fullname': 'Jane', 'status': 'inactive'})
+    result = UserTable.filter(filter={'status': 'active'})
+    assert result.total == 1
+    assert result.items[0].username == 'john'
+
+
+def test_lru_deallocates_oldest(prepared):
+    item = ItemTable.add({'title': 'a'})
+    ItemTable.get(item.id)
+    ItemTable.all()
+    names = server_statements(prepared)
+    assert len(names) == 2
+    assert 'sql_1' not in names
+
+
+def test_closed_connection_invalidated(prepared):
+    ItemTable.add({'title': 'a'})
+    conn = prepared.get()
+    assert conn in prepared.prepared
+    conn.close()
+    prepared.put(conn)
+    assert conn not in prepared.prepared
+    assert len(ItemTable.all()) == 1
+
+
+def test_bulk_chunks_capped_to_bind_parameters(prepared):
+    rows = [{'title': str(number), 'active': True} for number in range(40000)]
+    assert ItemTable.add_many(rows, chunk_size=50000, returning=False) == 40000
+    ids = [row[0] for row in sql.query('SELECT id FROM test.items')]
+    assert ItemTable.save_many({id: {'title': 'x', 'active': False} for id in ids}, chunk_size=50000, returning=False) == 40000
+    sizes = sorted(key[2] for key in ItemTable.statements.items if key[0] == 'add_many')
+    assert max(sizes) == sql.PARAMS // 2
@@ -0,0 +1,135 @@
+import os
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+def named(name):
+    dsn = os.environ['TEST_DSN']
+    if '://' in dsn:
+        return dsn+('&' if '?' in dsn else '?')+'application_name='+name
+    return dsn+' application_name='+name
+
+
+def server(database, read):
+    conn = database.get(read=read)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT current_setting('application_name')")
+        name = cursor.fetchone()[0]
+        conn.commit()
+    finally:
+        database.put(conn)
+    return name
+
+
+@pytest.fixture
+def replicated(db, monkeypatch):
+    created = []
+    def create(**options):
+        database = sql.Db(primary=named('primary'), replicas=[named('replica1'), named('replica2')], size=4, **options)
+        monkeypatch.setattr(UserTable, 'db', database)
+        monkeypatch.setattr(sql, 'db', database)
+        created.append(database)
+        return database
+    yield create
+    for database in created:
+        for pool in [database.pool]+[replica.pool for replica in database.replicas]:
+            if pool is not None:
+                pool.closeall()
+
+
+def record(database, monkeypatch):
+    used = []
+    for position, replica in enumerate(database.replicas):
+        def get(key=None, replica=replica, name='replica'+str(position+1)):
+            used.append(name)
+            return sql.Db.get(replica, key)
+        monkeypatch.setattr(replica, 'get', get)
+    return used
+
+
+def test_requires_config():
+    with pytest.raises(sql.MissingConfig):
+        sql.Db()
+    with pytest.raises(sql.InvalidValue):
+        sql.Db('dbname=x', balance='random')
+
+
+def test_round_robin(replicated):
+    database = replicated()
+    assert [server(database, True) for _ in range(4)] == ['replica1', 'replica2', 'replica1', 'replica2']
+    assert server(database, False) == 'primary'
+    assert database.using == {replica: 0 for replica in database.replicas}
+
+
+def test_least_connections(replicated):
+    database = replicated(balance='least-connections')
+    held = database.get(read=True)
+    try:
+        assert [server(database, True) for _ in range(3)] == ['replica2'] * 3
+    finally:
+        database.put(held)
+    assert database.using == {replica: 0 for replica in database.replicas}
+
+
+def test_table_reads_and_writes(replicated, monkeypatch, truncate):
+    database = replicated()
+    used = record(database, monkeypatch)
+    user = UserTable.add({'username': 'john'})
+    UserTable.save(user.id, {'fullname': 'John'})
+    assert used == []
+    assert UserTable.get(user.id).fullname == 'John'
+    UserTable.all()
+    UserTable.filter()
+    assert used == ['replica1', 'replica2', 'replica1']
+    UserTable.delete(user.id)
+    assert len(used) == 3
+
+
+def test_query_routing(replicated):
+    replicated()
+    assert sql.query("SELECT current_setting('application_name')")[0][0].startswith('replica')
+    assert sql.query("SELECT current_setting('application_name')", primary=True)[0][0] == 'primary'
+    assert sql.query("WITH x AS (SELECT 1) SELECT current_setting('application_name')")[0][0].startswith('replica')
+
+
+def test_reads():
+    assert sql.reads('SELECT * FROM users')
+    assert sql.reads('  with x as (select 1) select * from x')
+    assert not sql.reads('UPDATE users SET name = 1')
+    assert not sql.reads('WITH x AS (DELETE FROM users RETURNING *) SELECT * FROM x')
+    assert not sql.reads('SELECT * FROM users FOR UPDATE')
+    assert not sql.reads('SELECT * FROM users FOR SHARE')
+    assert not sql.reads("SELECT nextval('seq')")
+    assert not sql.reads('SELECT * INTO copy FROM users')
+
+
+def test_sticky(replicated, truncate):
+    database = replicated(sticky=60)
+    assert server(database, True).startswith('replica')
+    UserTable.add({'username': 'john'})
+    assert server(database, True) == 'primary'
+    assert server(database, True) == 'primary'
+    database.written.set((0, None, frozenset()))
+    assert server(database, True).startswith('replica')
+
+
+def test_lsn_replayed(replicated, truncate):
+    database = replicated(lsn=0.1)
+    UserTable.add({'username': 'john'})
+    time, position, replayed = database.written.get()
+    assert position is not None
+    assert server(database, True) == 'replica1'
+    assert database.written.get()[2] == {database.replicas[0]}
+    assert server(database, True) == 'replica2'
+    assert server(database, True) == 'replica1'
+    assert database.written.get() is None
+
+
+def test_lsn_behind_falls_back_to_primary(replicated):
+    database = replicated(lsn=0.05)
+    database.written.set((0, 'FFFFFFFF/0', frozenset()))
+    assert server(database, True) == 'primary'
+    assert database.using == {replica: 0 for replica in database.replicas}
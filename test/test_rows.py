@@ -0,0 +1,80 @@
+import pytest
+import sql
+from conftest import UserTable, GroupTable, CategoryTable, EncodedItemTable
+
+
+def joined_row(rows):
+    join = sql.Join(UserTable)
+    join.row.data((1, 'john', 'John', 'active', 2, 2, 'admins'))
+    return join.create(rows)
+
+
+# ---------------------------------------------------------------------------
+# Join.create (no database)
+# ---------------------------------------------------------------------------
+
+def test_create_tuple_nests_joined_tuple():
+    assert joined_row('tuple') == (1, 'john', 'John', 'active', 2, (2, 'admins'))
+
+
+def test_create_dict_nests_joined_dict():
+    assert joined_row('dict') == {
+        'id': 1, 'username': 'john', 'fullname': 'John', 'status': 'active', 'group_id': 2,
+        'group': {'id': 2, 'name': 'admins'},
+    }
+
+
+def test_create_namedtuple_nests_joined_namedtuple():
+    row = joined_row('namedtuple')
+    assert row.username == 'john'
+    assert row.group.name == 'admins'
+    assert row._fields[-1] == 'group'
+
+
+def test_create_invalid_rows_raises():
+    with pytest.raises(sql.InvalidValue):
+        joined_row('xml')
+
+
+def test_raw_rows_apply_json_and_arrays():
+    join = sql.Join(CategoryTable)
+    join.row.data((1, '{"en": "a"}', '{x,y}'))
+    assert join.create('dict') == {'id': 1, 'name': {'en': 'a'}, 'tags': ['x', 'y']}
+
+
+def test_raw_rows_apply_decoder():
+    join = sql.Join(EncodedItemTable)
+    join.row.data((1, 'title', 'SECRET'))
+    assert join.create('tuple') == (1, 'title', 'secret')
+
+
+# ---------------------------------------------------------------------------
+# Table methods
+# ---------------------------------------------------------------------------
+
+def test_get_rows_dict(truncate):
+    group = GroupTable.add({'name': 'admins'})
+    user = UserTable.add({'username': 'john', 'status': 'active', 'group_id': group.id})
+    row = UserTable.get(user.id, rows='dict')
+    assert row['username'] == 'john'
+    assert row['group'] == {'id': group.id, 'name': 'admins'}
+
+
+def test_all_rows_tuple(truncate):
+    GroupTable.add({'name': 'a'})
+    GroupTable.add({'name': 'b'})
+    assert [row[1] for row in GroupTable.all(rows='tuple')] == ['b', 'a']
+
+
+def test_filter_rows_namedtuple(truncate):
+    UserTable.add({'username': 'john', 'status': 'active'})
+    result = UserTable.filter(rows='namedtuple')
+    assert result.total == 1
+    assert result.items[0].username == 'john'
+    assert result.items[0].group.id is None
+
+
+def test_keyset_filter_rows_dict(truncate):
+    GroupTable.add({'name': 'a'})
+    result = GroupTable.filter(cursor=True, rows='dict')
+    assert result.items[0]['name'] == 'a'
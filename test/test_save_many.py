@@ -0,0 +1,69 @@
+import pytest
+import sql
+from conftest import UserTable, GroupTable, CategoryTable, ItemTable, UniqueItemTable
+
+
+def test_save_many_updates_rows(truncate):
+    a = UserTable.add({'username': 'a', 'fullname': 'A', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'fullname': 'B', 'status': 'active'})
+    result = UserTable.save_many({a.id: {'fullname': 'AA'}, b.id: {'fullname': 'BB'}})
+    assert result[a.id].fullname == 'AA'
+    assert result[b.id].fullname == 'BB'
+    assert UserTable.get(a.id).fullname == 'AA'
+    assert UserTable.get(a.id).username == 'a'
+
+
+def test_save_many_groups_different_field_sets(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'active'})
+    UserTable.statements.clear()
+    UserTable.save_many({a.id: {'fullname': 'AA'}, b.id: {'status': 'inactive', 'username': 'bb'}})
+    assert UserTable.statements.misses == 2
+    assert UserTable.get(a.id).fullname == 'AA'
+    fetched = UserTable.get(b.id)
+    assert fetched.status == 'inactive'
+    assert fetched.username == 'bb'
+
+
+def test_save_many_typed_columns(truncate):
+    group = GroupTable.add({'name': 'admins'})
+    user = UserTable.add({'username': 'a', 'status': 'active'})
+    item = ItemTable.add({'title': 'x', 'active': False})
+    category = CategoryTable.add({'name': {'en': 'a'}, 'tags': ['a']})
+    result = UserTable.save_many({user.id: {'group_id': group.id}})
+    assert result[user.id].group.name == 'admins'
+    ItemTable.save_many({item.id: {'active': True, 'created_at': '2024-01-02'}})
+    assert ItemTable.get(item.id).active is True
+    CategoryTable.save_many({category.id: {'name': {'en': 'b'}, 'tags': ['b', 'c']}})
+    fetched = CategoryTable.get(category.id)
+    assert fetched.name == {'en': 'b'}
+    assert fetched.tags == ['b', 'c']
+
+
+def test_save_many_honours_filter(truncate):
+    a = UserTable.add({'username': 'a', 'status': 'active'})
+    b = UserTable.add({'username': 'b', 'status': 'inactive'})
+    result = UserTable.save_many({a.id: {'fullname': 'AA'}, b.id: {'fullname': 'BB'}}, filter={'status': 'active'})
+    assert list(result) == [a.id]
+    assert UserTable.get(b.id).fullname is None
+
+
+def test_save_many_without_returning_returns_count(truncate):
+    a = ItemTable.add({'title': 'a'})
+    b = ItemTable.add({'title': 'b'})
+    assert ItemTable.save_many({a.id: {'title': 'x'}, b.id: {'title': 'y'}, 999: {'title': 'z'}}, returning=False) == 2
+
+
+def test_save_many_chunks(truncate):
+    items = ItemTable.add_many([{'title': str(n)} for n in range(7)])
+    result = ItemTable.save_many({item.id: {'title': 'n'+item.title} for item in items}, chunk_size=3)
+    assert len(result) == 7
+    assert all(item.title.startswith('n') for item in ItemTable.all())
+
+
+def test_save_many_rolls_back_on_error(truncate):
+    a = UniqueItemTable.add({'code': 'a'})
+    b = UniqueItemTable.add({'code': 'b'})
+    with pytest.raises(sql.UniqueError):
+        UniqueItemTable.save_many({a.id: {'code': 'c'}, b.id: {'code': 'c'}})
+    assert UniqueItemTable.get(a.id).code == 'a'
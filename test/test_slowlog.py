@@ -0,0 +1,89 @@
+import os
+import json
+import asyncio
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+@pytest.fixture
+def slowlog(db, monkeypatch):
+    slowlog = sql.SlowLog(threshold=0, size=3, interval=60)
+    monkeypatch.setattr(sql, 'slowlog', slowlog)
+    return slowlog
+
+
+def test_capture_with_plan(slowlog, truncate):
+    UserTable.add({'username': 'john'})
+    UserTable.filter(filter={'username': 'jo'})
+    item, = slowlog.dump()
+    assert item['table'] == 'test.users'
+    assert item['sql'].strip().startswith('SELECT')
+    assert item['params'] == ['%jo%', 100, 0]
+    assert item['duration'] >= 0
+    assert item['error'] is None
+    plan = item['plan'][0]
+    assert 'Plan' in plan
+    assert 'Actual Rows' in plan['Plan']
+    assert 'Shared Hit Blocks' in plan['Plan']
+
+
+def test_rate_limited_and_bounded(slowlog, truncate):
+    for _ in range(5):
+        UserTable.all()
+    items = slowlog.dump()
+    assert len(items) == 3
+    assert [item['plan'] is None for item in items] == [True, True, True]
+    slowlog.interval = 0
+    UserTable.all()
+    assert slowlog.dump()[-1]['plan'] is not None
+
+
+def test_only_all_and_filter(slowlog, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.get(user.id)
+    UserTable.save(user.id, {'username': 'johnny'})
+    assert slowlog.dump() == []
+
+
+def test_threshold(db, monkeypatch, truncate):
+    slowlog = sql.SlowLog(threshold=60)
+    monkeypatch.setattr(sql, 'slowlog', slowlog)
+    UserTable.all()
+    assert slowlog.dump() == []
+
+
+def test_redact_and_dump(slowlog, truncate, tmp_path):
+    slowlog.redact = True
+    UserTable.all(filter={'username': 'secret'})
+    path = tmp_path/'slow.json'
+    items = slowlog.dump(str(path))
+    assert items[0]['params'] == ['?']
+    assert items[0]['plan'] is not None
+    assert json.loads(path.read_text())[0]['params'] == ['?']
+    slowlog.clear()
+    assert slowlog.dump() == []
+
+
+def test_not_explained_in_transaction(db, slowlog, truncate):
+    with db.transaction():
+        UserTable.add({'username': 'john'})
+        UserTable.all()
+    item, = slowlog.dump()
+    assert item['plan'] is None
+    assert len(UserTable.all()) == 1
+
+
+def test_async(slowlog, monkeypatch, truncate):
+    pytest.importorskip('psycopg_pool')
+    monkeypatch.setattr(sql.Table, 'adb', None)
+    adb = sql.AsyncDb(os.environ['TEST_DSN'], size=2)
+    async def run():
+        try:
+            await UserTable.afilter()
+        finally:
+            await adb.close()
+    asyncio.run(run())
+    item, = slowlog.dump()
+    assert item['plan'][0]['Plan']['Actual Rows'] == 0
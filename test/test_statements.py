@@ -0,0 +1,117 @@
+import threading
+import sql
+from conftest import UserTable, ItemTable, GroupTable
+
+
+# ---------------------------------------------------------------------------
+# Statements / shape (no database)
+# ---------------------------------------------------------------------------
+
+def test_statements_counts_hits_and_misses():
+    cache = sql.Statements()
+    assert cache.get('k') is None
+    cache.set('k', 'SELECT 1')
+    assert cache.get('k') == 'SELECT 1'
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+
+def test_statements_bounded_size():
+    cache = sql.Statements(size=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.set('c', '3')
+    assert len(cache.items) == 2
+    assert 'a' not in cache.items
+
+
+def test_statements_threads():
+    cache = sql.Statements(size=8)
+
+    def work(number):
+        for position in range(2000):
+            key = (number, position % 16)
+            if cache.get(key) is None:
+                cache.set(key, 'SELECT 1')
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache.items) == 8
+    assert cache.hits+cache.misses == 8*2000
+
+
+def test_where_shape_ignores_values():
+    assert UserTable.where({'username': 'a'}).shape() == UserTable.where({'username': 'b'}).shape()
+
+
+def test_where_shape_depends_on_in_list_length():
+    one = UserTable.where({'id': [1, 2]}).shape()
+    two = UserTable.where({'id': [3, 4, 5]}).shape()
+    assert one != two
+
+
+def test_where_shape_depends_on_separator():
+    assert UserTable.where({'username': 'a'}).shape() != UserTable.where({'username': 'a'}, 'OR').shape()
+
+
+def test_compile_resets_statements():
+    class Temp(sql.Table):
+        name = 'temp'
+        fields = {'id': {'type': 'int'}}
+    Temp.statements.set('k', 'SELECT 1')
+    Temp.fields = {'id': {'type': 'int'}, 'title': {}}
+    assert Temp.statements.items == {}
+
+
+def test_compile_resets_joining_tables(truncate, monkeypatch):
+    group = GroupTable.add({'name': 'admins'})
+    user = UserTable.add({'username': 'john', 'group_id': group.id})
+    assert UserTable.get(user.id).group.name == 'admins'
+    monkeypatch.setattr(GroupTable, 'fields', dict(GroupTable.fields, label={'field': 'name'}))
+    assert UserTable.get(user.id).group.label == 'admins'
+    assert UserTable in GroupTable.joining() and GroupTable not in UserTable.joining()
+
+
+# ---------------------------------------------------------------------------
+# Cached sql reused across calls
+# ---------------------------------------------------------------------------
+
+def test_repeated_get_hits_cache(truncate):
+    user = UserTable.add({'username': 'john', 'fullname': 'John', 'status': 'active'})
+    UserTable.statements.clear()
+    UserTable.get(user.id)
+    fetched = UserTable.get(user.id)
+    assert fetched.username == 'john'
+    assert UserTable.statements.misses == 1
+    assert UserTable.statements.hits == 1
+
+
+def test_different_filter_shape_misses(truncate):
+    UserTable.statements.clear()
+    UserTable.all(filter={'status': 'active'})
+    UserTable.all(filter={'username': 'john'})
+    assert UserTable.statements.misses == 2
+    assert UserTable.statements.hits == 0
+
+
+def test_all_limit_bound_as_param(truncate):
+    for title in ['a', 'b', 'c']:
+        ItemTable.add({'title': title})
+    ItemTable.statements.clear()
+    assert len(ItemTable.all(limit=1)) == 1
+    assert len(ItemTable.all(limit=2)) == 2
+    assert ItemTable.statements.hits == 1
+
+
+def test_filter_cached_with_new_params(truncate):
+    for title in ['a', 'b', 'c']:
+        ItemTable.add({'title': title})
+    ItemTable.statements.clear()
+    first = ItemTable.filter(filter={'title': 'a'})
+    second = ItemTable.filter(filter={'title': 'b'})
+    assert first.items[0].title == 'a'
+    assert second.items[0].title == 'b'
+    assert ItemTable.statements.hits == 1
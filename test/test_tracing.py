@@ -0,0 +1,87 @@
+import os
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+@pytest.fixture
+def spans(db, monkeypatch):
+    tracer = sql.Spans(comment=True)
+    monkeypatch.setattr(sql, 'tracer', tracer)
+    return tracer
+
+
+def test_spans(spans, truncate):
+    user = UserTable.add({'username': 'john'})
+    UserTable.get(user.id)
+    UserTable.filter(count='estimate')
+    add, get, filter, estimate = list(spans.spans)[:4]
+    assert (add.table, add.operation, add.rowcount, add.error) == ('test.users', 'add', 1, None)
+    assert (get.operation, get.params) == ('get', [user.id])
+    assert filter.operation == estimate.operation == 'filter'
+    assert estimate.query.startswith('SELECT reltuples')
+    assert get.caller == 'test_tracing:test_spans'
+    assert get.duration > 0
+    assert '/*' not in get.query
+
+
+def test_before_and_error(db, monkeypatch):
+    seen = []
+    class Tracer(sql.Tracer):
+        def before(self, span):
+            seen.append(('before', span.query, span.duration))
+        def after(self, span):
+            seen.append(('after', span.query, type(span.error)))
+    monkeypatch.setattr(sql, 'tracer', Tracer())
+    with pytest.raises(Exception):
+        sql.query('SELECT missing_column')
+    assert seen[0] == ('before', 'SELECT missing_column', None)
+    assert seen[1][0] == 'after'
+    assert issubclass(seen[1][2], Exception)
+
+
+def test_comment(spans, truncate):
+    token = sql.TRACE.set('abc-1')
+    try:
+        text = sql.query('SELECT current_query()')[0][0]
+        assert text == "SELECT current_query() /*caller='test_tracing%3Atest_comment',operation='query',trace_id='abc-1'*/"
+        user = UserTable.add({'username': '100%'})
+        assert UserTable.get(user.id).username == '100%'
+        assert sql.query('SELECT current_query() WHERE 1 = %s', [1])[0][0].endswith("trace_id='abc-1'*/")
+    finally:
+        sql.TRACE.reset(token)
+    assert not any('/*' in span.query for span in spans.spans)
+    assert all('/*' not in query for query in UserTable.statements.items.values())
+
+
+def test_comment_prepared(spans, truncate, monkeypatch):
+    database = sql.Db(os.environ['TEST_DSN'], size=1, prepare=2)
+    monkeypatch.setattr(UserTable, 'db', database)
+    try:
+        user = UserTable.add({'username': 'john'})
+        for trace in ('a', 'b'):
+            token = sql.TRACE.set(trace)
+            try:
+                assert UserTable.get(user.id).username == 'john'
+            finally:
+                sql.TRACE.reset(token)
+        conn = database.get()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT statement FROM pg_prepared_statements')
+            statements = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+        finally:
+            database.put(conn)
+        assert len(statements) == 2
+        assert not any('/*' in statement for statement in statements)
+    finally:
+        database.pool.closeall()
+
+
+def test_disabled_by_default(db, monkeypatch):
+    assert sql.tracer is None
+    monkeypatch.setattr(sql, 'tracer', sql.Spans())
+    assert sql.query('SELECT current_query()')[0][0] == 'SELECT current_query()'
+    assert len(sql.tracer.spans) == 1
@@ -0,0 +1,105 @@
+import threading
+import pytest
+import sql
+
+from conftest import UserTable
+
+
+def backend(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT pg_backend_pid()')
+    return cursor.fetchone()[0]
+
+
+def test_commits_at_exit(db, truncate):
+    with db.transaction() as scope:
+        user = UserTable.add({'username': 'john'})
+        UserTable.save(user.id, {'fullname': 'John'})
+        assert UserTable.get(user.id).fullname == 'John'
+        assert sql.query('SELECT COUNT(*) FROM test.users')[0][0] == 1
+        conn = db.pool.getconn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM test.users')
+            assert cursor.fetchone()[0] == 0
+            conn.rollback()
+        finally:
+            db.pool.putconn(conn)
+    assert scope.conn.autocommit is False
+    assert UserTable.get(user.id).fullname == 'John'
+
+
+def test_rolls_back_on_error(db, truncate):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            UserTable.add({'username': 'john'})
+            raise RuntimeError()
+    assert UserTable.all() == []
+
+
+def test_one_connection(db, truncate):
+    with db.transaction() as scope:
+        assert db.get() is scope.conn
+        db.put(scope.conn)
+        assert db.get(read=True) is scope.conn
+        pid = backend(scope.conn)
+        assert sql.query('SELECT pg_backend_pid()')[0][0] == pid
+        assert list(UserTable.iter()) == []
+    assert db.scope.get() is None
+
+
+def test_nested_savepoint(db, truncate):
+    with db.transaction():
+        UserTable.add({'username': 'outer'})
+        with pytest.raises(sql.UniqueError):
+            with db.transaction():
+                UserTable.add({'username': 'inner'})
+                sql.query('CREATE UNIQUE INDEX users_unique_username_index ON test.users (username)')
+                UserTable.add({'username': 'inner'})
+        with db.transaction():
+            UserTable.add({'username': 'second'})
+    assert sorted(user.username for user in UserTable.all()) == ['outer', 'second']
+    assert sql.query("SELECT COUNT(*) FROM pg_indexes WHERE indexname = 'users_unique_username_index'")[0][0] == 0
+
+
+def test_readonly_autocommit(db, truncate):
+    UserTable.add({'username': 'john'})
+    with db.transaction(readonly=True) as scope:
+        assert scope.conn.autocommit
+        assert UserTable.all()[0].username == 'john'
+        assert [user.username for user in UserTable.iter(itersize=1)] == ['john']
+        assert sql.query('SHOW transaction_read_only')[0][0] == 'on'
+        with pytest.raises(Exception):
+            UserTable.add({'username': 'jane'})
+    assert scope.conn.autocommit is False
+    assert scope.conn.readonly is None
+    assert len(UserTable.all()) == 1
+    UserTable.add({'username': 'jane'})
+
+
+def test_isolation(db, truncate):
+    with db.transaction(isolation='REPEATABLE READ', readonly=True) as scope:
+        assert not scope.conn.autocommit
+        assert sql.query('SHOW transaction_isolation')[0][0] == 'repeatable read'
+        assert sql.query('SHOW transaction_read_only')[0][0] == 'on'
+        before = len(UserTable.all())
+        conn = db.pool.getconn()
+        try:
+            conn.cursor().execute("INSERT INTO test.users (username) VALUES ('other')")
+            conn.commit()
+        finally:
+            db.pool.putconn(conn)
+        assert len(UserTable.all()) == before
+    assert scope.conn.isolation_level is None
+    assert len(UserTable.all()) == before+1
+
+
+def test_scope_is_per_thread(db, truncate):
+    seen = []
+    with db.transaction() as scope:
+        UserTable.add({'username': 'john'})
+        thread = threading.Thread(target=lambda: seen.append((db.scope.get(), len(UserTable.all()))))
+        thread.start()
+        thread.join()
+    assert seen == [(None, 0)]
+    assert len(UserTable.all()) == 1